@@ -0,0 +1,248 @@
+"""Брокер событий для Server-Sent Events.
+
+Подписчик — открытое SSE-соединение — получает события своих каналов
+через ограниченную очередь. Отстающее соединение не копит события без
+конца: при переполнении очереди оно получает событие OVERFLOW и
+закрывается, а клиент перечитывает данные обычным запросом.
+
+Каждое соединение держит поток воркера, поэтому число подписчиков в
+процессе ограничено EVENTS_MAX_CONNECTIONS.
+
+Между процессами события идут через журнал в файле SQLite
+(EVENTS_LOG_PATH) — так же, как общий кэш: publish дописывает строку
+(и раз в LOG_TTL удаляет устаревшие), а фоновый поток каждого процесса
+с подписчиками читает новые строки и раздаёт их своим подписчикам. Без
+EVENTS_LOG_PATH брокер работает только внутри процесса.
+"""
+import json
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# Событие, после которого подписка закрыта: очередь переполнилась.
+OVERFLOW = object()
+
+BUSY_TIMEOUT = 5
+# Сколько секунд хранить строки журнала.
+LOG_TTL = 60
+LOG_BATCH = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    channel TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_created ON events (created);
+"""
+
+
+class TooManySubscribers(Exception):
+    pass
+
+
+class Subscription:
+    """Очередь событий одного соединения."""
+
+    def __init__(self, broker, channels, size):
+        self.broker = broker
+        self.channels = frozenset(channels)
+        self.queue = queue.Queue(size)
+        self.closed = False
+
+    def put(self, event):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except queue.Full:
+            # Место для OVERFLOW освобождаем, выбросив старое событие:
+            # после него подписка всё равно закрывается.
+            self.close()
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+            self.queue.put_nowait(OVERFLOW)
+
+    def get(self, timeout):
+        """Следующее событие (id, канал, данные), OVERFLOW или None."""
+        try:
+            return self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.broker.unsubscribe(self)
+
+
+class SQLiteLog:
+    """Журнал событий в файле SQLite, общий для процессов."""
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._trimmed = time.monotonic()
+
+    @property
+    def connection(self):
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            local.connection = sqlite3.connect(
+                self.path, timeout=BUSY_TIMEOUT, isolation_level=None
+            )
+            local.connection.execute('PRAGMA journal_mode=WAL')
+            local.connection.execute('PRAGMA synchronous=NORMAL')
+            local.connection.executescript(SCHEMA)
+            local.pid = os.getpid()
+        return local.connection
+
+    def append(self, channel, data):
+        self.connection.execute(
+            'INSERT INTO events (channel, data, created) VALUES (?, ?, ?)',
+            (channel, data, time.time()),
+        )
+        # Старые строки удаляет тот, кто пишет: у процесса может не быть
+        # ни одного подписчика, а журнал расти не должен.
+        if time.monotonic() - self._trimmed > LOG_TTL:
+            self._trimmed = time.monotonic()
+            self.trim()
+
+    def last_id(self):
+        (last_id,) = self.connection.execute(
+            'SELECT COALESCE(MAX(id), 0) FROM events'
+        ).fetchone()
+        return last_id
+
+    def read_after(self, last_id):
+        return self.connection.execute(
+            'SELECT id, channel, data FROM events WHERE id > ? '
+            'ORDER BY id LIMIT ?',
+            (last_id, LOG_BATCH),
+        ).fetchall()
+
+    def trim(self):
+        self.connection.execute(
+            'DELETE FROM events WHERE created < ?', (time.time() - LOG_TTL,)
+        )
+
+
+class Broker:
+    """Издатель-подписчик событий по каналам."""
+
+    def __init__(self, max_subscribers, queue_size, log=None,
+                 poll_interval=0.2):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self.log = log
+        self.poll_interval = poll_interval
+        self._channels = defaultdict(set)
+        self._count = 0
+        self._lock = threading.Lock()
+        self._sequence = 0
+        self._relay = None
+
+    def subscribe(self, channels):
+        """Новая подписка на channels или TooManySubscribers."""
+        with self._lock:
+            if self._count >= self.max_subscribers:
+                raise TooManySubscribers
+            subscription = Subscription(self, channels, self.queue_size)
+            for channel in subscription.channels:
+                self._channels[channel].add(subscription)
+            self._count += 1
+            if self.log is not None and self._relay is None:
+                self._start_relay()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            for channel in subscription.channels:
+                subscribers = self._channels.get(channel)
+                if subscribers and subscription in subscribers:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._channels[channel]
+            self._count -= 1
+
+    def subscribers(self):
+        with self._lock:
+            return self._count
+
+    def publish(self, channel, data):
+        """Отправляет data (объект JSON) подписчикам канала."""
+        data = json.dumps(data, ensure_ascii=False)
+        if self.log is not None:
+            self.log.append(channel, data)
+            return
+        with self._lock:
+            self._sequence += 1
+            event_id = self._sequence
+        self.dispatch(event_id, channel, data)
+
+    def dispatch(self, event_id, channel, data):
+        with self._lock:
+            subscribers = list(self._channels.get(channel, ()))
+        for subscription in subscribers:
+            subscription.put((event_id, channel, data))
+
+    def _start_relay(self):
+        # Вызывается под self._lock: поток журнала запускается и решает
+        # завершиться под той же блокировкой, поэтому подписка не может
+        # застать уже завершающийся поток.
+        self._relay = threading.Thread(
+            target=self._run_relay, name='events-relay', daemon=True
+        )
+        self._relay.start()
+
+    def _run_relay(self):
+        try:
+            last_id = self.log.last_id()
+            while True:
+                with self._lock:
+                    if not self._count:
+                        self._relay = None
+                        return
+                time.sleep(self.poll_interval)
+                for event_id, channel, data in self.log.read_after(last_id):
+                    self.dispatch(event_id, channel, data)
+                    last_id = event_id
+        except BaseException:
+            # Следующая подписка запустит поток заново.
+            with self._lock:
+                self._relay = None
+            raise
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    global _broker
+    with _broker_lock:
+        if _broker is None:
+            path = settings.EVENTS_LOG_PATH
+            _broker = Broker(
+                settings.EVENTS_MAX_CONNECTIONS,
+                settings.EVENTS_QUEUE_SIZE,
+                SQLiteLog(path) if path else None,
+            )
+        return _broker
+
+
+@receiver(setting_changed)
+def reset_broker(setting, **kwargs):
+    global _broker
+    if setting.startswith('EVENTS_'):
+        _broker = None
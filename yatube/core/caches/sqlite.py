@@ -0,0 +1,303 @@
+"""Кэш в файле SQLite, общий для всех процессов одного сервера.
+
+LocMemCache у каждого воркера свой: сброс поколения в одном процессе не
+виден остальным, а память умножается на число воркеров. Этот бэкенд
+хранит записи в одном файле SQLite в режиме WAL: читатели не блокируют
+писателя, add и incr атомарны между процессами, а суммарный размер
+записей ограничен MAX_BYTES с вытеснением давно не читанных записей.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.caches.sqlite.SQLiteCache',
+            'LOCATION': '/var/tmp/yatube-cache.sqlite3',
+            'OPTIONS': {'MAX_BYTES': 256 * 1024 * 1024},
+        }
+    }
+"""
+import os
+import pickle
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+# При переполнении кэш ужимается до этой доли бюджета, чтобы не
+# вытеснять записи на каждой следующей вставке.
+CULL_TARGET = 0.9
+# Время последнего чтения обновляется не чаще раза в столько секунд:
+# так горячие ключи не превращают каждое чтение в запись.
+ACCESS_RESOLUTION = 1
+# Накладные расходы SQLite на строку, учитываемые в размере записи.
+ROW_OVERHEAD = 64
+BUSY_TIMEOUT = 5
+MAX_VARIABLES = 999
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache_entries (
+    key TEXT PRIMARY KEY,
+    value BLOB NOT NULL,
+    expires REAL,
+    accessed REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS cache_entries_accessed
+    ON cache_entries (accessed);
+CREATE INDEX IF NOT EXISTS cache_entries_expires ON cache_entries (expires);
+CREATE TABLE IF NOT EXISTS cache_size (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    bytes INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO cache_size VALUES (0, 0);
+CREATE TRIGGER IF NOT EXISTS cache_entries_inserted
+    AFTER INSERT ON cache_entries
+BEGIN
+    UPDATE cache_size SET bytes = bytes + NEW.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_updated
+    AFTER UPDATE OF size ON cache_entries
+BEGIN
+    UPDATE cache_size SET bytes = bytes + NEW.size - OLD.size;
+END;
+CREATE TRIGGER IF NOT EXISTS cache_entries_deleted
+    AFTER DELETE ON cache_entries
+BEGIN
+    UPDATE cache_size SET bytes = bytes - OLD.size;
+END;
+"""
+
+UPSERT = """
+INSERT INTO cache_entries (key, value, expires, accessed, size)
+VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (key) DO UPDATE SET
+    value = excluded.value,
+    expires = excluded.expires,
+    accessed = excluded.accessed,
+    size = excluded.size
+"""
+
+# add перезаписывает только истёкшую запись.
+INSERT_IF_EXPIRED = UPSERT + """
+WHERE cache_entries.expires IS NOT NULL
+    AND cache_entries.expires <= excluded.accessed
+"""
+
+CULL = """
+DELETE FROM cache_entries WHERE key IN (
+    SELECT key FROM (
+        SELECT key, size,
+            SUM(size) OVER (ORDER BY accessed, key) AS running
+        FROM cache_entries
+    )
+    WHERE running - size < ?
+)
+"""
+
+
+def _chunks(items, size=MAX_VARIABLES):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class SQLiteCache(BaseCache):
+    """Общий для процессов кэш с TTL и LRU-бюджетом в байтах."""
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._path = location
+        self._max_bytes = options.get('MAX_BYTES', DEFAULT_MAX_BYTES)
+        self._connection = None
+        self._pid = None
+
+    @property
+    def connection(self):
+        # Соединение SQLite нельзя наследовать при fork: каждый процесс
+        # открывает своё.
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = self._connect()
+            self._pid = os.getpid()
+        return self._connection
+
+    def _connect(self):
+        connection = sqlite3.connect(
+            self._path, timeout=BUSY_TIMEOUT, isolation_level=None,
+            check_same_thread=False,
+        )
+        connection.execute('PRAGMA journal_mode=WAL')
+        connection.execute('PRAGMA synchronous=NORMAL')
+        connection.executescript(SCHEMA)
+        return connection
+
+    @contextmanager
+    def _write(self):
+        """Транзакция, сразу берущая блокировку записи."""
+        connection = self.connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield connection
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def _make_key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _row(self, key, value, timeout, now):
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        expires = self.get_backend_timeout(timeout)
+        size = len(data) + len(key) + ROW_OVERHEAD
+        return key, data, expires, now, size
+
+    def _cull(self, connection, now):
+        (total,) = connection.execute(
+            'SELECT bytes FROM cache_size'
+        ).fetchone()
+        if total <= self._max_bytes:
+            return
+        connection.execute(
+            'DELETE FROM cache_entries WHERE expires <= ?', (now,)
+        )
+        (total,) = connection.execute(
+            'SELECT bytes FROM cache_size'
+        ).fetchone()
+        excess = total - self._max_bytes * CULL_TARGET
+        if excess > 0:
+            connection.execute(CULL, (excess,))
+
+    def _touch_accessed(self, connection, rows, now):
+        stale = [
+            (now, key) for key, accessed in rows
+            if now - accessed > ACCESS_RESOLUTION
+        ]
+        if stale:
+            connection.executemany(
+                'UPDATE cache_entries SET accessed = ? WHERE key = ?', stale
+            )
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            added = connection.execute(
+                INSERT_IF_EXPIRED, self._row(key, value, timeout, now)
+            ).rowcount > 0
+            if added:
+                self._cull(connection, now)
+        return added
+
+    def get(self, key, default=None, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+        row = self.connection.execute(
+            'SELECT value, expires, accessed FROM cache_entries '
+            'WHERE key = ?', (key,)
+        ).fetchone()
+        if row is None:
+            return default
+        value, expires, accessed = row
+        if expires is not None and expires <= now:
+            return default
+        self._touch_accessed(self.connection, [(key, accessed)], now)
+        return pickle.loads(value)
+
+    def get_many(self, keys, version=None):
+        made = {self._make_key(key, version): key for key in keys}
+        now = time.time()
+        found = {}
+        accessed = []
+        for chunk in _chunks(list(made)):
+            rows = self.connection.execute(
+                'SELECT key, value, accessed FROM cache_entries '
+                'WHERE (expires IS NULL OR expires > ?) AND key IN (%s)'
+                % ', '.join('?' * len(chunk)),
+                [now, *chunk],
+            )
+            for key, value, last_access in rows:
+                found[made[key]] = pickle.loads(value)
+                accessed.append((key, last_access))
+        self._touch_accessed(self.connection, accessed, now)
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            connection.execute(UPSERT, self._row(key, value, timeout, now))
+            self._cull(connection, now)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        now = time.time()
+        rows = [
+            self._row(self._make_key(key, version), value, timeout, now)
+            for key, value in data.items()
+        ]
+        with self._write() as connection:
+            connection.executemany(UPSERT, rows)
+            self._cull(connection, now)
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._make_key(key, version)
+        return self.connection.execute(
+            'UPDATE cache_entries SET expires = ? '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), key, time.time()),
+        ).rowcount > 0
+
+    def incr(self, key, delta=1, version=None):
+        key = self._make_key(key, version)
+        now = time.time()
+        with self._write() as connection:
+            row = connection.execute(
+                'SELECT value FROM cache_entries '
+                'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                (key, now),
+            ).fetchone()
+            if row is None:
+                raise ValueError("Key '%s' not found" % key)
+            value = pickle.loads(row[0]) + delta
+            data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            connection.execute(
+                'UPDATE cache_entries SET value = ?, accessed = ?, size = ? '
+                'WHERE key = ?',
+                (data, now, len(data) + len(key) + ROW_OVERHEAD, key),
+            )
+        return value
+
+    def has_key(self, key, version=None):
+        key = self._make_key(key, version)
+        return self.connection.execute(
+            'SELECT 1 FROM cache_entries '
+            'WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (key, time.time()),
+        ).fetchone() is not None
+
+    def delete(self, key, version=None):
+        key = self._make_key(key, version)
+        return self.connection.execute(
+            'DELETE FROM cache_entries WHERE key = ?', (key,)
+        ).rowcount > 0
+
+    def delete_many(self, keys, version=None):
+        made = [self._make_key(key, version) for key in keys]
+        with self._write() as connection:
+            for chunk in _chunks(made):
+                connection.execute(
+                    'DELETE FROM cache_entries WHERE key IN (%s)'
+                    % ', '.join('?' * len(chunk)),
+                    chunk,
+                )
+
+    def clear(self):
+        self.connection.execute('DELETE FROM cache_entries')
+
+    def size(self):
+        """Суммарный размер записей в байтах."""
+        return self.connection.execute(
+            'SELECT bytes FROM cache_size'
+        ).fetchone()[0]
@@ -0,0 +1,236 @@
+"""Двухуровневый кэш: LRU в памяти процесса перед общим кэшем.
+
+Крупные значения (отрисованные страницы) держатся в памяти процесса,
+чтобы не читать их каждый раз из общего кэша. Рядом с таким значением
+в общем кэше лежит его короткая метка версии: попадание в L1 считается
+действительным, только пока метка в L2 совпадает с меткой в L1, поэтому
+запись или удаление в любом процессе сразу делают копии в L1 остальных
+процессов устаревшими. Мелкие значения (поколения, счётчики,
+блокировки) хранятся только в L2: проверка метки стоила бы столько же,
+сколько само чтение.
+
+    CACHES = {
+        'default': {
+            'BACKEND': 'core.caches.tiered.TieredCache',
+            'LOCATION': 'default',
+            'OPTIONS': {'L2': 'shared', 'MAX_BYTES': 32 * 1024 * 1024},
+        },
+        'shared': {...},
+    }
+"""
+import pickle
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from threading import Lock
+
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+DEFAULT_MAX_BYTES = 32 * 1024 * 1024
+# Значения меньше этого размера в L1 не попадают.
+DEFAULT_MIN_BYTES = 1024
+
+# Значение, закэшированное в обоих уровнях, как оно лежит в L2.
+Versioned = namedtuple('Versioned', 'token expires data')
+
+_stores = {}
+_stores_lock = Lock()
+
+
+def _token_key(key):
+    return f'{key}:l1-token'
+
+
+class LRUStore:
+    """Хранилище L1 процесса с бюджетом в байтах и вытеснением LRU."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.entries = OrderedDict()
+        self.lock = Lock()
+        self.stats = dict.fromkeys(
+            ('l1_hits', 'l1_stale', 'l1_evictions', 'l2_hits', 'l2_misses'),
+            0,
+        )
+
+    def count(self, event, amount=1):
+        with self.lock:
+            self.stats[event] += amount
+
+    def get(self, key, now):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires is not None and entry.expires <= now:
+                self._pop(key)
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self._pop(key)
+            if len(entry.data) > self.max_bytes:
+                return
+            self.entries[key] = entry
+            self.size += len(entry.data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted.data)
+                self.stats['l1_evictions'] += 1
+
+    def pop(self, key):
+        with self.lock:
+            self._pop(key)
+
+    def _pop(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.data)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.stats,
+                'l1_entries': len(self.entries),
+                'l1_bytes': self.size,
+                'l1_max_bytes': self.max_bytes,
+            }
+
+
+class TieredCache(BaseCache):
+    """L1 в памяти процесса поверх кэша из OPTIONS['L2']."""
+
+    def __init__(self, name, params):
+        super().__init__(params)
+        options = params.get('OPTIONS', {})
+        self._l2_alias = options['L2']
+        self._min_bytes = options.get('MIN_BYTES', DEFAULT_MIN_BYTES)
+        with _stores_lock:
+            self._l1 = _stores.setdefault(
+                name, LRUStore(options.get('MAX_BYTES', DEFAULT_MAX_BYTES))
+            )
+
+    @property
+    def l2(self):
+        return caches[self._l2_alias]
+
+    def _l1_key(self, key, version):
+        return self.l2.make_key(key, version=version)
+
+    def _prepare(self, key, value, timeout, version):
+        """Значения для L2 и запись для L1 (None для мелких значений)."""
+        data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        if len(data) < self._min_bytes:
+            return {key: value}, None
+        entry = Versioned(
+            uuid.uuid4().hex, self.get_backend_timeout(timeout), data
+        )
+        return {key: entry, _token_key(key): entry.token}, entry
+
+    def _unwrap(self, key, value, version):
+        if not isinstance(value, Versioned):
+            return value
+        self._l1.put(self._l1_key(key, version), value)
+        return pickle.loads(value.data)
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        values, entry = self._prepare(key, value, timeout, version)
+        if not self.l2.add(key, values.pop(key), timeout, version):
+            return False
+        if entry is not None:
+            self.l2.set_many(values, timeout, version)
+            self._l1.put(self._l1_key(key, version), entry)
+        return True
+
+    def get(self, key, default=None, version=None):
+        return self.get_many([key], version).get(key, default)
+
+    def get_many(self, keys, version=None):
+        now = time.time()
+        found = {}
+        cached = {}
+        for key in keys:
+            entry = self._l1.get(self._l1_key(key, version), now)
+            if entry is not None:
+                cached[key] = entry
+        if cached:
+            tokens = self.l2.get_many(
+                [_token_key(key) for key in cached], version
+            )
+            for key, entry in cached.items():
+                if tokens.get(_token_key(key)) == entry.token:
+                    found[key] = pickle.loads(entry.data)
+                else:
+                    self._l1.pop(self._l1_key(key, version))
+                    self._l1.count('l1_stale')
+            self._l1.count('l1_hits', len(found))
+        missing = [key for key in keys if key not in found]
+        if missing:
+            values = self.l2.get_many(missing, version)
+            for key, value in values.items():
+                found[key] = self._unwrap(key, value, version)
+            self._l1.count('l2_hits', len(values))
+            self._l1.count('l2_misses', len(missing) - len(values))
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        self.set_many({key: value}, timeout, version)
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        values = {}
+        stale = []
+        for key, value in data.items():
+            prepared, entry = self._prepare(key, value, timeout, version)
+            values.update(prepared)
+            if entry is None:
+                # Мелкое значение заменяет крупное: старая метка не должна
+                # подтверждать копии в L1.
+                stale.append(_token_key(key))
+                self._l1.pop(self._l1_key(key, version))
+            else:
+                self._l1.put(self._l1_key(key, version), entry)
+        if stale:
+            self.l2.delete_many(stale, version)
+        return self.l2.set_many(values, timeout, version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        self._l1.pop(self._l1_key(key, version))
+        self.l2.touch(_token_key(key), timeout, version)
+        return self.l2.touch(key, timeout, version)
+
+    def incr(self, key, delta=1, version=None):
+        # Числа мельче MIN_BYTES и лежат только в L2.
+        return self.l2.incr(key, delta, version)
+
+    def has_key(self, key, version=None):
+        return self.l2.has_key(key, version)
+
+    def delete(self, key, version=None):
+        self._l1.pop(self._l1_key(key, version))
+        self.l2.delete(_token_key(key), version)
+        return self.l2.delete(key, version)
+
+    def delete_many(self, keys, version=None):
+        keys = list(keys)
+        for key in keys:
+            self._l1.pop(self._l1_key(key, version))
+        self.l2.delete_many(
+            keys + [_token_key(key) for key in keys], version
+        )
+
+    def clear(self):
+        self._l1.clear()
+        self.l2.clear()
+
+    def stats(self):
+        """Попадания и промахи по уровням в этом процессе."""
+        return self._l1.snapshot()
@@ -0,0 +1,45 @@
+from functools import wraps
+
+from django.conf import settings
+from django.db import connection
+
+TRANSACTION_STATEMENTS = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO'
+)
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов, чем ему разрешено."""
+
+
+def query_budget(limit, ignore_tables=()):
+    """Ограничивает число SQL-запросов, которое делает представление.
+
+    Проверка включается настройкой ENFORCE_QUERY_BUDGETS (в DEBUG и
+    тестах): превышение бюджета поднимает QueryBudgetExceeded. Запросы
+    к таблицам из ignore_tables в бюджет не входят.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            if not settings.ENFORCE_QUERY_BUDGETS:
+                return view(request, *args, **kwargs)
+            queries = []
+
+            def count(execute, sql, params, many, context):
+                if not sql.startswith(TRANSACTION_STATEMENTS) and not any(
+                    table in sql for table in ignore_tables
+                ):
+                    queries.append(sql)
+                return execute(sql, params, many, context)
+
+            with connection.execute_wrapper(count):
+                response = view(request, *args, **kwargs)
+            if len(queries) > limit:
+                raise QueryBudgetExceeded(
+                    f'{view.__name__}: {len(queries)} запросов '
+                    f'при бюджете {limit}:\n' + '\n'.join(queries)
+                )
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,194 @@
+"""Кэш страниц с отдачей устаревшей версии и одиночным пересчётом.
+
+В отличие от cache_page, истёкшая страница не пропадает из кэша сразу:
+её ещё stale_timeout секунд отдают всем запросам, пока один воркер под
+блокировкой в кэше пересчитывает новую версию. Незадолго до истечения
+страница с растущей вероятностью пересчитывается заранее (XFetch),
+чтобы одновременные промахи не обрушивались на базу разом.
+
+Ключ страницы не зависит от пользователя (Vary: Cookie добавляет
+SessionMiddleware уже после кэша), поэтому в кэш попадают только
+страницы запросов без сессии: вошедший пользователь или посетитель с
+данными в сессии получает страницу мимо кэша.
+"""
+import hashlib
+import math
+import random
+import threading
+import time
+from collections import Counter, defaultdict
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.cache import (get_cache_key, has_vary_header,
+                                learn_cache_key, patch_cache_control)
+
+EVENTS = ('hit', 'miss', 'stale', 'refresh', 'early_refresh', 'wait')
+LOCK_TIMEOUT = 30
+LOCK_WAIT = 2
+LOCK_POLL_INTERVAL = 0.05
+
+_registry = set()
+_stats = defaultdict(Counter)
+_stats_lock = threading.Lock()
+
+
+def record(name, event):
+    # Счётчики в памяти процесса: запись в общий кэш на каждый запрос
+    # выстраивала бы воркеры в очередь за блокировкой файла кэша.
+    with _stats_lock:
+        _stats[name][event] += 1
+
+
+def get_stats():
+    """Возвращает {представление: {событие: количество}} этого процесса."""
+    with _stats_lock:
+        return {
+            name: {event: _stats[name][event] for event in EVENTS}
+            for name in _registry
+        }
+
+
+def _lock_key(request, key_prefix):
+    url = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'page-cache-lock:{key_prefix}:{url}'
+
+
+def _is_personal(request):
+    """Может ли страница запроса отличаться от страницы анонима."""
+    if settings.SESSION_COOKIE_NAME in request.COOKIES:
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_authenticated
+
+
+def _is_cacheable(request, response):
+    if response.streaming or response.status_code != 200:
+        return False
+    session = getattr(request, 'session', None)
+    if session is not None and not session.is_empty():
+        # Представление положило что-то в сессию: например, сообщение.
+        return False
+    if (
+        not request.COOKIES and response.cookies
+        and has_vary_header(response, 'Cookie')
+    ):
+        return False
+    return 'private' not in response.get('Cache-Control', ())
+
+
+class StaleWhileRevalidate:
+    """Обёртка представления, реализующая cache_page_swr."""
+
+    def __init__(self, view, timeout, key_prefix, stale_timeout, beta, name):
+        self.view = view
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.stale_timeout = stale_timeout
+        self.beta = beta
+        self.name = name
+        _registry.add(name)
+
+    def __call__(self, request, *args, **kwargs):
+        if request.method not in ('GET', 'HEAD') or _is_personal(request):
+            return self.view(request, *args, **kwargs)
+        prefix = self.key_prefix
+        if callable(prefix):
+            prefix = prefix(*args, **kwargs)
+        entry = self.lookup(request, prefix)
+        lock_key = _lock_key(request, prefix)
+        if entry is None:
+            record(self.name, 'miss')
+            if cache.add(lock_key, 1, LOCK_TIMEOUT):
+                return self.recompute(request, args, kwargs, prefix, lock_key)
+            return self.wait_or_compute(request, args, kwargs, prefix)
+        response, fresh_until, compute_time = entry
+        now = time.time()
+        expired = now >= fresh_until
+        # XFetch: log(random) < 0, и чем ближе истечение и дороже
+        # пересчёт, тем вероятнее обновить страницу заранее.
+        refresh_at = fresh_until + compute_time * self.beta * math.log(
+            random.random() or 1e-12
+        )
+        if now < refresh_at:
+            record(self.name, 'hit')
+            return response
+        if cache.add(lock_key, 1, LOCK_TIMEOUT):
+            record(self.name, 'refresh' if expired else 'early_refresh')
+            return self.recompute(request, args, kwargs, prefix, lock_key)
+        record(self.name, 'stale' if expired else 'hit')
+        return response
+
+    def lookup(self, request, prefix):
+        cache_key = get_cache_key(request, prefix, 'GET', cache=cache)
+        return cache.get(cache_key) if cache_key else None
+
+    def compute(self, request, args, kwargs, prefix):
+        started = time.monotonic()
+        response = self.view(request, *args, **kwargs)
+        if not _is_cacheable(request, response):
+            return response
+        # timeout — срок только серверного кэша, который сбрасывают записи.
+        # Браузеры и прокси каждый раз переспрашивают страницу по ETag.
+        patch_cache_control(response, no_cache=True)
+        lifetime = self.timeout + self.stale_timeout
+        cache_key = learn_cache_key(
+            request, response, lifetime, prefix, cache=cache
+        )
+
+        def store(response):
+            entry = (
+                response,
+                time.time() + self.timeout,
+                time.monotonic() - started,
+            )
+            cache.set(cache_key, entry, lifetime)
+
+        if hasattr(response, 'render') and callable(response.render):
+            response.add_post_render_callback(store)
+        else:
+            store(response)
+        return response
+
+    def recompute(self, request, args, kwargs, prefix, lock_key):
+        try:
+            return self.compute(request, args, kwargs, prefix)
+        finally:
+            cache.delete(lock_key)
+
+    def wait_or_compute(self, request, args, kwargs, prefix):
+        # Страницу уже считает другой запрос: ждём его результата,
+        # а если не дождались, считаем сами.
+        record(self.name, 'wait')
+        deadline = time.monotonic() + LOCK_WAIT
+        while time.monotonic() < deadline:
+            time.sleep(LOCK_POLL_INTERVAL)
+            entry = self.lookup(request, prefix)
+            if entry is not None:
+                return entry[0]
+        return self.compute(request, args, kwargs, prefix)
+
+
+def cache_page_swr(timeout, key_prefix='', stale_timeout=None, beta=1.0,
+                   name=None):
+    """Кэширует страницу на timeout секунд и ещё stale_timeout отдаёт её
+    устаревшей, пока страница пересчитывается одним запросом.
+
+    key_prefix может быть функцией от аргументов представления. beta
+    управляет ранним пересчётом: чем больше, тем раньше.
+    """
+    if stale_timeout is None:
+        stale_timeout = timeout
+
+    def decorator(view):
+        page_cache = StaleWhileRevalidate(
+            view, timeout, key_prefix, stale_timeout, beta,
+            name or view.__name__,
+        )
+
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            return page_cache(request, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,99 @@
+"""Хранилище файлов, адресуемых по содержимому.
+
+Файл сохраняется под именем из SHA-256 своего содержимого:
+posts/ab/ab12…ef.jpg. Повторная загрузка той же картинки не пишет
+второй копии, а получает то же имя, так что один файл делят несколько
+постов. Содержимое по такому адресу никогда не меняется, поэтому его
+можно отдавать с вечным Cache-Control (см. is_immutable и
+core.views.serve_media; в nginx — location с тем же шаблоном пути).
+
+Общий файл удаляется, когда на него не ссылается ни один пост (см.
+posts.images.release). Пост, получивший уже существующий файл, ещё не
+закоммичен, и удаление может его не увидеть, поэтому после коммита
+файл проверяется снова и при необходимости пишется заново. Проверка и
+удаление идут под общей для процессов блокировкой (lock).
+"""
+import fcntl
+import hashlib
+import os
+import posixpath
+import re
+import tempfile
+from contextlib import contextmanager
+
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+
+LOCK_NAME = '.lock'
+
+# Файлы этого хранилища и миниатюры sorl, чьё имя — хэш исходной
+# картинки и параметров миниатюры.
+IMMUTABLE_PATH = re.compile(
+    r'(^|/)[0-9a-f]{2}/[0-9a-f]{64}\.\w+$'
+    r'|^cache/[0-9a-f]{2}/[0-9a-f]{2}/[0-9a-f]{32}\.\w+$'
+)
+
+
+def is_immutable(path):
+    """Не меняется ли содержимое файла по этому пути никогда."""
+    return bool(IMMUTABLE_PATH.search(path))
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """FileSystemStorage, называющий файлы хэшем содержимого."""
+
+    def get_available_name(self, name, max_length=None):
+        # Имя всё равно заменит хэш содержимого в _save.
+        return name
+
+    def _save(self, name, content):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, filename = posixpath.split(name)
+        hexdigest = digest.hexdigest()
+        name = posixpath.join(
+            directory,
+            hexdigest[:2],
+            hexdigest + os.path.splitext(filename)[1].lower(),
+        )
+        if not self.exists(name):
+            self._write(name, content)
+        else:
+            transaction.on_commit(lambda: self._restore(name, content))
+        return name
+
+    @contextmanager
+    def lock(self):
+        """Блокировка удаления и восстановления файлов между процессами."""
+        os.makedirs(self.location, exist_ok=True)
+        with open(os.path.join(self.location, LOCK_NAME), 'a') as handle:
+            fcntl.flock(handle, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(handle, fcntl.LOCK_UN)
+
+    def _restore(self, name, content):
+        # Файл мог удалить release поста, снявшего последнюю ссылку до
+        # коммита нашего.
+        with self.lock():
+            if not self.exists(name):
+                self._write(name, content)
+
+    def _write(self, name, content):
+        full_path = self.path(name)
+        directory = os.path.dirname(full_path)
+        os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и атомарно переименовываем: параллельная
+        # загрузка того же содержимого лишь заменит файл таким же.
+        handle, temp_path = tempfile.mkstemp(dir=directory, suffix='.part')
+        try:
+            with os.fdopen(handle, 'wb') as output:
+                for chunk in content.chunks():
+                    output.write(chunk)
+            os.chmod(temp_path, self.file_permissions_mode or 0o644)
+            os.replace(temp_path, full_path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
@@ -1,6 +1,15 @@
 from http import HTTPStatus
 
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.cache import cache
+from django.http import JsonResponse
 from django.shortcuts import render
+from django.views.static import serve
+
+from . import page_cache
+from .storage import is_immutable
+
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
 
 
 def page_not_found(request, exception):
@@ -22,3 +31,23 @@ def internal_server_error(request, reason=''):
         'core/500.html',
         status=HTTPStatus.INTERNAL_SERVER_ERROR
     )
+
+
+@staff_member_required
+def cache_stats(request):
+    """Счётчики кэша страниц и уровней кэша для мониторинга.
+
+    Статистика своя у каждого процесса.
+    """
+    stats = {'pages': page_cache.get_stats()}
+    if hasattr(cache, 'stats'):
+        stats['tiers'] = cache.stats()
+    return JsonResponse(stats)
+
+
+def serve_media(request, path, document_root=None):
+    """Отдаёт медиафайлы в DEBUG, неизменяемые — с вечным кэшем."""
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == HTTPStatus.OK and is_immutable(path):
+        response['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+    return response
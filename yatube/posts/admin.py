@@ -1,6 +1,14 @@
+from django import forms
 from django.contrib import admin
 
+from . import search
 from .models import Group, Post
+from .utils import EstimatedCountPaginator
+
+
+def is_changelist(request):
+    match = request.resolver_match
+    return bool(match) and match.url_name.endswith('_changelist')
 
 
 @admin.register(Post)
@@ -13,9 +21,36 @@ class PostAdmin(admin.ModelAdmin):
         'group',
     )
     list_editable = ('group',)
+    list_select_related = ('author', 'group')
     search_fields = ('text',)
     list_filter = ('pub_date',)
+    # Форма поста не выгружает всех пользователей и все группы в <select>.
+    autocomplete_fields = ('author', 'group')
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.name != 'group' or not is_changelist(request):
+            return super().formfield_for_foreignkey(
+                db_field, request, **kwargs
+            )
+        # В списке группа редактируется обычным <select>. Варианты
+        # выбираются один раз на запрос: иначе каждая строка списка
+        # заново читала бы все группы.
+        kwargs['widget'] = forms.Select
+        field = super().formfield_for_foreignkey(db_field, request, **kwargs)
+        if not hasattr(request, 'group_choices'):
+            # iter, а не list: list спросил бы len, то есть COUNT(*).
+            request.group_choices = [*iter(field.choices)]
+        field.choices = request.group_choices
+        return field
+
+    def get_search_results(self, request, queryset, search_term):
+        # Поиск по тексту идёт по полнотекстовому индексу, а не LIKE.
+        if not search_term:
+            return queryset, False
+        return search.filter_posts(queryset, search_term), False
 
 
 @admin.register(Group)
@@ -25,5 +60,8 @@ class GroupAdmin(admin.ModelAdmin):
         'slug',
         'description'
     )
-    search_fields = ('description',)
+    search_fields = ('title', 'description')
+    ordering = ('title',)
     empty_value_display = '-пусто-'
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
@@ -0,0 +1,198 @@
+"""JSON API лент постов только для чтения.
+
+Те же ленты, что и HTML-страницы, но без шаблонов: строки читаются
+через values() только с запрошенными полями (параметр fields=) и сразу
+превращаются в JSON. Страницы листаются курсором (параметр cursor из
+next и previous ответа). Общие ленты кэшируются и проверяются по ETag
+по поколениям областей, как их HTML-страницы; у ленты подписок ETag —
+хэш самого ответа.
+
+Представления *_since отдают только посты новее присланного after (id
+последнего виденного поста) или пустой 304 по отметкам high_water.
+"""
+import hashlib
+from functools import partial
+from urllib.parse import urlencode
+
+from django.contrib.auth import get_user_model
+from django.core.files.storage import default_storage
+from django.http import HttpResponseNotModified, JsonResponse
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.views.decorators.http import require_GET
+
+from . import high_water, timeline
+from .cache import (AUTHORS, GROUPS, INDEX, cache_page_by_generation,
+                    etag_by_generation, group_scope, profile_scope)
+from .models import Group, Post
+from .utils import CursorPaginator
+
+User = get_user_model()
+
+PAGE_SIZE = 20
+# Больше новых постов опрос не отдаёт: клиенту проще перечитать ленту.
+SINCE_LIMIT = 100
+
+# Поле ответа: поле values(), из которого оно берётся.
+FIELDS = {
+    'id': 'id',
+    'text': 'text',
+    'pub_date': 'pub_date',
+    'author': 'author__username',
+    'group': 'group__slug',
+    'image': 'image',
+}
+# Нужны курсору, даже если их не просили.
+CURSOR_FIELDS = ('id', 'pub_date')
+
+
+class BadRequest(Exception):
+    pass
+
+
+def _fields(request):
+    names = request.GET.get('fields')
+    if not names:
+        return list(FIELDS)
+    names = [name.strip() for name in names.split(',') if name.strip()]
+    unknown = sorted(set(names) - set(FIELDS))
+    if unknown:
+        raise BadRequest(f'Неизвестные поля: {", ".join(unknown)}')
+    return names
+
+
+def _serialize(row, fields):
+    item = {name: row[FIELDS[name]] for name in fields}
+    if item.get('image') is not None:
+        item['image'] = (
+            default_storage.url(item['image']) if item['image'] else None
+        )
+    return item
+
+
+def _page_url(request, cursor):
+    if not cursor:
+        return None
+    query = request.GET.copy()
+    query['cursor'] = cursor
+    return request.build_absolute_uri(
+        f'{request.path}?{urlencode(sorted(query.items()))}'
+    )
+
+
+def _since_response(request, feeds, posts):
+    """Посты posts новее after или 304, если отметки лент не новее."""
+    after = request.GET.get('after', '')
+    if not after.isdigit():
+        return JsonResponse(
+            {'error': 'Укажите after — id последнего поста.'}, status=400
+        )
+    latest = high_water.latest(feeds)
+    if latest <= int(after):
+        return HttpResponseNotModified()
+    try:
+        fields = _fields(request)
+    except BadRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    rows = list(
+        posts.filter(id__gt=after, id__lte=latest).order_by('-id').values(
+            *{FIELDS[name] for name in fields}
+        )[:SINCE_LIMIT + 1]
+    )
+    return JsonResponse({
+        'results': [_serialize(row, fields) for row in rows[:SINCE_LIMIT]],
+        'high_water': latest,
+        'truncated': len(rows) > SINCE_LIMIT,
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+def _response(request, posts, paginator_class=CursorPaginator):
+    """Страница постов posts в JSON."""
+    try:
+        fields = _fields(request)
+    except BadRequest as error:
+        return JsonResponse({'error': str(error)}, status=400)
+    lookups = {FIELDS[name] for name in (*fields, *CURSOR_FIELDS)}
+    pages = paginator_class(
+        posts.values(*lookups), PAGE_SIZE, request.GET.get('cursor')
+    )
+    page = pages.page()
+    return JsonResponse({
+        'results': [_serialize(row, fields) for row in page],
+        'next': _page_url(request, pages.next_cursor),
+        'previous': _page_url(request, pages.previous_cursor),
+    }, json_dumps_params={'ensure_ascii': False})
+
+
+@require_GET
+@etag_by_generation(lambda: [INDEX])
+@cache_page_by_generation(lambda: [INDEX])
+def api_index(request):
+    return _response(request, Post.objects.all())
+
+
+@require_GET
+@etag_by_generation(lambda slug: [group_scope(slug), AUTHORS])
+@cache_page_by_generation(lambda slug: [group_scope(slug), AUTHORS])
+def api_group(request, slug):
+    group = get_object_or_404(Group, slug=slug)
+    return _response(request, Post.objects.filter(group=group))
+
+
+@require_GET
+@etag_by_generation(lambda username: [profile_scope(username), GROUPS])
+@cache_page_by_generation(
+    lambda username: [profile_scope(username), GROUPS]
+)
+def api_profile(request, username):
+    author = get_object_or_404(User, username=username)
+    return _response(request, Post.objects.filter(author=author))
+
+
+@require_GET
+def api_follow(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужно войти.'}, status=401)
+    response = _response(
+        request,
+        timeline.follow_feed(request.user),
+        partial(timeline.FollowFeedPaginator, user=request.user),
+    )
+    # Лента своя у каждого и в общий кэш не попадает: ETag экономит
+    # хотя бы передачу неизменившегося ответа.
+    patch_cache_control(response, private=True)
+    response['ETag'] = '"{}"'.format(
+        hashlib.md5(response.content).hexdigest()
+    )
+    return get_conditional_response(
+        request, etag=response['ETag'], response=response
+    )
+
+
+@require_GET
+def api_index_since(request):
+    return _since_response(request, [high_water.INDEX], Post.objects.all())
+
+
+@require_GET
+def api_group_since(request, slug):
+    # Группа не проверяется, чтобы опрос не ходил в БД: у несуществующей
+    # группы просто нет новых постов.
+    return _since_response(
+        request,
+        [high_water.group(slug)],
+        Post.objects.filter(group__slug=slug),
+    )
+
+
+@require_GET
+def api_follow_since(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужно войти.'}, status=401)
+    response = _since_response(
+        request,
+        timeline.follow_high_water(request.user),
+        timeline.follow_feed(request.user),
+    )
+    patch_cache_control(response, private=True)
+    return response
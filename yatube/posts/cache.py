@@ -0,0 +1,147 @@
+"""Поколения кэша страниц.
+
+Ключ закэшированной страницы включает поколения областей, от которых
+она зависит (лента, группа, профиль). Сигналы записей Post, Group и User
+меняют поколения затронутых областей, и устаревшие страницы просто
+перестают находиться в кэше, поэтому хранить страницы можно часами.
+"""
+import hashlib
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import translation
+from django.views.decorators.http import condition
+
+from core.page_cache import cache_page_swr
+
+INDEX = 'index'
+GROUPS = 'groups'
+AUTHORS = 'authors'
+
+
+def group_scope(slug):
+    return f'group:{slug}'
+
+
+def profile_scope(username):
+    return f'profile:{username}'
+
+
+def post_scope(pk):
+    return f'post:{pk}'
+
+
+def _generation_key(scope):
+    return f'generation:{scope}'
+
+
+def get_generations(scopes):
+    """Возвращает текущие поколения областей в том же порядке."""
+    keys = [_generation_key(scope) for scope in scopes]
+    generations = cache.get_many(keys)
+    missing = [key for key in keys if key not in generations]
+    if missing:
+        for key in missing:
+            cache.add(key, uuid.uuid4().hex, None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(key, '') for key in keys]
+
+
+def bump(*scopes):
+    """Начинает новое поколение областей: их старые страницы устаревают."""
+    # Случайные метки вместо счётчика: после сброса кэша поколение
+    # не может совпасть с поколением страниц, сохранённых до сброса.
+    cache.set_many(
+        {_generation_key(scope): uuid.uuid4().hex for scope in scopes},
+        None,
+    )
+
+
+def card_keys(posts):
+    """Ключи кэша карточек постов.
+
+    Ключ зависит от поколений самого поста, профиля автора и группы
+    поста, поэтому правка любого из них даёт карточке новый ключ.
+    """
+    card_scopes = [
+        [post_scope(post.pk), profile_scope(post.author.username)]
+        + ([group_scope(post.group.slug)] if post.group_id else [])
+        for post in posts
+    ]
+    scopes = list({scope for post_scopes in card_scopes
+                   for scope in post_scopes})
+    generations = dict(zip(scopes, get_generations(scopes)))
+    language = translation.get_language()
+    return [
+        'post-card:{}:{}:{}'.format(
+            post.pk,
+            language,
+            hashlib.md5(
+                ':'.join(generations[scope] for scope in post_scopes).encode()
+            ).hexdigest(),
+        )
+        for post, post_scopes in zip(posts, card_scopes)
+    ]
+
+
+def cache_page_by_generation(scopes, timeout=None):
+    """Кэш страницы, чей ключ зависит от поколений областей страницы.
+
+    scopes — функция от аргументов представления, возвращающая список
+    областей, изменения в которых должны сбрасывать страницу. В общем
+    кэше только страницы анонимов: у вошедшего пользователя в шапке его
+    имя, а в профилях — его подписки.
+    """
+    def key_prefix(*args, **kwargs):
+        generations = get_generations(scopes(*args, **kwargs))
+        return hashlib.md5(':'.join(generations).encode()).hexdigest()
+
+    def decorator(view):
+        return cache_page_swr(
+            timeout or settings.POSTS_PAGE_CACHE_TIMEOUT,
+            key_prefix=lambda *args, **kwargs: (
+                f'{view.__name__}.{key_prefix(*args, **kwargs)}'
+            ),
+            stale_timeout=settings.POSTS_PAGE_CACHE_STALE_TIMEOUT,
+        )(view)
+    return decorator
+
+
+def page_etag(request, scopes, *parts, csrf=False):
+    """ETag страницы без её отрисовки.
+
+    Складывается из поколений областей страницы и адреса запроса. Для
+    вошедшего пользователя — свой вариант: в шапке его имя, а на
+    страницах его подписки. У страницы с формой (csrf) в ETag входит
+    и CSRF-токен: после нового входа токен меняется, и браузер не
+    должен отправить форму со старым.
+    """
+    if scopes is None:
+        return None
+    if request.user.is_authenticated:
+        scopes = [*scopes, profile_scope(request.user.username)]
+        variant = f'user:{request.user.pk}'
+    else:
+        variant = 'anonymous'
+    if csrf:
+        parts = [*parts, request.META.get('CSRF_COOKIE', '')]
+    return hashlib.md5(':'.join([
+        variant,
+        translation.get_language(),
+        request.get_full_path(),
+        *get_generations(scopes),
+        *parts,
+    ]).encode()).hexdigest()
+
+
+def etag_by_generation(scopes, csrf=False):
+    """Отвечает 304 Not Modified, пока не сменились поколения областей.
+
+    scopes — как в cache_page_by_generation; None вместо списка
+    отключает проверку (например, для несуществующего объекта). csrf —
+    страница отрисовывает форму с CSRF-токеном.
+    """
+    return condition(etag_func=lambda request, *args, **kwargs: page_etag(
+        request, scopes(*args, **kwargs), csrf=csrf
+    ))
@@ -0,0 +1,30 @@
+"""Варианты группы для формы поста.
+
+Форма поста не выводит все группы в <select>, а подгружает их по мере
+ввода через представление group_choices: каждая страница — один запрос
+с LIMIT, и список всех групп не читается ни в память, ни в кэш.
+"""
+from .models import Group
+
+PAGE_SIZE = 20
+
+
+def labels(pks):
+    """Названия групп с данными id; неизвестные id пропускаются."""
+    return dict(
+        Group.objects.filter(pk__in=pks).values_list('pk', 'title')
+    )
+
+
+def find(text, page=1):
+    """Страница групп, чьё название начинается с text.
+
+    Возвращает (список пар (id, название), есть ли следующая страница).
+    """
+    offset = (max(page, 1) - 1) * PAGE_SIZE
+    found = list(
+        Group.objects.filter(title__istartswith=text.strip()).order_by(
+            'title'
+        ).values_list('pk', 'title')[offset:offset + PAGE_SIZE + 1]
+    )
+    return found[:PAGE_SIZE], len(found) > PAGE_SIZE
@@ -0,0 +1,124 @@
+"""Комментарии к посту страницами по курсору и в карточках лент.
+
+Страница поста показывает только первую страницу комментариев, а
+следующие подгружаются фрагментами при прокрутке. Каждая страница —
+один запрос с JOIN автора. Отрисованный фрагмент кэшируется по
+поколениям поста (его меняют новые и удалённые комментарии) и авторов
+(их имена), поэтому первая страница обычно берётся из кэша вместе со
+страницей поста.
+
+Карточкам ленты нужны число комментариев и последние комментарии
+каждого поста страницы: previews получает их для всех постов сразу
+одним запросом, а их число — из счётчиков. Новые и удалённые
+комментарии сбрасывают поколения поста и тех лент, где его карточка на
+первой странице (см. signals); на дальних страницах и с новым именем
+комментатора карточка обновится, когда страница истечёт.
+"""
+import hashlib
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.template.loader import render_to_string
+from django.urls import reverse
+from django.utils import translation
+
+from . import counters
+from .cache import AUTHORS, get_generations, post_scope
+from .models import Comment, Counter
+from .utils import CursorPaginator, decode_cursor
+
+User = get_user_model()
+
+# Последние комментарии одного поста: чтение индекса
+# comment_post_date_idx с конца, не больше size строк.
+LATEST_SQL = (
+    'SELECT id FROM (SELECT id FROM {comment} WHERE post_id = %s '
+    'ORDER BY pub_date DESC, id DESC LIMIT %s) latest_{number}'
+)
+PREVIEWS_SQL = """
+SELECT c.id, c.post_id, c.text, c.pub_date, u.{username} AS author_username
+FROM {comment} c
+INNER JOIN {user} u ON u.id = c.author_id
+WHERE c.id IN ({latest})
+ORDER BY c.post_id, c.pub_date, c.id
+"""
+
+
+def _key(post_id, cursor):
+    generations = get_generations([post_scope(post_id), AUTHORS])
+    return 'comments:{}:{}:{}:{}'.format(
+        post_id,
+        translation.get_language(),
+        cursor or '',
+        hashlib.md5(':'.join(generations).encode()).hexdigest(),
+    )
+
+
+def render_page(post_id, cursor=None):
+    """HTML страницы комментариев поста, начиная с cursor."""
+    if cursor and decode_cursor(cursor) is None:
+        cursor = None
+    key = _key(post_id, cursor)
+    html = cache.get(key)
+    if html is None:
+        pages = CursorPaginator(
+            Comment.objects.filter(post_id=post_id).select_related(
+                'author'
+            ).only(
+                'pub_date', 'text', 'author', 'author__username'
+            ).order_by('pub_date', 'id'),
+            settings.POSTS_COMMENTS_PER_PAGE,
+            cursor,
+            oldest_first=True,
+        )
+        page = pages.page()
+        next_url = None
+        if pages.next_cursor:
+            next_url = '{}?cursor={}'.format(
+                reverse('posts:post_comments', args=(post_id,)),
+                pages.next_cursor,
+            )
+        html = render_to_string('includes/comments.html', {
+            'comments': page,
+            'next_url': next_url,
+        })
+        cache.set(key, html, settings.POSTS_CARD_CACHE_TIMEOUT)
+    return html
+
+
+def previews(post_ids, size=None):
+    """{id поста: (число комментариев, последние комментарии)}.
+
+    Последние size комментариев идут от старых к новым, у каждого есть
+    author_username. Комментарии всех постов читаются одним запросом, в
+    котором каждый пост берёт из индекса только свои size строк, а
+    число — из денормализованного счётчика.
+    """
+    size = settings.POSTS_CARD_COMMENTS if size is None else size
+    post_ids = list(post_ids)
+    counts = counters.get_many(
+        [(Counter.POST_COMMENTS, post_id) for post_id in post_ids]
+    )
+    found = {
+        post_id: (counts[Counter.POST_COMMENTS, post_id], [])
+        for post_id in post_ids
+    }
+    if not post_ids or not size:
+        return found
+    quote = connection.ops.quote_name
+    comment = quote(Comment._meta.db_table)
+    sql = PREVIEWS_SQL.format(
+        username=quote('username'),
+        comment=comment,
+        user=quote(User._meta.db_table),
+        latest=' UNION ALL '.join(
+            LATEST_SQL.format(comment=comment, number=number)
+            for number in range(len(post_ids))
+        ),
+    )
+    params = [param for post_id in post_ids for param in (post_id, size)]
+    for comment in Comment.objects.raw(sql, params):
+        found[comment.post_id][1].append(comment)
+    return found
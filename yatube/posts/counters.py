@@ -0,0 +1,219 @@
+"""Денормализованные счётчики постов, комментариев и подписок.
+
+Счётчики обновляются сигналами в той же транзакции, что и сама запись,
+а страницы читают их одним запросом вместо COUNT(*) по таблицам.
+Расхождения, если они появятся, исправляет команда reconcile_counters.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import (Case, CharField, Count, F, IntegerField,
+                              Value, When)
+
+from .models import Comment, Counter, Follow, Post
+
+SOURCES = {
+    Counter.AUTHOR_POSTS: (Post, 'author_id'),
+    Counter.GROUP_POSTS: (Post, 'group_id'),
+    Counter.POST_COMMENTS: (Comment, 'post_id'),
+    Counter.USER_FOLLOWERS: (Follow, 'author_id'),
+    Counter.USER_FOLLOWING: (Follow, 'user_id'),
+}
+BATCH_SIZE = 1000
+# Сколько id объектов сверяется за раз.
+CHUNK_SIZE = 500
+
+
+def recount(kind, object_ids):
+    """Считает значения счётчика по исходной таблице."""
+    model, field = SOURCES[kind]
+    counts = dict.fromkeys(object_ids, 0)
+    counts.update(
+        model.objects.filter(**{f'{field}__in': object_ids}).order_by().values(
+            field
+        ).annotate(total=Count('pk')).values_list(field, 'total')
+    )
+    return counts
+
+
+def change(kind, object_id, delta):
+    """Атомарно меняет счётчик на delta."""
+    if object_id is None:
+        return
+    with transaction.atomic():
+        updated = Counter.objects.filter(
+            kind=kind, object_id=object_id
+        ).update(value=F('value') + delta)
+        if updated:
+            return
+        # Счётчика ещё нет: считаем его по таблице, где запись уже учтена.
+        try:
+            with transaction.atomic():
+                Counter.objects.create(
+                    kind=kind,
+                    object_id=object_id,
+                    value=recount(kind, [object_id])[object_id],
+                )
+        except IntegrityError:
+            Counter.objects.filter(
+                kind=kind, object_id=object_id
+            ).update(value=F('value') + delta)
+
+
+def get_many(keys):
+    """Возвращает {(kind, object_id): value} для списка пар."""
+    keys = [(kind, object_id) for kind, object_id in keys if object_id]
+    values = dict.fromkeys(keys, 0)
+    if not keys:
+        return values
+    found = Counter.objects.filter(
+        kind__in={kind for kind, _ in keys},
+        object_id__in={object_id for _, object_id in keys},
+    ).values_list('kind', 'object_id', 'value')
+    missing = set(keys)
+    for kind, object_id, value in found:
+        if (kind, object_id) in missing:
+            values[kind, object_id] = value
+            missing.discard((kind, object_id))
+    if missing:
+        counts = _recount_many(missing)
+        Counter.objects.bulk_create(
+            [
+                Counter(kind=kind, object_id=object_id, value=value)
+                for (kind, object_id), value in counts.items()
+            ],
+            ignore_conflicts=True,
+        )
+        values.update(counts)
+    return values
+
+
+def _recount_many(keys):
+    """Считает по таблицам счётчики пар (kind, object_id) одним запросом
+    на все виды сразу."""
+    parts = []
+    for kind in {kind for kind, _ in keys}:
+        model, field = SOURCES[kind]
+        parts.append(
+            model.objects.filter(**{
+                f'{field}__in': [pk for k, pk in keys if k == kind]
+            }).order_by().values(field).annotate(
+                counter=Value(kind, CharField()), total=Count('pk')
+            ).values_list('counter', field, 'total')
+        )
+    counts = dict.fromkeys(keys, 0)
+    counts.update(
+        ((kind, object_id), total)
+        for kind, object_id, total in parts[0].union(*parts[1:], all=True)
+    )
+    return counts
+
+
+def get(kind, object_id):
+    return get_many([(kind, object_id)]).get((kind, object_id), 0)
+
+
+def delete(kind, object_id):
+    Counter.objects.filter(kind=kind, object_id=object_id).delete()
+
+
+def refresh(kind, object_ids):
+    """Пересчитывает по таблице счётчики kind объектов object_ids
+    пачками по CHUNK_SIZE в порядке id."""
+    object_ids = sorted(set(object_ids) - {None})
+    for start in range(0, len(object_ids), CHUNK_SIZE):
+        chunk = object_ids[start:start + CHUNK_SIZE]
+        stored = set(
+            Counter.objects.filter(
+                kind=kind, object_id__in=chunk
+            ).values_list('object_id', flat=True)
+        )
+        _save(kind, recount(kind, chunk), stored)
+
+
+def _next_bound(object_ids, after):
+    """CHUNK_SIZE-й по порядку id после after или None, если их меньше."""
+    bound = list(
+        object_ids.filter(object_id__gt=after).order_by('object_id')[
+            CHUNK_SIZE - 1:CHUNK_SIZE
+        ]
+    )
+    return bound[0] if bound else None
+
+
+def _save(kind, values, stored):
+    """Записывает значения values счётчиков kind, из которых в БД уже
+    есть stored: одним UPDATE и одним INSERT."""
+    if stored:
+        Counter.objects.filter(
+            kind=kind, object_id__in=list(stored)
+        ).update(value=Case(
+            *[When(object_id=object_id, then=Value(values[object_id]))
+              for object_id in stored],
+            output_field=IntegerField(),
+        ))
+    Counter.objects.bulk_create(
+        [
+            Counter(kind=kind, object_id=object_id, value=value)
+            for object_id, value in values.items()
+            if object_id not in stored
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+
+
+def reconcile(kinds=None, dry_run=False):
+    """Сверяет счётчики с таблицами и исправляет расхождения.
+
+    id объектов проходятся по возрастанию пачками до CHUNK_SIZE из
+    исходной таблицы и из счётчиков, так что память не зависит от
+    размера таблиц. Возвращает словарь {kind: число исправленных
+    счётчиков}.
+    """
+    fixed = {}
+    for kind in kinds or SOURCES:
+        model, field = SOURCES[kind]
+        sources = model.objects.exclude(
+            **{f'{field}__isnull': True}
+        ).annotate(object_id=F(field)).values_list(
+            'object_id', flat=True
+        ).distinct()
+        counted = Counter.objects.filter(kind=kind).values_list(
+            'object_id', flat=True
+        )
+        fixed[kind] = 0
+        after = 0
+        while after is not None:
+            bounds = [
+                bound for bound in (
+                    _next_bound(sources, after), _next_bound(counted, after)
+                ) if bound is not None
+            ]
+            until = min(bounds) if bounds else None
+            chunk = {'object_id__gt': after}
+            if until is not None:
+                chunk['object_id__lte'] = until
+            actual = dict(
+                sources.filter(**chunk).order_by().annotate(
+                    total=Count('pk')
+                ).values_list('object_id', 'total')
+            )
+            stored = dict(
+                Counter.objects.filter(kind=kind, **chunk).values_list(
+                    'object_id', 'value'
+                )
+            )
+            # Счётчик без строк в таблице должен быть нулём.
+            wrong = {
+                object_id: actual.get(object_id, 0)
+                for object_id in actual.keys() | stored.keys()
+                if stored.get(object_id) != actual.get(object_id, 0)
+            }
+            fixed[kind] += len(wrong)
+            if wrong and not dry_run:
+                with transaction.atomic():
+                    _save(kind, wrong, {
+                        object_id for object_id in wrong
+                        if object_id in stored
+                    })
+            after = until
+    return fixed
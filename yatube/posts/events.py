@@ -0,0 +1,151 @@
+"""Server-Sent Events о новых постах и комментариях.
+
+Новый пост после коммита публикуется в каналы общей ленты, своей группы
+и автора, новый комментарий — в канал поста. Имена каналов лент те же,
+что у отметок high_water. Событие маленькое — тип и id записи: клиент
+сам решает, перечитать ли ленту. Пропущенное за время обрыва соединения
+он получает обычным опросом *_since API.
+
+Соединение не держит ни БД (оно закрывается перед началом потока),
+ни кэш, но занимает поток воркера, поэтому их число ограничено
+брокером; сверх предела ответ 503.
+"""
+import logging
+import sqlite3
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connections, transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.views.decorators.http import require_GET
+
+from core.broker import OVERFLOW, TooManySubscribers, get_broker
+
+from . import high_water
+from .models import Post
+
+User = get_user_model()
+
+logger = logging.getLogger(__name__)
+
+# Через сколько миллисекунд браузеру переподключаться после обрыва.
+RETRY = 3000
+
+
+def post(post_id):
+    return f'post:{post_id}'
+
+
+def _publish(channels, data):
+    def send():
+        broker = get_broker()
+        try:
+            for channel in channels:
+                broker.publish(channel, data)
+        except sqlite3.Error:
+            # Событие — только подсказка клиенту, запись уже сохранена.
+            logger.warning('Событие %s не опубликовано', data, exc_info=True)
+
+    transaction.on_commit(send)
+
+
+def post_created(instance):
+    channels = [high_water.INDEX, high_water.author(instance.author_id)]
+    group_slug = None
+    if instance.group_id:
+        group_slug = instance.group.slug
+        channels.append(high_water.group(group_slug))
+    _publish(channels, {
+        'type': 'post',
+        'id': instance.pk,
+        'author': instance.author.username,
+        'group': group_slug,
+    })
+
+
+def comment_created(instance):
+    _publish([post(instance.post_id)], {
+        'type': 'comment',
+        'id': instance.pk,
+        'post': instance.post_id,
+        'author': instance.author.username,
+    })
+
+
+class EventStream:
+    """Тело ответа text/event-stream для подписки."""
+
+    def __init__(self, subscription):
+        self.subscription = subscription
+
+    def __iter__(self):
+        yield f'retry: {RETRY}\n\n'
+        while True:
+            event = self.subscription.get(settings.EVENTS_HEARTBEAT)
+            if event is None:
+                # Комментарий не дойдёт до клиента, но закроет соединение,
+                # если клиент ушёл.
+                yield ': ping\n\n'
+            elif event is OVERFLOW:
+                yield 'event: overflow\ndata: {}\n\n'
+                return
+            else:
+                event_id, channel, data = event
+                yield f'id: {event_id}\ndata: {data}\n\n'
+
+    def close(self):
+        # Вызывается сервером по окончании ответа, даже если поток
+        # событий ни разу не читался.
+        self.subscription.close()
+
+
+def _release_connections():
+    # Ответ живёт, пока открыт поток событий, а request_finished,
+    # закрывающий соединения с БД, придёт только в его конце. Внутри
+    # транзакции (в тестах) соединение закрывать нельзя.
+    for connection in connections.all():
+        if not connection.in_atomic_block:
+            connection.close()
+
+
+def _stream(channels):
+    _release_connections()
+    try:
+        subscription = get_broker().subscribe(channels)
+    except TooManySubscribers:
+        response = HttpResponse('Слишком много соединений.', status=503)
+        response['Retry-After'] = RETRY // 1000
+        return response
+    response = StreamingHttpResponse(
+        EventStream(subscription), content_type='text/event-stream'
+    )
+    response['Cache-Control'] = 'no-cache'
+    # Иначе nginx копит поток в буфере.
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@require_GET
+def post_events(request, post_id):
+    get_object_or_404(Post, pk=post_id)
+    return _stream([post(post_id)])
+
+
+@require_GET
+def group_events(request, slug):
+    return _stream([high_water.group(slug)])
+
+
+@require_GET
+def profile_events(request, username):
+    author = get_object_or_404(User, username=username)
+    return _stream([high_water.author(author.pk)])
+
+
+@require_GET
+def follow_events(request):
+    if not request.user.is_authenticated:
+        return JsonResponse({'error': 'Нужно войти.'}, status=401)
+    # Подписки, сделанные после подключения, придут после переподключения.
+    return _stream(high_water.following(request.user.pk))
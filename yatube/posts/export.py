@@ -0,0 +1,124 @@
+"""Выгрузка данных пользователя одним ZIP-архивом.
+
+Архив собирается на лету: zipfile пишет в буфер, генератор отдаёт его
+содержимое кусками в StreamingHttpResponse. Строки из БД читаются через
+iterator() пачками, картинки копируются кусками по CHUNK_SIZE, поэтому
+память не зависит от числа постов и размера картинок.
+
+Строки posts.jsonl, comments.jsonl и follows.jsonl в формате команды
+import_content.
+"""
+import json
+import logging
+import zipfile
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils import timezone
+
+from .models import Comment, Follow, Post
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+ROWS_CHUNK_SIZE = 2000
+
+
+class _Buffer:
+    """Файл без seek для zipfile: копит записанное до выдачи."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _rows(user):
+    """(имя файла, строки) для таблиц пользователя."""
+    posts = Post.objects.filter(author=user).order_by('pk').values(
+        'id', 'text', 'pub_date', 'group__slug', 'image'
+    )
+    comments = Comment.objects.filter(author=user).order_by('pk').values(
+        'id', 'post_id', 'text', 'pub_date'
+    )
+    follows = Follow.objects.filter(user=user).order_by('pk').values_list(
+        'author__username', flat=True
+    )
+    yield 'posts.jsonl', (
+        {'id': post['id'], 'text': post['text'], 'author': user.username,
+         'group': post['group__slug'], 'pub_date': post['pub_date'],
+         'image': post['image'] or None}
+        for post in posts.iterator(chunk_size=ROWS_CHUNK_SIZE)
+    )
+    yield 'comments.jsonl', (
+        {'id': comment['id'], 'post': comment['post_id'],
+         'author': user.username, 'text': comment['text'],
+         'pub_date': comment['pub_date']}
+        for comment in comments.iterator(chunk_size=ROWS_CHUNK_SIZE)
+    )
+    yield 'follows.jsonl', (
+        {'user': user.username, 'author': author}
+        for author in follows.iterator(chunk_size=ROWS_CHUNK_SIZE)
+    )
+
+
+def _entry(name, compress_type=zipfile.ZIP_DEFLATED):
+    info = zipfile.ZipInfo(name, timezone.localtime().timetuple()[:6])
+    info.compress_type = compress_type
+    return info
+
+
+def stream_archive(user):
+    """Генератор байтов ZIP-архива с данными пользователя."""
+    buffer = _Buffer()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr(_entry('profile.json'), json.dumps({
+            'username': user.username,
+            'first_name': user.first_name,
+            'last_name': user.last_name,
+            'email': user.email,
+            'date_joined': user.date_joined,
+        }, cls=DjangoJSONEncoder, ensure_ascii=False, indent=2))
+        yield buffer.pop()
+        for filename, rows in _rows(user):
+            with archive.open(_entry(filename), 'w',
+                              force_zip64=True) as output:
+                for row in rows:
+                    output.write(json.dumps(
+                        row, cls=DjangoJSONEncoder, ensure_ascii=False
+                    ).encode() + b'\n')
+                    if len(buffer.parts) > 64:
+                        yield buffer.pop()
+            yield buffer.pop()
+        images = Post.objects.filter(author=user).exclude(image='').order_by(
+            'image'
+        ).values_list('image', flat=True).distinct()
+        for name in images.iterator(chunk_size=ROWS_CHUNK_SIZE):
+            yield from _copy_image(archive, buffer, name)
+    yield buffer.pop()
+
+
+def _copy_image(archive, buffer, name):
+    try:
+        source = default_storage.open(name)
+    except (OSError, SuspiciousFileOperation):
+        logger.warning('Картинка %s не найдена для выгрузки', name)
+        return
+    # Картинки уже сжаты: кладём как есть.
+    entry = _entry(f'media/{name}', zipfile.ZIP_STORED)
+    with source, archive.open(entry, 'w', force_zip64=True) as output:
+        for chunk in source.chunks(CHUNK_SIZE):
+            output.write(chunk)
+            yield buffer.pop()
+    yield buffer.pop()
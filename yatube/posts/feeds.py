@@ -0,0 +1,130 @@
+"""RSS и Atom ленты: общая, группы и автора.
+
+Ленты кэшируются и проверяются по ETag так же, как HTML-страницы тех же
+лент: ключ зависит от поколений областей, которые меняют сигналы
+записей. Читатель, опрашивающий ленту каждую минуту, обычно получает
+304 после одного чтения поколений из кэша.
+"""
+from django.contrib.auth import get_user_model
+from django.contrib.syndication.views import Feed
+from django.shortcuts import get_object_or_404
+from django.urls import reverse
+from django.utils.feedgenerator import Atom1Feed
+from django.utils.text import Truncator
+
+from . import queries
+from .cache import (AUTHORS, GROUPS, INDEX, cache_page_by_generation,
+                    etag_by_generation, group_scope, profile_scope)
+from .models import Group
+
+User = get_user_model()
+
+# Сколько последних постов в ленте.
+FEED_SIZE = 20
+
+
+class PostsFeed(Feed):
+    title = 'Yatube: последние записи'
+    description = 'Новые посты всех авторов.'
+
+    def link(self, obj=None):
+        return reverse('posts:index')
+
+    def posts(self, obj):
+        return queries.index_feed()
+
+    def items(self, obj=None):
+        return self.posts(obj)[:FEED_SIZE]
+
+    def item_title(self, item):
+        return Truncator(item.text).words(10)
+
+    def item_description(self, item):
+        return item.text
+
+    def item_link(self, item):
+        return reverse('posts:post_detail', args=(item.pk,))
+
+    def item_pubdate(self, item):
+        return item.pub_date
+
+    def item_author_name(self, item):
+        return item.author.get_full_name() or item.author.username
+
+    def item_categories(self, item):
+        return [item.group.title] if item.group_id else []
+
+
+class GroupPostsFeed(PostsFeed):
+    def get_object(self, request, slug):
+        return get_object_or_404(Group, slug=slug)
+
+    def title(self, group):
+        return f'Yatube: {group.title}'
+
+    def description(self, group):
+        return group.description
+
+    def link(self, group):
+        return reverse('posts:group_list', args=(group.slug,))
+
+    def posts(self, group):
+        return queries.group_feed(group)
+
+
+class ProfilePostsFeed(PostsFeed):
+    def get_object(self, request, username):
+        return get_object_or_404(User, username=username)
+
+    def title(self, author):
+        return f'Yatube: {author.get_full_name() or author.username}'
+
+    def description(self, author):
+        return f'Посты пользователя {author.username}.'
+
+    def link(self, author):
+        return reverse('posts:profile', args=(author.username,))
+
+    def posts(self, author):
+        return queries.profile_feed(author)
+
+
+def _atom(feed_class):
+    return type(
+        f'Atom{feed_class.__name__}',
+        (feed_class,),
+        {'feed_type': Atom1Feed, 'subtitle': feed_class.description},
+    )
+
+
+def cached_feed(feed_class, name, scopes):
+    """Представление ленты с кэшем и ETag по поколениям scopes."""
+    feed = feed_class()
+
+    def view(request, *args, **kwargs):
+        return feed(request, *args, **kwargs)
+
+    view.__name__ = name
+    return etag_by_generation(scopes)(
+        cache_page_by_generation(scopes)(view)
+    )
+
+
+index_rss = cached_feed(PostsFeed, 'index_rss', lambda: [INDEX])
+index_atom = cached_feed(_atom(PostsFeed), 'index_atom', lambda: [INDEX])
+group_rss = cached_feed(
+    GroupPostsFeed, 'group_rss',
+    lambda slug: [group_scope(slug), AUTHORS],
+)
+group_atom = cached_feed(
+    _atom(GroupPostsFeed), 'group_atom',
+    lambda slug: [group_scope(slug), AUTHORS],
+)
+profile_rss = cached_feed(
+    ProfilePostsFeed, 'profile_rss',
+    lambda username: [profile_scope(username), GROUPS],
+)
+profile_atom = cached_feed(
+    _atom(ProfilePostsFeed), 'profile_atom',
+    lambda username: [profile_scope(username), GROUPS],
+)
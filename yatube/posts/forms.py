@@ -1,12 +1,47 @@
 from django import forms
+from django.core.files.uploadedfile import UploadedFile
+from django.urls import reverse_lazy
 
+from . import choices, images
 from .models import Comment, Post
 
 
+class GroupSelect(forms.Select):
+    """<select> группы, в котором есть только выбранная группа.
+
+    Остальные варианты скрипт страницы подгружает по мере ввода с
+    адреса из data-url. Проверка выбранного значения — обычная для
+    ModelChoiceField: одна группа по id.
+    """
+
+    def __init__(self, attrs=None):
+        super().__init__({'data-url': reverse_lazy('posts:group_choices'),
+                          **(attrs or {})})
+
+    def optgroups(self, name, value, attrs=None):
+        selected = choices.labels(
+            int(pk) for pk in value if str(pk).isdigit()
+        )
+        options = [('', self.choices.field.empty_label), *selected.items()]
+        return [
+            (None, [self.create_option(
+                name, pk, label, str(pk) in value, index, attrs=attrs
+            )], index)
+            for index, (pk, label) in enumerate(options)
+        ]
+
+
 class PostForm(forms.ModelForm):
     class Meta:
         model = Post
         fields = ('text', 'group', 'image')
+        widgets = {'group': GroupSelect}
+
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        if isinstance(image, UploadedFile):
+            return images.process_upload(image)
+        return image
 
 
 class CommentForm(forms.ModelForm):
@@ -0,0 +1,106 @@
+"""Отметки последнего поста лент для опроса «что нового».
+
+Для каждой ленты (общей, группы, автора) в кэше лежит id её последнего
+поста. Клиент присылает id последнего виденного поста, и если отметка
+не больше его, ответ 304 получается без обращения к БД. Новый пост
+после коммита удаляет отметки своих лент; недостающая отметка
+считается по БД одним запросом MAX(id) и снова кэшируется. Запрос,
+начатый до коммита поста, может положить в кэш старую отметку уже
+после её удаления, поэтому посчитанные отметки живут недолго.
+
+У ленты подписок своя отметка пользователя — наибольший id поста в его
+материализованной ленте (её сбрасывает раскладка поста по лентам), а
+посты знаменитостей добавляют отметки их авторов (см.
+timeline.follow_high_water).
+"""
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max
+
+from .models import Follow, Post, TimelineEntry
+
+INDEX = 'index'
+# Сколько живёт отметка, посчитанная по БД.
+MARK_TIMEOUT = 60
+TIMEOUT = 60 * 60 * 24
+
+
+def group(slug):
+    return f'group:{slug}'
+
+
+def author(author_id):
+    return f'author:{author_id}'
+
+
+def follow(user_id):
+    return f'follow:{user_id}'
+
+
+def _key(feed):
+    return f'high-water:{feed}'
+
+
+def _following_key(user_id):
+    return f'following-ids:{user_id}'
+
+
+def _mark(feed):
+    if feed == INDEX:
+        return Post.objects.aggregate(mark=Max('id'))['mark'] or 0
+    kind, value = feed.split(':', 1)
+    if kind == 'follow':
+        # MAX по индексу уникальности (user, post) ленты.
+        marks = TimelineEntry.objects.filter(user_id=value).aggregate(
+            mark=Max('post_id')
+        )
+    elif kind == 'group':
+        marks = Post.objects.filter(group__slug=value).aggregate(
+            mark=Max('id')
+        )
+    else:
+        marks = Post.objects.filter(author_id=value).aggregate(
+            mark=Max('id')
+        )
+    return marks['mark'] or 0
+
+
+def latest(feeds):
+    """Наибольшая отметка среди лент feeds (0, если постов нет)."""
+    keys = {_key(feed): feed for feed in feeds}
+    found = cache.get_many(list(keys))
+    for key, feed in keys.items():
+        if key not in found:
+            found[key] = _mark(feed)
+            cache.add(key, found[key], MARK_TIMEOUT)
+    return max(found.values(), default=0)
+
+
+def following(user_id):
+    """Ленты авторов, на которых подписан пользователь."""
+    key = _following_key(user_id)
+    author_ids = cache.get(key)
+    if author_ids is None:
+        author_ids = list(
+            Follow.objects.filter(user_id=user_id).values_list(
+                'author_id', flat=True
+            )
+        )
+        cache.set(key, author_ids, TIMEOUT)
+    return [author(author_id) for author_id in author_ids]
+
+
+def forget(feeds=(), users=()):
+    """После коммита сбрасывает отметки лент, а также списки подписок и
+    отметки лент подписок пользователей users."""
+    keys = [_key(feed) for feed in feeds]
+    for user_id in users:
+        keys += [_following_key(user_id), _key(follow(user_id))]
+    transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def forget_post(post):
+    feeds = [INDEX, author(post.author_id)]
+    if post.group_id:
+        feeds.append(group(post.group.slug))
+    forget(feeds)
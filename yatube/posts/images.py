@@ -0,0 +1,167 @@
+"""Обработка загружаемых картинок постов.
+
+Загрузки пишутся во временный файл на диске, а не в память (см.
+FILE_UPLOAD_HANDLERS). До декодирования проверяются размер файла,
+формат и размеры картинки из заголовка. JPEG декодируется сразу в
+уменьшенном масштабе (draft), картинка ужимается до
+POSTS_IMAGE_MAX_SIDE и сохраняется заново без EXIF, поэтому на диске
+оказываются картинки ограниченного размера. PNG или GIF, не влезающий
+в POSTS_IMAGE_MAX_BYTES, сохраняется в JPEG или WEBP.
+
+Хранилище называет файлы по содержимому, и одинаковые картинки разных
+постов — один файл. Поэтому файл удаляется (release) только тогда,
+когда на него не ссылается больше ни один пост; новый пост с тем же
+файлом после коммита восстанавливает его.
+"""
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.db import transaction
+from PIL import Image, ImageOps
+from sorl import thumbnail
+
+from core.storage import is_immutable
+
+from .models import Post
+
+FORMATS = {
+    'JPEG': ('.jpg', {'quality': 85, 'optimize': True, 'progressive': True}),
+    'PNG': ('.png', {'optimize': True}),
+    'GIF': ('.gif', {}),
+    'WEBP': ('.webp', {'quality': 85}),
+}
+# Ступени качества, по которым ужимается JPEG и WEBP, не влезающий
+# в POSTS_IMAGE_MAX_BYTES.
+QUALITY_STEPS = (85, 75, 65, 50)
+# Во сколько раз уменьшается длинная сторона картинки, которая не
+# влезла и при самом низком качестве.
+SCALE_STEPS = (1, 0.75, 0.5)
+# Файлы меньше этого остаются в памяти, крупнее — уходят на диск.
+SPOOL_SIZE = 512 * 1024
+
+
+def _open(upload):
+    if upload.size > settings.POSTS_IMAGE_MAX_UPLOAD_SIZE:
+        raise ValidationError(
+            'Файл больше %(limit)s МБ.',
+            code='file_too_large',
+            params={'limit': settings.POSTS_IMAGE_MAX_UPLOAD_SIZE // 2 ** 20},
+        )
+    upload.seek(0)
+    # Image.open читает только заголовок: пиксели ещё не декодированы.
+    image = Image.open(upload)
+    if image.format not in FORMATS:
+        raise ValidationError(
+            'Поддерживаются только JPEG, PNG, GIF и WEBP.',
+            code='invalid_format',
+        )
+    width, height = image.size
+    if width * height > settings.POSTS_IMAGE_MAX_PIXELS:
+        raise ValidationError(
+            'Слишком большое разрешение картинки.', code='too_many_pixels'
+        )
+    return image
+
+
+def _encode(image, image_format, quality=None):
+    options = dict(FORMATS[image_format][1])
+    if quality is not None:
+        options['quality'] = quality
+    output = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    image.save(output, image_format, **options)
+    output.seek(0, os.SEEK_END)
+    return output
+
+
+def _lossy(image):
+    """Картинка без ручки качества (PNG, GIF), перекодированная для
+    сжатия с потерями: с прозрачностью — в WEBP, без неё — в JPEG."""
+    if image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info:
+        return image.convert('RGBA'), 'WEBP'
+    if image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    return image, 'JPEG'
+
+
+def _attempts(image, image_format):
+    """Варианты сохранения (картинка, формат, качество) от лучшего."""
+    if 'quality' not in FORMATS[image_format][1]:
+        yield image, image_format, None
+        image, image_format = _lossy(image)
+    width, height = image.size
+    for scale in SCALE_STEPS:
+        scaled = image
+        if scale != 1:
+            scaled = image.resize(
+                (max(round(width * scale), 1), max(round(height * scale), 1)),
+                Image.LANCZOS,
+            )
+        for quality in QUALITY_STEPS:
+            yield scaled, image_format, quality
+
+
+def _fit(image, image_format):
+    """Сохраняет картинку не больше POSTS_IMAGE_MAX_BYTES.
+
+    Возвращает файл и его формат. Сначала снижается качество, PNG и GIF
+    перекодируются в JPEG или WEBP, а если не хватает и этого —
+    картинка уменьшается.
+    """
+    for variant, variant_format, quality in _attempts(image, image_format):
+        output = _encode(variant, variant_format, quality)
+        if output.tell() <= settings.POSTS_IMAGE_MAX_BYTES:
+            output.seek(0)
+            return output, variant_format
+        output.close()
+    raise ValidationError(
+        'Картинка не помещается в %(limit)s КБ даже после сжатия.',
+        code='file_too_large',
+        params={'limit': settings.POSTS_IMAGE_MAX_BYTES // 1024},
+    )
+
+
+def process_upload(upload):
+    """Проверяет и пересохраняет загруженную картинку.
+
+    Возвращает File с уменьшенной картинкой без метаданных или
+    поднимает ValidationError.
+    """
+    image = _open(upload)
+    image_format = image.format
+    max_side = settings.POSTS_IMAGE_MAX_SIDE
+    # draft даёт декодеру JPEG сразу уменьшить картинку в 2–8 раз.
+    image.draft('RGB', (max_side, max_side))
+    # Поворот из EXIF применяем к пикселям: сами метаданные не
+    # сохраняются.
+    image = ImageOps.exif_transpose(image)
+    image.thumbnail((max_side, max_side), Image.LANCZOS)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    image.info.pop('exif', None)
+    output, image_format = _fit(image, image_format)
+    name = os.path.splitext(os.path.basename(upload.name))[0]
+    return File(output, name=name + FORMATS[image_format][0])
+
+
+def release(name):
+    """Снимает ссылку поста на файл картинки.
+
+    После коммита файл и его миниатюры удаляются, если на него больше не
+    ссылается ни один пост. Файлы, загруженные до хранилища по
+    содержимому, принадлежат одному посту и, как раньше, не удаляются.
+    """
+    if not is_immutable(name):
+        return
+
+    def delete():
+        # Под блокировкой хранилища: пост с тем же файлом, закоммиченный
+        # позже, восстановит файл уже после удаления (см. core.storage).
+        with default_storage.lock():
+            if not Post.objects.filter(image=name).exists():
+                thumbnail.delete(name)
+
+    transaction.on_commit(delete)
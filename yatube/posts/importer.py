@@ -0,0 +1,353 @@
+"""Массовый импорт групп, постов, комментариев и подписок.
+
+Строки читаются потоком из JSONL или CSV и пишутся пачками через
+bulk_create, поэтому память не зависит от размера файла. Ссылки в
+строках (автор по username, группа по slug, пост по id) разрешаются
+одним запросом на пачку. При bulk_create сигналы не срабатывают:
+страницы сбрасываются сменой поколений после каждой пачки, а счётчики
+затронутых объектов и поисковый индекс записанных постов обновляются
+в транзакции пачки, так что и они не зависят от размера файла.
+"""
+import csv
+import json
+import os
+from collections import namedtuple
+from contextlib import contextmanager
+
+from django.contrib.auth import get_user_model
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Max, Q
+from django.utils import timezone
+
+from . import cache, counters, high_water, search
+from .models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+BATCH_SIZE = 1000
+FORMATS = ('jsonl', 'csv')
+
+# Как импортируется каждый вид записей: модель, сборка объектов пачки,
+# ignore_conflicts для bulk_create и счётчики, которые надо пересчитать.
+Kind = namedtuple('Kind', 'model build ignore_conflicts counters')
+
+
+def read_rows(path, file_format=None):
+    """Строки файла по одной: словари или ValidationError для битых."""
+    file_format = file_format or os.path.splitext(path)[1].lstrip('.')
+    if file_format not in FORMATS:
+        raise ValueError(f'Неизвестный формат файла: {file_format}')
+    with open(path, newline='', encoding='utf-8') as source:
+        if file_format == 'csv':
+            yield from csv.DictReader(source)
+            return
+        for line in source:
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as error:
+                yield ValidationError(f'Не JSON: {error}')
+                continue
+            if not isinstance(row, dict):
+                row = ValidationError('Строка должна быть объектом JSON.')
+            yield row
+
+
+def _value(row, name):
+    # Пустая ячейка CSV — то же, что отсутствующее поле JSON.
+    value = row.get(name)
+    return None if value == '' else value
+
+
+def _lookup(model, field, values):
+    values = {value for value in values if value is not None}
+    if not values:
+        return {}
+    return dict(
+        model.objects.filter(**{f'{field}__in': values}).values_list(
+            field, 'pk'
+        )
+    )
+
+
+def _new_ids(model, objects):
+    """Отвергает объекты, чей явный id уже занят."""
+    ids = [obj.pk for obj in objects if isinstance(obj, model) and obj.pk]
+    taken = set(
+        model.objects.filter(pk__in=ids).values_list('pk', flat=True)
+    ) if ids else set()
+    result = []
+    for obj in objects:
+        if isinstance(obj, model) and obj.pk:
+            if obj.pk in taken:
+                obj = ValidationError(f'id {obj.pk} уже занят.')
+            else:
+                taken.add(obj.pk)
+        result.append(obj)
+    return result
+
+
+def _build_groups(rows):
+    slugs = {_value(row, 'slug') for row in rows}
+    titles = {_value(row, 'title') for row in rows}
+    taken = set()
+    for slug, title in Group.objects.filter(
+        Q(slug__in=slugs) | Q(title__in=titles)
+    ).values_list('slug', 'title'):
+        taken.update((('slug', slug), ('title', title)))
+    result = []
+    for row in rows:
+        slug, title = _value(row, 'slug'), _value(row, 'title')
+        if ('slug', slug) in taken or ('title', title) in taken:
+            result.append(ValidationError(f'Группа {slug} уже есть.'))
+            continue
+        taken.update((('slug', slug), ('title', title)))
+        result.append(Group(
+            title=title,
+            slug=slug,
+            description=_value(row, 'description') or '',
+        ))
+    return result
+
+
+def _build_posts(rows):
+    authors = _lookup(User, 'username', (_value(r, 'author') for r in rows))
+    groups = _lookup(Group, 'slug', (_value(r, 'group') for r in rows))
+    result = []
+    for row in rows:
+        author, group = _value(row, 'author'), _value(row, 'group')
+        pk = _value(row, 'id')
+        if pk is not None and not str(pk).isdigit():
+            result.append(ValidationError(f'Неверный id {pk}.'))
+        elif author not in authors:
+            result.append(ValidationError(f'Нет пользователя {author}.'))
+        elif group is not None and group not in groups:
+            result.append(ValidationError(f'Нет группы {group}.'))
+        else:
+            result.append(Post(
+                id=int(pk) if pk is not None else None,
+                text=_value(row, 'text'),
+                author_id=authors[author],
+                group_id=groups.get(group),
+                pub_date=_value(row, 'pub_date') or timezone.now(),
+            ))
+    return _new_ids(Post, result)
+
+
+def _build_comments(rows):
+    authors = _lookup(User, 'username', (_value(r, 'author') for r in rows))
+    post_ids = {str(_value(row, 'post')) for row in rows}
+    posts = {
+        str(pk) for pk in Post.objects.filter(
+            pk__in=[pk for pk in post_ids if pk.isdigit()]
+        ).values_list('pk', flat=True)
+    }
+    result = []
+    for row in rows:
+        author, post = _value(row, 'author'), str(_value(row, 'post'))
+        if author not in authors:
+            result.append(ValidationError(f'Нет пользователя {author}.'))
+        elif post not in posts:
+            result.append(ValidationError(f'Нет поста {post}.'))
+        else:
+            result.append(Comment(
+                post_id=int(post),
+                author_id=authors[author],
+                text=_value(row, 'text'),
+                pub_date=_value(row, 'pub_date') or timezone.now(),
+            ))
+    return result
+
+
+def _build_follows(rows):
+    users = _lookup(User, 'username', (
+        _value(row, field) for row in rows for field in ('user', 'author')
+    ))
+    result = []
+    for row in rows:
+        user, author = _value(row, 'user'), _value(row, 'author')
+        missing = [name for name in (user, author) if name not in users]
+        if missing:
+            result.append(ValidationError(f'Нет пользователя {missing[0]}.'))
+        elif user == author:
+            result.append(ValidationError('Нельзя подписаться на себя.'))
+        else:
+            result.append(
+                Follow(user_id=users[user], author_id=users[author])
+            )
+    return result
+
+
+KINDS = {
+    'groups': Kind(Group, _build_groups, False, ()),
+    'posts': Kind(
+        Post, _build_posts, False,
+        (Counter.AUTHOR_POSTS, Counter.GROUP_POSTS),
+    ),
+    'comments': Kind(
+        Comment, _build_comments, False, (Counter.POST_COMMENTS,)
+    ),
+    # Повтор уже существующей подписки пропускается (unique_follow).
+    'follows': Kind(
+        Follow, _build_follows, True,
+        (Counter.USER_FOLLOWERS, Counter.USER_FOLLOWING),
+    ),
+}
+
+
+def _validate(obj):
+    """Проверяет поля объекта без запросов к БД."""
+    if isinstance(obj, ValidationError):
+        return obj
+    related = [
+        field.name for field in obj._meta.fields if field.is_relation
+    ]
+    try:
+        obj.clean_fields(exclude=['image', *related])
+    except ValidationError as error:
+        return error
+    pub_date = getattr(obj, 'pub_date', None)
+    if pub_date is not None and timezone.is_naive(pub_date):
+        obj.pub_date = timezone.make_aware(pub_date)
+    return obj
+
+
+@contextmanager
+def _keep_pub_date():
+    """Не даёт auto_now_add заменить дату из файла текущим временем."""
+    fields = [
+        model._meta.get_field('pub_date') for model in (Post, Comment)
+    ]
+    for field in fields:
+        field.auto_now_add = False
+    try:
+        yield
+    finally:
+        for field in fields:
+            field.auto_now_add = True
+
+
+def _scopes(objects):
+    """Области кэша страниц, где появятся записанные объекты."""
+    scopes = {cache.INDEX}
+    user_ids, group_ids = set(), set()
+    for obj in objects:
+        if isinstance(obj, Group):
+            scopes.update((cache.GROUPS, cache.group_scope(obj.slug)))
+        elif isinstance(obj, Post):
+            user_ids.add(obj.author_id)
+            group_ids.add(obj.group_id)
+        elif isinstance(obj, Comment):
+            scopes.add(cache.post_scope(obj.post_id))
+        elif isinstance(obj, Follow):
+            user_ids.update((obj.user_id, obj.author_id))
+    scopes.update(
+        cache.profile_scope(username) for username in User.objects.filter(
+            pk__in=user_ids
+        ).values_list('username', flat=True)
+    )
+    scopes.update(
+        cache.group_scope(slug) for slug in Group.objects.filter(
+            pk__in=group_ids - {None}
+        ).values_list('slug', flat=True)
+    )
+    return scopes
+
+
+def _forget_high_water(objects):
+    posts = [obj for obj in objects if isinstance(obj, Post)]
+    group_slugs = Group.objects.filter(
+        pk__in={post.group_id for post in posts} - {None}
+    ).values_list('slug', flat=True) if posts else []
+    high_water.forget(
+        [
+            *([high_water.INDEX] if posts else []),
+            *{high_water.author(post.author_id) for post in posts},
+            *(high_water.group(slug) for slug in group_slugs),
+        ],
+        users={obj.user_id for obj in objects if isinstance(obj, Follow)},
+    )
+
+
+def _index_posts(posts, last_id):
+    """Индексирует записанные посты пачки.
+
+    SQLite не возвращает id из bulk_create: новые посты — это явные id
+    и всё, что новее last_id (заодно переиндексируются и посты, которые
+    успели записать параллельно, что безвредно).
+    """
+    explicit = [post.pk for post in posts if post.pk]
+    written = Q(pk__in=explicit)
+    if len(explicit) < len(posts):
+        written |= Q(pk__gt=last_id or 0)
+    search.index_posts(Post.objects.filter(written))
+
+
+def _batches(rows, size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_rows(kind, rows, batch_size=BATCH_SIZE, start=0,
+                on_error=None, on_batch=None):
+    """Импортирует строки rows вида kind пачками по batch_size.
+
+    Первые start строк пропускаются. on_error(номер строки, ошибка)
+    вызывается для каждой отвергнутой строки, on_batch(число
+    прочитанных строк) — после коммита каждой пачки. Возвращает
+    (записано, отвергнуто).
+    """
+    kind = KINDS[kind]
+    imported = rejected = 0
+    numbered = (
+        (number, row) for number, row in enumerate(rows, 1)
+        if number > start
+    )
+    for batch in _batches(numbered, batch_size):
+        valid_rows = [
+            (number, row) for number, row in batch if isinstance(row, dict)
+        ]
+        built = iter(kind.build([row for _, row in valid_rows]))
+        objects = []
+        for number, row in batch:
+            obj = _validate(next(built) if isinstance(row, dict) else row)
+            if isinstance(obj, ValidationError):
+                rejected += 1
+                if on_error:
+                    on_error(number, obj)
+            else:
+                objects.append(obj)
+        with transaction.atomic(), _keep_pub_date():
+            if kind.model is Post:
+                last_id = Post.objects.aggregate(last=Max('id'))['last']
+            kind.model.objects.bulk_create(
+                objects, ignore_conflicts=kind.ignore_conflicts
+            )
+            for counter in kind.counters:
+                field = counters.SOURCES[counter][1]
+                counters.refresh(
+                    counter, {getattr(obj, field) for obj in objects}
+                )
+            if kind.model is Post and objects:
+                _index_posts(objects, last_id)
+        imported += len(objects)
+        if objects:
+            cache.bump(*_scopes(objects))
+            _forget_high_water(objects)
+        if on_batch:
+            on_batch(batch[-1][0])
+    return imported, rejected
+
+
+def finish(kind):
+    """Завершает импорт вида kind: сливает сегменты поискового индекса."""
+    if kind == 'posts':
+        search.optimize()
@@ -0,0 +1,110 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from posts import importer
+
+# Сколько ошибок в строках выводить; остальные только считаются.
+MAX_REPORTED_ERRORS = 100
+
+
+class Command(BaseCommand):
+    help = (
+        'Импортирует группы, посты, комментарии или подписки из JSONL '
+        'или CSV. Прерванный импорт продолжается с контрольной точки.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(importer.KINDS))
+        parser.add_argument('path', help='Файл .jsonl или .csv.')
+        parser.add_argument(
+            '--format',
+            choices=importer.FORMATS,
+            help='Формат файла (по умолчанию по расширению).',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=importer.BATCH_SIZE,
+            help='Сколько строк записывать одной пачкой.',
+        )
+        parser.add_argument(
+            '--checkpoint',
+            help='Файл контрольной точки (по умолчанию <path>.checkpoint).',
+        )
+        parser.add_argument(
+            '--restart',
+            action='store_true',
+            help='Начать с первой строки, не глядя на контрольную точку.',
+        )
+
+    def handle(self, *args, **options):
+        kind, path = options['kind'], os.path.abspath(options['path'])
+        if not os.path.exists(path):
+            raise CommandError(f'Нет файла {path}')
+        file_format = (
+            options['format'] or os.path.splitext(path)[1].lstrip('.')
+        )
+        if file_format not in importer.FORMATS:
+            raise CommandError(f'Неизвестный формат файла: {file_format}')
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля.')
+        self.checkpoint_path = (
+            options['checkpoint'] or f'{path}.checkpoint'
+        )
+        self.state = {
+            'kind': kind, 'path': path, 'rows': 0, 'finished': False,
+        }
+        if not options['restart']:
+            self.load_checkpoint()
+        self.errors = 0
+        imported, rejected = importer.import_rows(
+            kind,
+            importer.read_rows(path, file_format),
+            batch_size=options['batch_size'],
+            start=self.state['rows'],
+            on_error=self.report,
+            on_batch=self.save_checkpoint,
+        )
+        if imported or not self.state['finished']:
+            importer.finish(kind)
+        self.save_checkpoint(finished=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записано: {imported}, отвергнуто строк: {rejected}'
+        ))
+        if kind in ('posts', 'follows'):
+            # Раскладка по лентам для миллионов строк — отдельная работа.
+            self.stdout.write(
+                'Ленты подписок не обновлялись: запустите rebuild_timeline.'
+            )
+
+    def load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path, encoding='utf-8') as checkpoint:
+            saved = json.load(checkpoint)
+        if (saved.get('kind'), saved.get('path')) != (
+            self.state['kind'], self.state['path']
+        ):
+            raise CommandError(
+                f'Контрольная точка {self.checkpoint_path} относится к '
+                'другому импорту; укажите --restart или --checkpoint.'
+            )
+        self.state = saved
+        self.stdout.write(f'Продолжаем со строки {saved["rows"] + 1}')
+
+    def save_checkpoint(self, rows=None, finished=False):
+        if rows is not None:
+            self.state['rows'] = rows
+        self.state['finished'] = finished
+        # Пишем рядом и переименовываем: оборванная запись не портит точку.
+        temp_path = f'{self.checkpoint_path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as checkpoint:
+            json.dump(self.state, checkpoint)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def report(self, number, error):
+        self.errors += 1
+        if self.errors <= MAX_REPORTED_ERRORS:
+            self.stderr.write(f'Строка {number}: {"; ".join(error.messages)}')
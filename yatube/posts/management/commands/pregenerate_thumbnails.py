@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from posts import thumbnails
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = 'Создаёт миниатюры для уже загруженных картинок постов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=None,
+            help='Число процессов (по умолчанию по числу ядер, '
+                 '0 — без пула).',
+        )
+
+    def handle(self, *args, **options):
+        names = Post.objects.exclude(image='').order_by('image').values_list(
+            'image', flat=True
+        ).distinct()
+        done, failed = thumbnails.backfill(
+            names.iterator(), options['workers']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Обработано картинок: {done}, с ошибками: {failed}'
+        ))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+
+from posts import counters
+
+
+class Command(BaseCommand):
+    help = 'Сверяет денормализованные счётчики с таблицами.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--kind',
+            action='append',
+            dest='kinds',
+            choices=sorted(counters.SOURCES),
+            help='Какой счётчик сверять (по умолчанию все).'
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, ничего не меняя.'
+        )
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile(
+            options['kinds'] or None, dry_run=options['dry_run']
+        )
+        for kind, count in fixed.items():
+            self.stdout.write(f'{kind}: расхождений {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Всего расхождений: {sum(fixed.values())}'
+        ))
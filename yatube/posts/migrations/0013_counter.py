@@ -0,0 +1,52 @@
+# Generated by Django 2.2.16 on 2026-10-17 06:33
+
+from django.db import migrations, models
+from django.db.models import Count
+
+SOURCES = (
+    ('author_posts', 'Post', 'author_id'),
+    ('group_posts', 'Post', 'group_id'),
+    ('post_comments', 'Comment', 'post_id'),
+    ('user_followers', 'Follow', 'author_id'),
+    ('user_following', 'Follow', 'user_id'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    Counter = apps.get_model('posts', 'Counter')
+    for kind, model_name, field in SOURCES:
+        model = apps.get_model('posts', model_name)
+        totals = model.objects.exclude(
+            **{f'{field}__isnull': True}
+        ).order_by().values(field).annotate(total=Count('pk'))
+        Counter.objects.bulk_create(
+            [
+                Counter(kind=kind, object_id=row[field], value=row['total'])
+                for row in totals
+            ],
+            batch_size=1000,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0012_timelineentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Counter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('author_posts', 'Посты автора'), ('group_posts', 'Посты группы'), ('post_comments', 'Комментарии к посту'), ('user_followers', 'Подписчики пользователя'), ('user_following', 'Подписки пользователя')], max_length=20, verbose_name='Счётчик')),
+                ('object_id', models.PositiveIntegerField(verbose_name='Объект')),
+                ('value', models.IntegerField(default=0, verbose_name='Значение')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='counter',
+            constraint=models.UniqueConstraint(fields=('kind', 'object_id'), name='unique_counter'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -38,14 +38,32 @@ class Post(CreatedModel):
         verbose_name='Группа',
         help_text='Группа, к которой относится пост'
     )
+    # Индекс нужен проверке, ссылается ли ещё пост на общий файл
+    # картинки (images.release).
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='posts/',
-        blank=True
+        blank=True,
+        db_index=True,
     )
 
     class Meta:
         ordering = ['-pub_date']
+        # Ленты листаются по (pub_date, id): страница — чтение индекса
+        # с нужного места, без сортировки всей таблицы.
+        indexes = [
+            models.Index(
+                fields=['-pub_date', '-id'], name='post_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_date_idx'
+            ),
+        ]
 
     def __str__(self):
         return self.text[:15]
@@ -69,6 +87,14 @@ class Comment(CreatedModel):
         help_text='Текст нового комментария'
     )
 
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['post', 'pub_date', 'id'],
+                name='comment_post_date_idx'
+            )
+        ]
+
     def __str__(self):
         return self.text
 
@@ -97,3 +123,71 @@ class Follow(models.Model):
 
     def __str__(self):
         return str(self.author)
+
+
+class TimelineEntry(models.Model):
+    """Пост в ленте подписок пользователя, записанный при публикации."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Читатель'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField('Дата создания поста')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'post'],
+                name='unique_timeline_entry'
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_date_post_idx'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.user} <- {self.post_id}'
+
+
+class Counter(models.Model):
+    """Денормализованный счётчик, обновляемый вместе с записями."""
+    AUTHOR_POSTS = 'author_posts'
+    GROUP_POSTS = 'group_posts'
+    POST_COMMENTS = 'post_comments'
+    USER_FOLLOWERS = 'user_followers'
+    USER_FOLLOWING = 'user_following'
+    KIND_CHOICES = (
+        (AUTHOR_POSTS, 'Посты автора'),
+        (GROUP_POSTS, 'Посты группы'),
+        (POST_COMMENTS, 'Комментарии к посту'),
+        (USER_FOLLOWERS, 'Подписчики пользователя'),
+        (USER_FOLLOWING, 'Подписки пользователя'),
+    )
+    kind = models.CharField(
+        max_length=20,
+        choices=KIND_CHOICES,
+        verbose_name='Счётчик'
+    )
+    object_id = models.PositiveIntegerField(verbose_name='Объект')
+    value = models.IntegerField(default=0, verbose_name='Значение')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'object_id'],
+                name='unique_counter'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.kind}:{self.object_id}={self.value}'
@@ -0,0 +1,57 @@
+"""Запросы лент постов.
+
+Все списки постов строятся здесь: автор и группа всегда подтягиваются
+одним JOIN, а из таблиц выбираются только поля, нужные карточке поста.
+"""
+from . import timeline
+from .models import Post
+
+CARD_FIELDS = (
+    'id',
+    'text',
+    'pub_date',
+    'image',
+    'author',
+    'author__username',
+    'author__first_name',
+    'author__last_name',
+    'group',
+    'group__slug',
+    'group__title',
+)
+
+# Допустимое число запросов к БД на одну страницу ленты. Миниатюры
+# страницы ищутся одним запросом (см. thumbnails.resolve), а создание
+# миниатюры, которое бывает один раз на картинку, в бюджет не входит.
+# Комментарии карточек — два запроса (счётчики и последние комментарии)
+# и ещё два при первом показе поста, когда его счётчик пересчитывается
+# и записывается (см. comments.previews). Профиль так же читает
+# счётчики автора: шесть запросов и по два на недостающие счётчики
+# автора и карточек (см. counters.get_many).
+INDEX_BUDGET = 7
+GROUP_BUDGET = 8
+PROFILE_BUDGET = 10
+FOLLOW_BUDGET = 9
+SEARCH_BUDGET = 6
+BUDGET_IGNORED_TABLES = ('thumbnail_kvstore',)
+
+
+def feed(posts):
+    """Готовит queryset постов к выводу карточками."""
+    return posts.select_related('author', 'group').only(*CARD_FIELDS)
+
+
+def index_feed():
+    return feed(Post.objects.all())
+
+
+def group_feed(group):
+    return feed(Post.objects.filter(group=group))
+
+
+def profile_feed(author):
+    return feed(Post.objects.filter(author=author))
+
+
+def follow_feed(user):
+    return feed(timeline.follow_feed(user))
@@ -0,0 +1,208 @@
+"""Полнотекстовый поиск по постам.
+
+Тексты постов лежат в виртуальной таблице SQLite FTS5 posts_post_fts
+(rowid — id поста), которую сигналы обновляют при записи и удалении
+постов, а команда rebuild_search_index пересобирает целиком. Результаты
+упорядочены по релевантности BM25, делённой на возраст поста, и
+листаются курсором (оценка, id). На других СУБД поиск сводится к
+icontains по тексту.
+"""
+import base64
+import binascii
+import json
+import re
+import time
+
+from django.core.paginator import Page, Paginator
+from django.db import connection
+
+from . import queries
+from .models import Post
+
+FTS_TABLE = 'posts_post_fts'
+# Через сколько дней оценка поста уменьшается вдвое.
+RECENCY_HALF_LIFE_DAYS = 30
+MAX_TERMS = 8
+
+SEARCH_SQL = f"""
+SELECT id, score FROM (
+    SELECT post.id AS id,
+        -bm25({FTS_TABLE})
+            / (1 + (%s - julianday(post.pub_date)) / %s) AS score
+    FROM {FTS_TABLE}
+    JOIN posts_post AS post ON post.id = {FTS_TABLE}.rowid
+    WHERE {FTS_TABLE} MATCH %s
+)
+{{where}}
+ORDER BY score DESC, id DESC
+LIMIT %s
+"""
+
+
+def is_available():
+    return connection.vendor == 'sqlite'
+
+
+def match_expression(text):
+    """Запрос FTS5 из слов text: все слова, каждое как префикс.
+
+    Слова берутся в кавычки, так что синтаксис FTS5 в тексте
+    пользователя не работает и не ломает запрос.
+    """
+    terms = re.findall(r'\w+', text.lower())[:MAX_TERMS]
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def index(post):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post.pk])
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) VALUES (%s, %s)',
+            [post.pk, post.text],
+        )
+
+
+def unindex(post_id):
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid = %s', [post_id]
+        )
+
+
+def index_posts(posts):
+    """Индексирует посты из queryset posts, не читая их в память."""
+    if not is_available():
+        return
+    sql, params = posts.order_by().values_list(
+        'id', 'text'
+    ).query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'DELETE FROM {FTS_TABLE} WHERE rowid IN '
+            f'(SELECT id FROM ({sql}))',
+            params,
+        )
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) {sql}', params
+        )
+
+
+def optimize():
+    """Сливает сегменты индекса после массовой записи."""
+    if not is_available():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('optimize')"
+        )
+
+
+def rebuild():
+    """Пересобирает индекс по таблице постов. Возвращает число постов."""
+    if not is_available():
+        return 0
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {FTS_TABLE}')
+        cursor.execute(
+            f'INSERT INTO {FTS_TABLE} (rowid, text) '
+            'SELECT id, text FROM posts_post'
+        )
+        count = cursor.rowcount
+    optimize()
+    return count
+
+
+def filter_posts(posts, text):
+    """Оставляет в queryset постов только найденные по text."""
+    expression = match_expression(text)
+    if not expression:
+        return posts.none()
+    if not is_available():
+        return posts.filter(text__icontains=text)
+    # Не pk__in=RawSQL(...): Django берёт подзапрос в двойные скобки, и
+    # SQLite читает IN ((SELECT ...)) как сравнение с одним значением.
+    id_column = '{}.{}'.format(
+        *map(connection.ops.quote_name, (posts.model._meta.db_table, 'id'))
+    )
+    return posts.extra(
+        where=[
+            f'{id_column} IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)'
+        ],
+        params=[expression],
+    )
+
+
+def _julian_now():
+    return time.time() / 86400 + 2440587.5
+
+
+def encode_cursor(score, pk, now):
+    payload = json.dumps([score, pk, now])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        score, pk, now = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if not all(isinstance(value, (int, float)) for value in (score, pk, now)):
+        return None
+    return float(score), int(pk), float(now)
+
+
+class SearchPaginator(Paginator):
+    """Страницы результатов поиска по курсору (оценка, id).
+
+    Момент первого запроса сохраняется в курсоре: оценки зависят от
+    возраста постов и иначе сдвигались бы между страницами.
+    """
+    cursor_mode = True
+    previous_cursor = None
+
+    def __init__(self, text, per_page, cursor=None):
+        super().__init__([], per_page)
+        self.text = text
+        self.cursor = cursor
+        self.next_cursor = None
+
+    @property
+    def num_pages(self):
+        return 2 if self.next_cursor else 1
+
+    def page(self, number=1):
+        expression = match_expression(self.text)
+        if not expression:
+            return Page([], 1, self)
+        if not is_available():
+            posts = queries.feed(filter_posts(Post.objects.all(), self.text))
+            return Page(list(posts[:self.per_page]), 1, self)
+        position = decode_cursor(self.cursor) if self.cursor else None
+        if position is None:
+            now, where, params = _julian_now(), '', []
+        else:
+            score, pk, now = position
+            where = 'WHERE score < %s OR (score = %s AND id < %s)'
+            params = [score, score, pk]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                SEARCH_SQL.format(where=where),
+                [now, RECENCY_HALF_LIFE_DAYS, expression, *params,
+                 self.per_page + 1],
+            )
+            rows = cursor.fetchall()
+        has_next = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        posts = queries.feed(Post.objects.filter(
+            pk__in=[pk for pk, _ in rows]
+        )).in_bulk()
+        if has_next:
+            pk, score = rows[-1]
+            self.next_cursor = encode_cursor(score, pk, now)
+        return Page([posts[pk] for pk, _ in rows if pk in posts], 1, self)
@@ -0,0 +1,196 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_delete, post_init, post_save
+from django.dispatch import receiver
+
+from . import (cache, counters, events, high_water, images, search,
+               thumbnails, timeline)
+from .models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+def bump_post_pages(post, *group_ids):
+    """Сбрасывает страницы, на которых показан пост."""
+    scopes = [
+        cache.INDEX,
+        cache.post_scope(post.pk),
+        cache.profile_scope(post.author.username),
+    ]
+    slugs = Group.objects.filter(
+        pk__in=[group_id for group_id in group_ids if group_id]
+    ).values_list('slug', flat=True)
+    scopes.extend(cache.group_scope(slug) for slug in slugs)
+    cache.bump(*scopes)
+
+
+def on_first_page(posts, post_id):
+    """Виден ли пост на первой странице ленты posts."""
+    return post_id in posts.order_by('-pub_date', '-id').values_list(
+        'id', flat=True
+    )[:settings.MAX_NUMBER_OF_POSTS]
+
+
+def bump_comment_pages(comment):
+    """Сбрасывает страницу поста и первые страницы лент с его карточкой.
+
+    Карточка показывает число и последние комментарии поста, но сброс
+    всей ленты на каждый комментарий лишил бы её кэша. Глубже первой
+    страницы карточка обновится со следующим постом ленты или по
+    истечении страницы.
+    """
+    post = Post.objects.filter(pk=comment.post_id).values(
+        'author_id', 'author__username', 'group_id', 'group__slug'
+    ).first()
+    scopes = [cache.post_scope(comment.post_id)]
+    if post is not None:
+        feeds = {
+            cache.INDEX: Post.objects.all(),
+            cache.profile_scope(post['author__username']):
+                Post.objects.filter(author_id=post['author_id']),
+        }
+        if post['group_id']:
+            feeds[cache.group_scope(post['group__slug'])] = (
+                Post.objects.filter(group_id=post['group_id'])
+            )
+        scopes += [
+            scope for scope, posts in feeds.items()
+            if on_first_page(posts, comment.post_id)
+        ]
+    cache.bump(*scopes)
+
+
+def bump_follow_pages(follow):
+    cache.bump(
+        cache.profile_scope(follow.author.username),
+        cache.profile_scope(follow.user.username),
+    )
+
+
+@receiver(post_init, sender=Post)
+def post_loaded(sender, instance, **kwargs):
+    # Запоминаем группу и картинку без обращения к отложенным полям.
+    instance._loaded_group_id = instance.__dict__.get('group_id')
+    instance._loaded_image = str(instance.__dict__.get('image') or '')
+
+
+@receiver(post_save, sender=Post)
+def post_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    old_group_id = instance._loaded_group_id
+    instance._loaded_group_id = instance.group_id
+    if instance._loaded_image and instance._loaded_image != str(
+        instance.image
+    ):
+        thumbnails.forget(instance._loaded_image)
+        images.release(instance._loaded_image)
+    instance._loaded_image = str(instance.image)
+    bump_post_pages(instance, instance.group_id, old_group_id)
+    search.index(instance)
+    if created:
+        high_water.forget_post(instance)
+        events.post_created(instance)
+        timeline.fan_out(instance)
+        counters.change(Counter.AUTHOR_POSTS, instance.author_id, 1)
+        counters.change(Counter.GROUP_POSTS, instance.group_id, 1)
+    elif old_group_id != instance.group_id:
+        counters.change(Counter.GROUP_POSTS, old_group_id, -1)
+        counters.change(Counter.GROUP_POSTS, instance.group_id, 1)
+
+
+@receiver(post_delete, sender=Post)
+def post_deleted(sender, instance, **kwargs):
+    bump_post_pages(instance, instance.group_id)
+    thumbnails.forget(str(instance.image))
+    images.release(str(instance.image))
+    search.unindex(instance.pk)
+    counters.change(Counter.AUTHOR_POSTS, instance.author_id, -1)
+    counters.change(Counter.GROUP_POSTS, instance.group_id, -1)
+    counters.delete(Counter.POST_COMMENTS, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def comment_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        bump_comment_pages(instance)
+        counters.change(Counter.POST_COMMENTS, instance.post_id, 1)
+        events.comment_created(instance)
+
+
+@receiver(post_delete, sender=Comment)
+def comment_deleted(sender, instance, **kwargs):
+    bump_comment_pages(instance)
+    counters.change(Counter.POST_COMMENTS, instance.post_id, -1)
+
+
+@receiver(post_save, sender=Follow)
+def follow_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        timeline.add_author(instance.user_id, instance.author_id)
+        high_water.forget(users=[instance.user_id])
+        bump_follow_pages(instance)
+        counters.change(Counter.USER_FOLLOWERS, instance.author_id, 1)
+        counters.change(Counter.USER_FOLLOWING, instance.user_id, 1)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_deleted(sender, instance, **kwargs):
+    timeline.remove_author(instance.user_id, instance.author_id)
+    high_water.forget(users=[instance.user_id])
+    bump_follow_pages(instance)
+    counters.change(Counter.USER_FOLLOWERS, instance.author_id, -1)
+    counters.change(Counter.USER_FOLLOWING, instance.user_id, -1)
+    timeline.follower_removed(instance.author_id)
+
+
+@receiver(post_init, sender=Group)
+def group_loaded(sender, instance, **kwargs):
+    instance._loaded_slug = instance.__dict__.get('slug')
+
+
+@receiver(post_save, sender=Group)
+def group_saved(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    scopes = {cache.INDEX, cache.GROUPS, cache.group_scope(instance.slug)}
+    if instance._loaded_slug:
+        scopes.add(cache.group_scope(instance._loaded_slug))
+    instance._loaded_slug = instance.slug
+    cache.bump(*scopes)
+
+
+@receiver(post_delete, sender=Group)
+def group_deleted(sender, instance, **kwargs):
+    cache.bump(cache.INDEX, cache.GROUPS, cache.group_scope(instance.slug))
+    counters.delete(Counter.GROUP_POSTS, instance.pk)
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    instance._loaded_username = instance.__dict__.get('username')
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Вход пользователя обновляет только last_login: страницы не меняются.
+    if raw or update_fields == frozenset({'last_login'}):
+        return
+    scopes = {
+        cache.INDEX, cache.AUTHORS, cache.profile_scope(instance.username)
+    }
+    if instance._loaded_username:
+        scopes.add(cache.profile_scope(instance._loaded_username))
+    instance._loaded_username = instance.username
+    cache.bump(*scopes)
+
+
+@receiver(post_delete, sender=User)
+def user_deleted(sender, instance, **kwargs):
+    cache.bump(
+        cache.INDEX, cache.AUTHORS, cache.profile_scope(instance.username)
+    )
+    for kind in (
+        Counter.AUTHOR_POSTS, Counter.USER_FOLLOWERS, Counter.USER_FOLLOWING
+    ):
+        counters.delete(kind, instance.pk)
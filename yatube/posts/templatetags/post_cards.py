@@ -0,0 +1,41 @@
+from django import template
+from django.conf import settings
+from django.core.cache import cache
+from django.template.loader import render_to_string
+
+from .. import comments, thumbnails
+from ..cache import card_keys
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_cards(posts):
+    """Отрисованные карточки постов, взятые из кэша там, где возможно.
+
+    Все карточки страницы читаются и сохраняются одним запросом к кэшу,
+    миниатюры и комментарии недостающих карточек тоже ищутся все сразу.
+    """
+    posts = list(posts)
+    keys = card_keys(posts)
+    cards = cache.get_many(keys)
+    missing = [
+        (post, key) for post, key in zip(posts, keys) if key not in cards
+    ]
+    images = thumbnails.resolve(
+        [post.image.name for post, _ in missing if post.image]
+    )
+    previews = comments.previews(post.pk for post, _ in missing)
+    rendered = {}
+    for post, key in missing:
+        comment_count, latest_comments = previews[post.pk]
+        rendered[key] = render_to_string('includes/post_card.html', {
+            'post': post,
+            'thumbnail': images.get(post.image.name),
+            'comment_count': comment_count,
+            'latest_comments': latest_comments,
+        })
+    if rendered:
+        cache.set_many(rendered, settings.POSTS_CARD_CACHE_TIMEOUT)
+        cards.update(rendered)
+    return [cards[key] for key in keys]
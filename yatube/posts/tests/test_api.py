@@ -0,0 +1,206 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import Client, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .. import high_water
+from ..models import Follow, Group, Post
+
+User = get_user_model()
+
+
+class ApiTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.reader = User.objects.create_user(username='TestReader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        for number in range(25):
+            Post.objects.create(
+                text=f'Пост {number}',
+                author=cls.author,
+                group=cls.group if number % 5 == 0 else None,
+            )
+        Post.objects.create(text='Пост читателя', author=cls.reader)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_pages_by_cursor(self):
+        """Лента листается курсором без повторов и пропусков."""
+        first = self.client.get(reverse('posts:api_index')).json()
+        self.assertEqual(len(first['results']), 20)
+        self.assertIsNone(first['previous'])
+        second = self.client.get(first['next']).json()
+        self.assertEqual(len(second['results']), 6)
+        self.assertIsNone(second['next'])
+        ids = [post['id'] for post in first['results'] + second['results']]
+        self.assertEqual(
+            ids, list(Post.objects.values_list('id', flat=True))
+        )
+        back = self.client.get(second['previous']).json()
+        self.assertEqual(back['results'], first['results'])
+
+    def test_sparse_fields(self):
+        """fields= оставляет в ответе только перечисленные поля."""
+        url = reverse('posts:api_group', args=('test-slug',))
+        response = self.client.get(url, {'fields': 'text,author'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 5)
+        self.assertEqual(
+            results[0], {'text': 'Пост 20', 'author': 'TestAuthor'}
+        )
+        response = self.client.get(url, {'fields': 'text,password'})
+        self.assertEqual(response.status_code, 400)
+        response = self.client.get(
+            reverse('posts:api_profile', args=('TestReader',))
+        )
+        post = response.json()['results'][0]
+        self.assertEqual(set(post), {
+            'id', 'text', 'pub_date', 'author', 'group', 'image'
+        })
+        self.assertIsNone(post['group'])
+
+    def test_responses_are_cached_with_etags(self):
+        """Повторный запрос не ходит в БД, а с ETag получает 304."""
+        url = reverse('posts:api_profile', args=('TestAuthor',))
+        response = self.client.get(url)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get(url).content, response.content)
+            self.assertEqual(self.client.get(
+                url, HTTP_IF_NONE_MATCH=response['ETag']
+            ).status_code, 304)
+        Post.objects.create(text='Новый пост', author=ApiTests.author)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.json()['results'][0]['text'], 'Новый пост')
+        response = self.client.get(
+            reverse('posts:api_group', args=('nope',))
+        )
+        self.assertEqual(response.status_code, 404)
+
+    def test_follow_feed(self):
+        url = reverse('posts:api_follow')
+        self.assertEqual(self.client.get(url).status_code, 401)
+        self.client.force_login(ApiTests.reader)
+        response = self.client.get(url, {'fields': 'author'})
+        self.assertEqual(
+            {post['author'] for post in response.json()['results']},
+            {'TestAuthor'},
+        )
+        response = self.client.get(
+            url, {'fields': 'author'}, HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(response.status_code, 304)
+
+
+@mock.patch('django.db.transaction.on_commit', side_effect=lambda f: f())
+class PostsSinceTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.reader = User.objects.create_user(username='TestReader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(text='Старый пост', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def poll(self, url, after):
+        return self.client.get(url, {'after': after, 'fields': 'id,text'})
+
+    def test_poll_without_new_posts_skips_database(self, on_commit):
+        """Без новых постов опрос отвечает 304 по отметке из кэша."""
+        url = reverse('posts:api_index_since')
+        after = PostsSinceTests.post.pk
+        self.assertEqual(self.poll(url, after).status_code, 304)
+        with self.assertNumQueries(0):
+            response = self.poll(url, after)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(self.poll(url, 'abc').status_code, 400)
+
+    def test_new_posts_are_returned(self, on_commit):
+        """Новые посты приходят, а отметка ленты обновляется."""
+        urls = [
+            reverse('posts:api_index_since'),
+            reverse('posts:api_group_since', args=('test-slug',)),
+        ]
+        after = PostsSinceTests.post.pk
+        for url in urls:
+            self.poll(url, after)
+        new = Post.objects.create(
+            text='Новый пост',
+            author=PostsSinceTests.author,
+            group=PostsSinceTests.group,
+        )
+        for url in urls:
+            with self.subTest(url=url):
+                data = self.poll(url, after).json()
+                self.assertEqual(
+                    data['results'], [{'id': new.pk, 'text': 'Новый пост'}]
+                )
+                self.assertEqual(data['high_water'], new.pk)
+                self.assertFalse(data['truncated'])
+                self.assertEqual(self.poll(url, new.pk).status_code, 304)
+
+    def test_follow_feed(self, on_commit):
+        url = reverse('posts:api_follow_since')
+        self.assertEqual(self.poll(url, 0).status_code, 401)
+        self.client.force_login(PostsSinceTests.reader)
+        self.assertEqual(self.poll(url, 0).status_code, 304)
+        Follow.objects.create(
+            user=PostsSinceTests.reader, author=PostsSinceTests.author
+        )
+        data = self.poll(url, 0).json()
+        self.assertEqual(data['results'][0]['text'], 'Старый пост')
+        new = Post.objects.create(
+            text='Новый пост', author=PostsSinceTests.author
+        )
+        data = self.poll(url, PostsSinceTests.post.pk).json()
+        self.assertEqual(
+            data['results'], [{'id': new.pk, 'text': 'Новый пост'}]
+        )
+
+    def test_cold_follow_poll_reads_one_mark(self, on_commit):
+        """Отметка ленты подписок считается одним MAX, сколько бы авторов
+        ни было в подписках."""
+        self.client.force_login(PostsSinceTests.reader)
+        for number in range(3):
+            author = User.objects.create_user(username=f'Author{number}')
+            Follow.objects.create(user=PostsSinceTests.reader, author=author)
+            Post.objects.create(text='Пост', author=author)
+        cache.clear()
+        with CaptureQueriesContext(connection) as context:
+            self.poll(reverse('posts:api_follow_since'), 0)
+        self.assertEqual(
+            sum('MAX(' in query['sql'] for query in context), 1
+        )
+
+    def test_recomputed_mark_expires_soon(self, on_commit):
+        """Отметка, посчитанная по БД, могла устареть до коммита нового
+        поста, поэтому кэшируется ненадолго."""
+        with mock.patch.object(
+            high_water.cache, 'add', wraps=high_water.cache.add
+        ) as add:
+            high_water.latest([high_water.INDEX])
+        add.assert_called_once_with(
+            'high-water:index', PostsSinceTests.post.pk,
+            high_water.MARK_TIMEOUT,
+        )
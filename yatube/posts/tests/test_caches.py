@@ -1,9 +1,23 @@
+import os
+import pickle
+import tempfile
+import time
+from unittest import mock
+
 from django.contrib.auth import get_user_model
-from django.core.cache import cache
-from django.test import Client, TestCase
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache, caches
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase
 from django.urls import reverse
 
-from ..models import Post
+from core import page_cache
+from core.caches.sqlite import SQLiteCache
+from core.caches.tiered import TieredCache
+from core.page_cache import cache_page_swr
+
+from ..models import Comment, Follow, Group, Post
+from ..templatetags.post_cards import post_cards
 
 User = get_user_model()
 
@@ -13,13 +27,20 @@ class CachesTests(TestCase):
     def setUpClass(cls):
         super().setUpClass()
         cls.user = User.objects.create_user(username='TestUsername')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
         cls.post = Post.objects.create(
             text='Текст',
             author=cls.user,
+            group=cls.group,
         )
 
     def setUp(self):
         self.client = Client()
+        cache.clear()
 
     def test_index_cache(self):
         """Проверка кэширования страницы index."""
@@ -28,9 +49,439 @@ class CachesTests(TestCase):
             CachesTests.post.text, response.context['page_obj'][0].text
         )
         temp = response.content
-        Post.objects.get(id=CachesTests.post.id).delete()
+        # Изменение в обход сигналов не сбрасывает закэшированную страницу.
+        Post.objects.filter(id=CachesTests.post.id).update(text='Другой')
         response_2 = self.client.get(reverse('posts:index'))
-        self.assertEqual(len(temp), len(response_2.content))
-        cache.clear()
+        self.assertEqual(temp, response_2.content)
+        # Удаление поста сразу сбрасывает кэш без cache.clear().
+        Post.objects.get(id=CachesTests.post.id).delete()
         response_3 = self.client.get(reverse('posts:index'))
-        self.assertNotEqual(len(temp), len(response_3.content))
+        self.assertNotEqual(temp, response_3.content)
+
+    def test_pages_are_invalidated_on_writes(self):
+        """Записи в Post, Group и User сразу сбрасывают свои страницы."""
+        pages = {
+            reverse('posts:index'): lambda: Post.objects.create(
+                text='Новый пост', author=CachesTests.user
+            ),
+            reverse(
+                'posts:group_list', kwargs={'slug': CachesTests.group.slug}
+            ): lambda: Group.objects.get(pk=CachesTests.group.pk).save(),
+            reverse(
+                'posts:profile', kwargs={'username': CachesTests.user}
+            ): lambda: User.objects.get(pk=CachesTests.user.pk).save(),
+        }
+        for url, write in pages.items():
+            with self.subTest(url=url):
+                self.assertIsNotNone(self.client.get(url).context)
+                self.assertIsNone(self.client.get(url).context)
+                write()
+                self.assertIsNotNone(self.client.get(url).context)
+
+    def test_login_does_not_invalidate_pages(self):
+        """Обновление last_login при входе не сбрасывает кэш анонимов."""
+        self.client.get(reverse('posts:index'))
+        Client().force_login(CachesTests.user)
+        self.assertIsNone(self.client.get(reverse('posts:index')).context)
+
+    def test_user_pages_are_not_shared(self):
+        """Страница, отрисованная для вошедшего пользователя, не попадает
+        в кэш и не отдаётся анониму."""
+        reader = User.objects.create_user(username='bobby')
+        Follow.objects.create(user=reader, author=CachesTests.user)
+        url = reverse('posts:profile', args=(CachesTests.user.username,))
+        self.client.force_login(reader)
+        self.assertIn('bobby', self.client.get(url).content.decode())
+        response = Client().get(url)
+        self.assertIsNotNone(response.context)
+        self.assertFalse(response.context['following'])
+        self.assertNotIn('bobby', response.content.decode())
+        self.assertIsNotNone(self.client.get(url).context)
+
+
+class StaleWhileRevalidateTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        page_cache._stats.clear()
+        self.factory = RequestFactory()
+        self.calls = 0
+
+        def view(request):
+            self.calls += 1
+            return HttpResponse(f'версия {self.calls}')
+
+        self.view = cache_page_swr(60, key_prefix='swr-test')(view)
+
+    def get(self):
+        request = self.factory.get('/swr/')
+        return self.view(request).content.decode()
+
+    def test_stale_page_is_served_while_refreshing(self):
+        """Истёкшую страницу отдают, пока её пересчитывает другой воркер."""
+        self.assertEqual(self.get(), 'версия 1')
+        self.assertEqual(self.get(), 'версия 1')
+        later = time.time() + 61
+        with mock.patch('core.page_cache.time.time', return_value=later):
+            lock_key = page_cache._lock_key(
+                self.factory.get('/swr/'), 'swr-test'
+            )
+            cache.add(lock_key, 1)
+            self.assertEqual(self.get(), 'версия 1')
+            cache.delete(lock_key)
+            self.assertEqual(self.get(), 'версия 2')
+        self.assertEqual(self.calls, 2)
+        stats = page_cache.get_stats()['view']
+        self.assertEqual(stats['miss'], 1)
+        self.assertEqual(stats['stale'], 1)
+        self.assertEqual(stats['refresh'], 1)
+
+    def test_hit_does_not_write_to_cache(self):
+        """Попадание только читает кэш, счётчики — в памяти процесса."""
+        self.get()
+        with mock.patch.object(cache, 'add') as add, \
+                mock.patch.object(cache, 'incr') as incr, \
+                mock.patch.object(cache, 'set') as cache_set:
+            self.assertEqual(self.get(), 'версия 1')
+        add.assert_not_called()
+        incr.assert_not_called()
+        cache_set.assert_not_called()
+        self.assertEqual(page_cache.get_stats()['view']['hit'], 1)
+
+    def test_users_get_their_own_pages(self):
+        """Страницы вошедших пользователей и запросов с сессией не
+        берутся из общего кэша и не кладутся в него."""
+        view = cache_page_swr(60, key_prefix='swr-users', name='users')(
+            lambda request: HttpResponse(request.user.username)
+        )
+        bodies = []
+        for username in ('first', 'second'):
+            request = self.factory.get('/swr/')
+            request.user = User.objects.create_user(username=username)
+            bodies.append(view(request).content.decode())
+        self.assertEqual(bodies, ['first', 'second'])
+        request = self.factory.get('/swr/', HTTP_COOKIE='sessionid=abc')
+        request.user = AnonymousUser()
+        view(request)
+        request = self.factory.get('/swr/')
+        request.user = AnonymousUser()
+        self.assertEqual(view(request).content.decode(), '')
+        self.assertEqual(page_cache.get_stats()['users']['miss'], 1)
+
+    def test_stats_endpoint_requires_staff(self):
+        staff = User.objects.create_user(username='TestStaff', is_staff=True)
+        url = reverse('core:cache_stats')
+        self.assertEqual(Client().get(url).status_code, 302)
+        client = Client()
+        client.force_login(staff)
+        stats = client.get(url).json()
+        self.assertIn('pages', stats)
+        self.assertIn('l1_hits', stats['tiers'])
+
+
+class SQLiteCacheTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.location = os.path.join(directory.name, 'cache.sqlite3')
+        self.cache = self.make_cache()
+
+    def make_cache(self, **options):
+        return SQLiteCache(self.location, {'OPTIONS': options})
+
+    def test_cache_is_shared_between_instances(self):
+        """Запись одного процесса видна другому, add и incr атомарны."""
+        other = self.make_cache()
+        self.assertTrue(self.cache.add('key', 1))
+        self.assertFalse(other.add('key', 2))
+        self.assertEqual(other.incr('key', 5), 6)
+        self.assertEqual(self.cache.get('key'), 6)
+        other.delete('key')
+        self.assertIsNone(self.cache.get('key'))
+        with self.assertRaises(ValueError):
+            self.cache.incr('key')
+
+    def test_entries_expire(self):
+        """Истёкшая запись не читается и может быть добавлена заново."""
+        self.cache.set('key', 'old', 10)
+        self.cache.set('forever', 'value', None)
+        later = time.time() + 11
+        with mock.patch('core.caches.sqlite.time.time', return_value=later):
+            self.assertIsNone(self.cache.get('key'))
+            self.assertEqual(self.cache.get_many(['key', 'forever']), {
+                'forever': 'value'
+            })
+            self.assertTrue(self.cache.add('key', 'new'))
+            self.assertEqual(self.cache.get('key'), 'new')
+
+    def test_least_recently_used_entries_are_evicted(self):
+        """Переполнение вытесняет давно не читанные записи."""
+        cache = self.make_cache(MAX_BYTES=10 * 1024)
+        now = time.time()
+        for number in range(5):
+            with mock.patch(
+                'core.caches.sqlite.time.time', return_value=now + number * 2
+            ):
+                cache.set(f'key-{number}', 'x' * 1500)
+        with mock.patch('core.caches.sqlite.time.time', return_value=now + 20):
+            cache.get('key-0')
+            cache.set('big', 'x' * 5000)
+        self.assertLessEqual(cache.size(), 10 * 1024)
+        self.assertIn('key-0', cache.get_many(['key-0']))
+        self.assertIsNone(cache.get('key-1'))
+        self.assertEqual(cache.get('big'), 'x' * 5000)
+
+
+class TieredCacheTests(TestCase):
+    def setUp(self):
+        caches['shared'].clear()
+        self.page = 'страница ' * 100
+
+    def make_cache(self, name, max_bytes=1024 * 1024):
+        cache = TieredCache(name, {'OPTIONS': {
+            'L2': 'shared', 'MIN_BYTES': 100, 'MAX_BYTES': max_bytes,
+        }})
+        cache.clear()
+        return cache
+
+    def test_l1_copy_is_dropped_when_l2_entry_changes(self):
+        """Запись в одном процессе сразу устаревает копии в L1 других."""
+        first = self.make_cache('first')
+        second = self.make_cache('second')
+        first.set('page', self.page)
+        self.assertEqual(second.get('page'), self.page)
+        self.assertEqual(second.get('page'), self.page)
+        first.set('page', 'новая ' + self.page)
+        self.assertEqual(second.get('page'), 'новая ' + self.page)
+        first.delete('page')
+        self.assertIsNone(second.get('page'))
+        stats = second.stats()
+        self.assertEqual(stats['l1_hits'], 1)
+        self.assertEqual(stats['l1_stale'], 2)
+        self.assertEqual(stats['l2_hits'], 2)
+        self.assertEqual(stats['l2_misses'], 1)
+
+    def test_l1_evicts_least_recently_used_by_bytes(self):
+        """L1 держится в бюджете байтов, вытесняя давно не читанное."""
+        size = len(pickle.dumps(self.page, pickle.HIGHEST_PROTOCOL))
+        tiered = self.make_cache('small', max_bytes=size * 2)
+        tiered.set('first', self.page)
+        tiered.set('second', self.page)
+        tiered.get('first')
+        tiered.set('third', self.page)
+        self.assertEqual(tiered.stats()['l1_evictions'], 1)
+        self.assertEqual(tiered.get('second'), self.page)
+        self.assertEqual(tiered.stats()['l2_hits'], 1)
+
+    def test_small_values_stay_in_l2(self):
+        """Мелкие значения и счётчики не занимают L1."""
+        tiered = self.make_cache('counters')
+        self.assertTrue(tiered.add('counter', 1))
+        self.assertEqual(tiered.incr('counter'), 2)
+        self.assertEqual(tiered.get('counter'), 2)
+        self.assertEqual(tiered.stats()['l1_entries'], 0)
+
+
+class PostCardsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(
+            username='TestUsername', first_name='Имя'
+        )
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Текст', author=cls.user, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def render(self):
+        post = Post.objects.select_related('author', 'group').get(
+            pk=PostCardsTests.post.pk
+        )
+        return post_cards([post])[0]
+
+    def test_card_is_cached_until_post_author_or_group_change(self):
+        """Карточка берётся из кэша и сбрасывается правкой её данных."""
+        card = self.render()
+        self.assertIn('Тестовая группа', card)
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string'
+        ) as render:
+            self.assertEqual(self.render(), card)
+        render.assert_not_called()
+        changes = {
+            'Новый текст': lambda: Post.objects.get(
+                pk=PostCardsTests.post.pk
+            ).save(update_fields=['text']),
+            'Новое имя': lambda: User.objects.filter(
+                pk=PostCardsTests.user.pk
+            ).get().save(),
+            'Новая группа': lambda: Group.objects.get(
+                pk=PostCardsTests.group.pk
+            ).save(),
+        }
+        for text, save in changes.items():
+            with self.subTest(text=text):
+                Post.objects.filter(pk=PostCardsTests.post.pk).update(
+                    text=text
+                )
+                self.assertNotIn(text, self.render())
+                save()
+                self.assertIn(text, self.render())
+
+    def test_follow_page_reuses_cards(self):
+        """Персональная лента подписок использует те же карточки."""
+        follower = User.objects.create_user(username='TestFollower')
+        Follow.objects.create(user=follower, author=PostCardsTests.user)
+        card = self.render()
+        client = Client()
+        client.force_login(follower)
+        with mock.patch(
+            'posts.templatetags.post_cards.render_to_string'
+        ) as render:
+            response = client.get(reverse('posts:follow_index'))
+        render.assert_not_called()
+        self.assertIn(card, response.content.decode())
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.follower = User.objects.create_user(username='TestFollower')
+        Follow.objects.create(user=cls.follower, author=cls.author)
+        cls.post = Post.objects.create(text='Текст', author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def revalidate(self, url, client=None):
+        client = client or self.client
+        etag = client.get(url)['ETag']
+        return client.get(url, HTTP_IF_NONE_MATCH=etag).status_code
+
+    def test_unchanged_pages_return_304(self):
+        """Неизменённые страницы отвечают 304, изменённые — 200."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse(
+                'posts:post_detail',
+                kwargs={'post_id': ConditionalGetTests.post.pk},
+            ),
+        ]
+        for url in urls:
+            with self.subTest(url=url):
+                self.assertEqual(self.revalidate(url), 304)
+                etag = self.client.get(url)['ETag']
+                Comment.objects.create(
+                    post=ConditionalGetTests.post,
+                    author=ConditionalGetTests.author,
+                    text='Комментарий',
+                )
+                Post.objects.create(
+                    text='Новый пост', author=ConditionalGetTests.author
+                )
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_clients_always_revalidate(self):
+        """Кэшированные страницы не кэшируются клиентом без проверки."""
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:profile', kwargs={'username': 'TestAuthor'}),
+            reverse('posts:index_rss'),
+            reverse('posts:api_index'),
+        ]
+        for url in urls:
+            for _ in range(2):
+                with self.subTest(url=url):
+                    response = self.client.get(url)
+                    self.assertEqual(response['Cache-Control'], 'no-cache')
+                    self.assertFalse(response.has_header('Expires'))
+
+    def test_authenticated_pages_have_own_etag(self):
+        """Вошедший пользователь получает свой вариант ETag."""
+        url = reverse('posts:index')
+        client = Client()
+        client.force_login(ConditionalGetTests.follower)
+        self.assertNotEqual(
+            self.client.get(url)['ETag'], client.get(url)['ETag']
+        )
+
+    def test_follow_page_revalidation(self):
+        """Лента подписок отвечает 304, пока в ней не появится пост."""
+        url = reverse('posts:follow_index')
+        client = Client()
+        client.force_login(ConditionalGetTests.follower)
+        self.assertEqual(self.revalidate(url, client), 304)
+        etag = client.get(url)['ETag']
+        Post.objects.create(
+            text='Новый пост', author=ConditionalGetTests.author
+        )
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class FeedsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(
+            text='Первый пост', author=cls.author, group=cls.group
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def test_feeds_are_cached_and_revalidated(self):
+        """Ленты кэшируются, отвечают 304 и обновляются при записи."""
+        urls = {
+            reverse('posts:index_rss'): 'application/rss+xml',
+            reverse('posts:index_atom'): 'application/atom+xml',
+            reverse('posts:group_rss', args=('test-slug',)): 'rss',
+            reverse('posts:group_atom', args=('test-slug',)): 'atom',
+            reverse('posts:profile_rss', args=('TestAuthor',)): 'rss',
+            reverse('posts:profile_atom', args=('TestAuthor',)): 'atom',
+        }
+        for url, content_type in urls.items():
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                self.assertIn(content_type, response['Content-Type'])
+                self.assertContains(response, 'Первый пост')
+                with self.assertNumQueries(0):
+                    self.assertEqual(self.client.get(url).content,
+                                     response.content)
+                    response = self.client.get(
+                        url, HTTP_IF_NONE_MATCH=response['ETag']
+                    )
+                self.assertEqual(response.status_code, 304)
+        etags = {url: self.client.get(url)['ETag'] for url in urls}
+        Post.objects.create(
+            text='Второй пост',
+            author=FeedsTests.author,
+            group=FeedsTests.group,
+        )
+        for url, etag in etags.items():
+            with self.subTest(url=url):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertContains(response, 'Второй пост')
+
+    def test_unknown_group_feed(self):
+        response = self.client.get(reverse('posts:group_rss', args=('nope',)))
+        self.assertEqual(response.status_code, 404)
@@ -0,0 +1,107 @@
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase
+
+from .. import counters
+from ..models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+class CountersTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+
+    def test_counters_follow_writes_and_deletes(self):
+        """Счётчики меняются вместе с постами, комментариями и подписками."""
+        post = Post.objects.create(
+            text='Текст', author=self.author, group=self.group
+        )
+        comment = Comment.objects.create(
+            text='Комментарий', author=self.user, post=post
+        )
+        Follow.objects.create(user=self.user, author=self.author)
+        expected = {
+            (Counter.AUTHOR_POSTS, self.author.pk): 1,
+            (Counter.GROUP_POSTS, self.group.pk): 1,
+            (Counter.POST_COMMENTS, post.pk): 1,
+            (Counter.USER_FOLLOWERS, self.author.pk): 1,
+            (Counter.USER_FOLLOWING, self.user.pk): 1,
+        }
+        self.assertEqual(counters.get_many(expected), expected)
+        comment.delete()
+        post.group = None
+        post.save()
+        self.assertEqual(counters.get(Counter.POST_COMMENTS, post.pk), 0)
+        self.assertEqual(counters.get(Counter.GROUP_POSTS, self.group.pk), 0)
+        post.delete()
+        self.assertEqual(counters.get(Counter.AUTHOR_POSTS, self.author.pk), 0)
+
+    def test_missing_counters_are_counted_at_once(self):
+        """Недостающие счётчики разных видов считаются одним запросом и
+        записываются одним INSERT."""
+        Post.objects.create(text='Текст', author=self.author)
+        Follow.objects.create(user=self.user, author=self.author)
+        Counter.objects.all().delete()
+        expected = {
+            (Counter.AUTHOR_POSTS, self.author.pk): 1,
+            (Counter.USER_FOLLOWERS, self.author.pk): 1,
+            (Counter.USER_FOLLOWING, self.author.pk): 0,
+            (Counter.USER_FOLLOWING, self.user.pk): 1,
+        }
+        with self.assertNumQueries(3):
+            self.assertEqual(counters.get_many(expected), expected)
+        with self.assertNumQueries(1):
+            self.assertEqual(counters.get_many(expected), expected)
+
+    def test_reconcile_fixes_drift(self):
+        """reconcile_counters исправляет разошедшиеся счётчики."""
+        Post.objects.create(text='Текст', author=self.author)
+        Counter.objects.filter(
+            kind=Counter.AUTHOR_POSTS, object_id=self.author.pk
+        ).update(value=42)
+        out = StringIO()
+        call_command('reconcile_counters', stdout=out)
+        self.assertIn('author_posts: расхождений 1', out.getvalue())
+        self.assertEqual(counters.get(Counter.AUTHOR_POSTS, self.author.pk), 1)
+
+    @mock.patch.object(counters, 'CHUNK_SIZE', 2)
+    def test_reconcile_walks_ids_in_chunks(self):
+        """Сверка идёт пачками id и исправляет каждую одним UPDATE."""
+        authors = [
+            User.objects.create_user(username=f'TestAuthor{number}')
+            for number in range(5)
+        ]
+        for author in authors:
+            Post.objects.create(text='Текст', author=author)
+        Counter.objects.filter(kind=Counter.AUTHOR_POSTS).update(value=7)
+        Counter.objects.filter(
+            kind=Counter.AUTHOR_POSTS, object_id=authors[0].pk
+        ).delete()
+        # Счётчик автора, у которого больше нет постов.
+        Counter.objects.create(
+            kind=Counter.AUTHOR_POSTS, object_id=self.user.pk, value=3
+        )
+        self.assertEqual(
+            counters.reconcile([Counter.AUTHOR_POSTS]),
+            {Counter.AUTHOR_POSTS: 6},
+        )
+        expected = {(Counter.AUTHOR_POSTS, self.user.pk): 0}
+        expected.update(
+            ((Counter.AUTHOR_POSTS, author.pk), 1) for author in authors
+        )
+        self.assertEqual(counters.get_many(expected), expected)
+        self.assertEqual(counters.reconcile([Counter.AUTHOR_POSTS]), {
+            Counter.AUTHOR_POSTS: 0,
+        })
@@ -0,0 +1,185 @@
+import json
+import os
+import tempfile
+import time
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from core.broker import (OVERFLOW, Broker, SQLiteLog, TooManySubscribers,
+                         get_broker)
+
+from ..models import Comment, Follow, Group, Post
+
+User = get_user_model()
+
+
+class BrokerTests(TestCase):
+    def test_slow_subscriber_is_closed_on_overflow(self):
+        """Переполненная подписка получает OVERFLOW и освобождает место."""
+        broker = Broker(max_subscribers=1, queue_size=2)
+        subscription = broker.subscribe(['index'])
+        with self.assertRaises(TooManySubscribers):
+            broker.subscribe(['index'])
+        broker.publish('other', {'id': 0})
+        for number in range(3):
+            broker.publish('index', {'id': number})
+        # Место под OVERFLOW освобождается за счёт самого старого события.
+        self.assertEqual(subscription.get(0), (3, 'index', '{"id": 1}'))
+        self.assertIs(subscription.get(0), OVERFLOW)
+        self.assertIsNone(subscription.get(0))
+        self.assertEqual(broker.subscribers(), 0)
+        broker.subscribe(['index']).close()
+
+    def test_events_are_relayed_between_brokers(self):
+        """Событие, опубликованное в журнал, доходит до другого процесса."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.sqlite3')
+        publisher = Broker(10, 10, SQLiteLog(path))
+        publisher.publish('index', {'id': 1})
+        listener = Broker(10, 10, SQLiteLog(path), poll_interval=0.01)
+        subscription = listener.subscribe(['index'])
+        self.addCleanup(subscription.close)
+        # Поток журнала начинает с последнего события на момент старта.
+        time.sleep(0.05)
+        publisher.publish('index', {'id': 2})
+        event_id, channel, data = subscription.get(2)
+        self.assertEqual((channel, json.loads(data)), ('index', {'id': 2}))
+        self.assertEqual(event_id, 2)
+
+    def test_log_is_trimmed_without_subscribers(self):
+        """Журнал процесса без подписчиков не растёт бесконечно."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        log = SQLiteLog(os.path.join(directory.name, 'events.sqlite3'))
+        publisher = Broker(10, 10, log)
+        publisher.publish('index', {'id': 1})
+        later = time.time() + 120, time.monotonic() + 120
+        with mock.patch('core.broker.time.time', return_value=later[0]), \
+                mock.patch('core.broker.time.monotonic',
+                           return_value=later[1]):
+            publisher.publish('index', {'id': 2})
+        self.assertEqual(
+            [data for _, _, data in log.read_after(0)], ['{"id": 2}']
+        )
+
+    def test_relay_serves_subscriber_after_others_left(self):
+        """Подписка, пришедшая, когда последняя другая закрылась, всё
+        равно получает события из журнала."""
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'events.sqlite3')
+        publisher = Broker(10, 10, SQLiteLog(path))
+        listener = Broker(10, 10, SQLiteLog(path), poll_interval=0.001)
+        for number in range(20):
+            listener.subscribe(['index']).close()
+            subscription = listener.subscribe(['index'])
+            self.addCleanup(subscription.close)
+            relay = listener._relay
+            self.assertIsNotNone(relay)
+            time.sleep(0.01)
+            self.assertTrue(relay.is_alive())
+            publisher.publish('index', {'id': number})
+            _, _, data = subscription.get(2)
+            self.assertEqual(json.loads(data), {'id': number})
+            subscription.close()
+            relay.join(2)
+            self.assertIsNone(listener._relay)
+
+
+@override_settings(EVENTS_LOG_PATH=None, EVENTS_HEARTBEAT=0.01)
+@mock.patch('django.db.transaction.on_commit', side_effect=lambda f: f())
+class EventsViewsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.reader = User.objects.create_user(username='TestReader')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+        cls.post = Post.objects.create(text='Тестовый пост', author=cls.author)
+        Follow.objects.create(user=cls.reader, author=cls.author)
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+
+    def open(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        self.addCleanup(response.close)
+        events = iter(response.streaming_content)
+        self.assertTrue(next(events).startswith(b'retry:'))
+        return response, events
+
+    def read_event(self, events):
+        for chunk in events:
+            if not chunk.startswith(b':'):
+                data = chunk.decode().split('data: ', 1)[1]
+                return json.loads(data)
+
+    def test_new_comment_is_pushed(self, on_commit):
+        """Новый комментарий приходит подписчикам поста."""
+        post = EventsViewsTests.post
+        response, events = self.open(
+            reverse('posts:post_events', args=(post.pk,))
+        )
+        self.assertEqual(next(events), b': ping\n\n')
+        comment = Comment.objects.create(
+            post=post, author=EventsViewsTests.reader, text='Комментарий'
+        )
+        self.assertEqual(self.read_event(events), {
+            'type': 'comment',
+            'id': comment.pk,
+            'post': post.pk,
+            'author': 'TestReader',
+        })
+        response.close()
+        self.assertEqual(get_broker().subscribers(), 0)
+
+    def test_new_post_is_pushed_to_its_feeds(self, on_commit):
+        """Новый пост приходит в ленты группы, автора и подписок."""
+        self.client.force_login(EventsViewsTests.reader)
+        streams = [
+            self.open(reverse('posts:group_events', args=('test-slug',))),
+            self.open(reverse('posts:profile_events', args=('TestAuthor',))),
+            self.open(reverse('posts:follow_events')),
+        ]
+        post = Post.objects.create(
+            text='Новый пост',
+            author=EventsViewsTests.author,
+            group=EventsViewsTests.group,
+        )
+        for number, (response, events) in enumerate(streams):
+            with self.subTest(stream=number):
+                self.assertEqual(self.read_event(events), {
+                    'type': 'post',
+                    'id': post.pk,
+                    'author': 'TestAuthor',
+                    'group': 'test-slug',
+                })
+
+    def test_stream_does_not_hold_db_connection(self, on_commit):
+        """Соединение с БД закрывается до начала потока событий."""
+        database = mock.Mock(in_atomic_block=False)
+        with mock.patch('posts.events.connections') as connections:
+            connections.all.return_value = [database]
+            self.open(reverse('posts:group_events', args=('test-slug',)))
+        database.close.assert_called_once_with()
+
+    @override_settings(EVENTS_MAX_CONNECTIONS=1)
+    def test_connections_are_limited(self, on_commit):
+        url = reverse('posts:group_events', args=('test-slug',))
+        self.open(url)
+        self.assertEqual(self.client.get(url).status_code, 503)
+        self.client.logout()
+        self.assertEqual(
+            self.client.get(reverse('posts:follow_events')).status_code, 401
+        )
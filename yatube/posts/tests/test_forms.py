@@ -1,11 +1,18 @@
+import os
 import shutil
 import tempfile
+from io import BytesIO
+from unittest import mock
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from PIL import Image, ImageFile
 
 from ..forms import PostForm
 from ..models import Group, Post
@@ -113,3 +120,145 @@ class PostCreateFormTests(TestCase):
                 id=form_data.get('post_id')
             ).exists()
         )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POSTS_IMAGE_MAX_SIDE=100)
+class ImageUploadTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+
+    def setUp(self):
+        self.authorized_client = Client()
+        self.authorized_client.force_login(ImageUploadTests.user)
+
+    def make_jpeg(self, size=(400, 200)):
+        exif = Image.Exif()
+        exif[0x010F] = 'Камера'
+        output = BytesIO()
+        Image.new('RGB', size, 'red').save(output, 'JPEG', exif=exif)
+        return SimpleUploadedFile(
+            'photo.JPG', output.getvalue(), content_type='image/jpeg'
+        )
+
+    def test_upload_is_downscaled_without_exif(self):
+        """Картинка ужимается до предела и сохраняется без EXIF."""
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С картинкой', 'image': self.make_jpeg()},
+        )
+        post = Post.objects.get(text='С картинкой')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (100, 50))
+            self.assertNotIn('exif', image.info)
+        self.assertTrue(post.image.name.endswith('.jpg'))
+
+    @override_settings(POSTS_IMAGE_MAX_SIDE=400, POSTS_IMAGE_MAX_BYTES=60000)
+    def test_large_png_is_saved_as_jpeg(self):
+        """Фотография в PNG, не влезающая в предел, пересохраняется в
+        JPEG, а не отклоняется."""
+        output = BytesIO()
+        Image.frombytes('RGB', (400, 300), os.urandom(400 * 300 * 3)).save(
+            output, 'PNG'
+        )
+        self.assertGreater(len(output.getvalue()), 60000)
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С картинкой', 'image': SimpleUploadedFile(
+                'photo.png', output.getvalue(), content_type='image/png'
+            )},
+        )
+        post = Post.objects.get(text='С картинкой')
+        self.assertTrue(post.image.name.endswith('.jpg'))
+        self.assertLessEqual(post.image.size, 60000)
+
+    @override_settings(POSTS_IMAGE_MAX_UPLOAD_SIZE=100)
+    def test_too_large_upload_is_rejected(self):
+        """Слишком большой файл отклоняется до декодирования."""
+        form = PostForm(
+            data={'text': 'Текст'}, files={'image': self.make_jpeg()}
+        )
+        with mock.patch.object(ImageFile.ImageFile, 'load') as load:
+            self.assertFalse(form.is_valid())
+        load.assert_not_called()
+        self.assertEqual(
+            form.errors.as_data()['image'][0].code, 'file_too_large'
+        )
+
+
+class GroupChoicesTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+        cls.groups = [
+            Group.objects.create(
+                title=f'{name} {number}',
+                slug=f'{name}-{number}',
+                description='Тестовое описание',
+            )
+            for name in ('cats', 'dogs')
+            for number in range(15)
+        ]
+        cls.post = Post.objects.create(
+            text='Тестовый текст', author=cls.user, group=cls.groups[-1]
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.client = Client()
+        self.client.force_login(GroupChoicesTests.user)
+
+    def test_form_renders_only_selected_group(self):
+        """Форма выводит не все группы, а только выбранную."""
+        response = self.client.get(reverse('posts:post_create'))
+        self.assertNotContains(response, 'cats 0')
+        response = self.client.get(
+            reverse('posts:post_edit', args=(GroupChoicesTests.post.pk,))
+        )
+        self.assertContains(response, 'dogs 14')
+        self.assertNotContains(response, 'dogs 13')
+        self.assertContains(response, reverse('posts:group_choices'))
+
+    def test_group_is_validated_by_pk(self):
+        """Проверка группы не читает все группы."""
+        group = GroupChoicesTests.groups[0]
+        form = PostForm({'text': 'Текст', 'group': group.pk})
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(form.is_valid())
+        for query in queries:
+            self.assertIn(f'"posts_group"."id" = {group.pk}', query['sql'])
+        self.assertEqual(form.cleaned_data['group'], group)
+        form = PostForm({'text': 'Текст', 'group': 100500})
+        self.assertIn('group', form.errors)
+
+    def test_choices_endpoint(self):
+        """Группы ищутся по началу названия и листаются страницами."""
+        url = reverse('posts:group_choices')
+        data = self.client.get(url, {'q': 'DOGS'}).json()
+        self.assertEqual(len(data['results']), 15)
+        self.assertFalse(data['more'])
+        data = self.client.get(url, {'q': 'ogs'}).json()
+        self.assertEqual(data['results'], [])
+        data = self.client.get(url).json()
+        self.assertTrue(data['more'])
+        self.assertEqual(data['results'][0]['text'], 'cats 0')
+        data = self.client.get(url, {'page': 2}).json()
+        self.assertEqual(len(data['results']), 10)
+        self.assertFalse(data['more'])
+        Group.objects.create(title='dogs new', slug='dogs-new')
+        data = self.client.get(url, {'q': 'dogs n'}).json()
+        self.assertEqual(data['results'][0]['text'], 'dogs new')
+
+    def test_choices_page_is_one_limited_query(self):
+        """Страница вариантов — один запрос с LIMIT, а не все группы."""
+        url = reverse('posts:group_choices')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(url, {'q': 'cats', 'page': 2})
+        group_queries = [
+            query['sql'] for query in queries
+            if 'FROM "posts_group"' in query['sql']
+        ]
+        self.assertEqual(len(group_queries), 1)
+        self.assertIn('LIMIT 21 OFFSET 20', group_queries[0])
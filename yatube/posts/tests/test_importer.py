@@ -0,0 +1,143 @@
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils import timezone
+
+from .. import counters, search
+from ..cache import INDEX, get_generations
+from ..models import Comment, Counter, Follow, Group, Post
+
+User = get_user_model()
+
+
+class ImportContentTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+        cls.author = User.objects.create_user(username='TestAuthor')
+        cls.group = Group.objects.create(
+            title='Тестовая группа',
+            slug='test-slug',
+            description='Тестовое описание',
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write(self, name, content):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w', encoding='utf-8') as output:
+            if name.endswith('.jsonl'):
+                output.writelines(json.dumps(row) + '\n' for row in content)
+            else:
+                output.write(content)
+        return path
+
+    def run_import(self, *args):
+        out, err = StringIO(), StringIO()
+        call_command('import_content', *args, stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_import_posts_and_comments(self):
+        """Посты и комментарии пишутся пачками, плохие строки отвергаются."""
+        generation = get_generations([INDEX])
+        path = self.write('posts.jsonl', [
+            {'id': 500, 'text': 'Импортированный ёж', 'author': 'TestAuthor',
+             'group': 'test-slug', 'pub_date': '2020-01-02T03:04:05'},
+            {'text': 'Без группы', 'author': 'TestAuthor'},
+            {'text': 'Чужой автор', 'author': 'Nobody'},
+            {'text': '', 'author': 'TestAuthor'},
+            {'id': 500, 'text': 'Повтор id', 'author': 'TestAuthor'},
+        ])
+        out, err = self.run_import('posts', path, '--batch-size', '2')
+        self.assertIn('Записано: 2, отвергнуто строк: 3', out)
+        self.assertIn('Строка 3: Нет пользователя Nobody.', err)
+        post = Post.objects.get(pk=500)
+        self.assertEqual(post.group, self.group)
+        self.assertEqual(post.pub_date, timezone.make_aware(
+            datetime(2020, 1, 2, 3, 4, 5)
+        ))
+        self.assertNotEqual(get_generations([INDEX]), generation)
+        self.assertEqual(counters.get(Counter.AUTHOR_POSTS, self.author.pk), 2)
+        self.assertEqual(counters.get(Counter.GROUP_POSTS, self.group.pk), 1)
+        self.assertEqual(
+            list(search.filter_posts(Post.objects.all(), 'ёж')), [post]
+        )
+        path = self.write(
+            'comments.csv',
+            'post,author,text\n500,TestUsername,Первый\n'
+            '500,TestUsername,"Второй, с запятой"\n999,TestUsername,Нет\n',
+        )
+        out, _ = self.run_import('comments', path)
+        self.assertIn('Записано: 2, отвергнуто строк: 1', out)
+        self.assertTrue(
+            Comment.objects.filter(text='Второй, с запятой').exists()
+        )
+        self.assertEqual(counters.get(Counter.POST_COMMENTS, 500), 2)
+
+    def test_import_updates_only_written_rows(self):
+        """Импорт пересчитывает счётчики и индекс только записанного, а
+        не таблиц целиком."""
+        path = self.write('posts.jsonl', [
+            {'text': 'Новый ёжик', 'author': 'TestAuthor'},
+            {'text': 'Ещё ёжик', 'author': 'TestAuthor', 'group': 'test-slug'},
+        ])
+        with mock.patch.object(counters, 'reconcile') as reconcile, \
+                mock.patch.object(search, 'rebuild') as rebuild:
+            self.run_import('posts', path, '--batch-size', '1')
+        reconcile.assert_not_called()
+        rebuild.assert_not_called()
+        self.assertEqual(counters.get(Counter.AUTHOR_POSTS, self.author.pk), 2)
+        self.assertEqual(counters.get(Counter.GROUP_POSTS, self.group.pk), 1)
+        self.assertEqual(
+            len(search.filter_posts(Post.objects.all(), 'ёжик')), 2
+        )
+
+    def test_import_follows_ignores_existing(self):
+        """Уже существующая подписка не мешает импорту."""
+        Follow.objects.create(user=self.user, author=self.author)
+        path = self.write(
+            'follows.csv',
+            'user,author\nTestUsername,TestAuthor\n'
+            'TestAuthor,TestUsername\nTestAuthor,TestAuthor\n',
+        )
+        out, _ = self.run_import('follows', path)
+        self.assertIn('отвергнуто строк: 1', out)
+        self.assertEqual(Follow.objects.count(), 2)
+        self.assertEqual(
+            counters.get(Counter.USER_FOLLOWERS, self.user.pk), 1
+        )
+
+    def test_import_resumes_from_checkpoint(self):
+        """Повторный запуск продолжает с контрольной точки."""
+        path = self.write('groups.jsonl', [
+            {'title': f'Группа {number}', 'slug': f'group-{number}',
+             'description': 'Описание'}
+            for number in range(5)
+        ])
+        with open(f'{path}.checkpoint', 'w', encoding='utf-8') as output:
+            json.dump({
+                'kind': 'groups', 'path': path, 'rows': 3, 'finished': False
+            }, output)
+        out, _ = self.run_import('groups', path, '--batch-size', '2')
+        self.assertIn('Продолжаем со строки 4', out)
+        self.assertEqual(
+            set(Group.objects.values_list('slug', flat=True)),
+            {'test-slug', 'group-3', 'group-4'},
+        )
+        out, _ = self.run_import('groups', path)
+        self.assertIn('Записано: 0', out)
+        self.run_import('groups', path, '--restart')
+        self.assertEqual(Group.objects.count(), 6)
@@ -0,0 +1,107 @@
+import shutil
+from io import StringIO
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from .. import search
+from ..models import Post
+from .test_thumbnails import TEMP_MEDIA_ROOT, make_image
+
+User = get_user_model()
+
+
+class SearchTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+        cls.post = Post.objects.create(
+            text='Ёжики ходят в туман', author=cls.user
+        )
+        Post.objects.create(text='Про котиков', author=cls.user)
+
+    def setUp(self):
+        cache.clear()
+
+    def find(self, query, cursor=None):
+        response = Client().get(
+            reverse('posts:search'), {'q': query, 'cursor': cursor or ''}
+        )
+        return response.context['page_obj']
+
+    def test_index_follows_post_writes(self):
+        """Индекс обновляется при создании, правке и удалении поста."""
+        post = Post.objects.get(pk=SearchTests.post.pk)
+        self.assertEqual(list(self.find('ТУМ')), [post])
+        self.assertEqual(list(self.find('туман ёжики')), [post])
+        self.assertEqual(list(self.find('"*) OR')), [])
+        post.text = 'Ёжики ходят в лес'
+        post.save()
+        self.assertEqual(list(self.find('туман')), [])
+        self.assertEqual(list(self.find('лес')), [post])
+        post.delete()
+        self.assertEqual(list(self.find('ёжики')), [])
+
+    def test_results_are_paginated_by_cursor(self):
+        """Результаты листаются курсором без повторов и пропусков."""
+        Post.objects.bulk_create(
+            Post(text=f'Новости {number}', author=SearchTests.user)
+            for number in range(15)
+        )
+        search.rebuild()
+        first = self.find('новости')
+        self.assertEqual(len(first), 10)
+        second = self.find('новости', first.paginator.next_cursor)
+        self.assertIsNone(second.paginator.next_cursor)
+        self.assertCountEqual(
+            [post.pk for post in [*first, *second]],
+            Post.objects.filter(
+                text__startswith='Новости'
+            ).values_list('pk', flat=True),
+        )
+
+    @override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POSTS_THUMBNAIL_WORKERS=0)
+    def test_results_with_images_fit_query_budget(self):
+        """Создание миниатюр найденных картинок не входит в бюджет
+        запросов поиска."""
+        self.addCleanup(shutil.rmtree, TEMP_MEDIA_ROOT, ignore_errors=True)
+        for color in ('red', 'green', 'blue', 'white', 'black'):
+            Post.objects.create(
+                text=f'Картинка {color}', author=SearchTests.user,
+                image=make_image(f'{color}.gif', color),
+            )
+        self.assertEqual(len(self.find('картинка')), 5)
+
+    def test_more_relevant_posts_come_first(self):
+        """Пост, где слово встречается чаще, выше в выдаче."""
+        rare = Post.objects.create(
+            text='Совы и много других птиц', author=SearchTests.user
+        )
+        frequent = Post.objects.create(
+            text='Совы, совы, совы', author=SearchTests.user
+        )
+        self.assertEqual(list(self.find('совы')), [frequent, rare])
+
+    def test_admin_search_uses_index(self):
+        admin = User.objects.create_superuser(
+            'TestAdmin', 'admin@example.com', 'password'
+        )
+        client = Client()
+        client.force_login(admin)
+        response = client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'котик'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 1)
+
+    def test_rebuild_command(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {search.FTS_TABLE}')
+        out = StringIO()
+        call_command('rebuild_search_index', stdout=out)
+        self.assertIn('Проиндексировано постов: 2', out.getvalue())
+        self.assertEqual(list(self.find('туман')), [SearchTests.post])
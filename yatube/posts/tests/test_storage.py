@@ -0,0 +1,98 @@
+import os
+import shutil
+import tempfile
+from unittest import mock, skipUnless
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import RequestFactory, TestCase, override_settings
+
+from core.storage import is_immutable
+from core.views import IMMUTABLE_CACHE_CONTROL, serve_media
+
+from ..models import Post
+from .test_thumbnails import make_image
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ContentAddressedStorageTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def create_post(self, name):
+        return Post.objects.create(
+            text='Текст', author=ContentAddressedStorageTests.user,
+            image=make_image(name, 'green'),
+        )
+
+    def test_same_content_is_stored_once(self):
+        """Одинаковые картинки — один файл с неизменяемым адресом."""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.GIF')
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(is_immutable(first.image.name))
+        self.assertEqual(
+            len(os.listdir(os.path.dirname(first.image.path))), 1
+        )
+
+    def test_file_is_deleted_with_last_reference(self):
+        """Файл удаляется, когда на него не ссылается ни один пост."""
+        first = self.create_post('first.gif')
+        second = self.create_post('second.gif')
+        path = first.image.path
+        with mock.patch(
+            'django.db.transaction.on_commit', side_effect=lambda f: f()
+        ):
+            first.delete()
+            self.assertTrue(os.path.exists(path))
+            second.delete()
+        self.assertFalse(os.path.exists(path))
+
+    def test_file_removed_before_commit_is_restored(self):
+        """Файл, удалённый release другого поста до коммита нового поста
+        с той же картинкой, после коммита пишется заново."""
+        first = self.create_post('first.gif')
+        path = first.image.path
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            second = self.create_post('second.gif')
+        first.delete()
+        os.remove(path)
+        for call in on_commit.call_args_list:
+            call[0][0]()
+        self.assertEqual(second.image.path, path)
+        with open(path, 'rb') as restored:
+            self.assertEqual(
+                restored.read(), make_image('x.gif', 'green').read()
+            )
+
+    @skipUnless(connection.vendor == 'sqlite', 'план запроса SQLite')
+    def test_reference_check_uses_index(self):
+        """Проверка ссылок на файл не просматривает всю таблицу постов."""
+        sql, params = Post.objects.filter(
+            image='posts/ab/ab.gif'
+        ).order_by().values('pk')[:1].query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(row[3] for row in cursor.fetchall())
+        self.assertRegex(plan, r'SEARCH posts_post USING (COVERING )?INDEX')
+
+    def test_immutable_media_are_cached_forever(self):
+        """Файлы с адресом по содержимому отдаются с вечным кэшем."""
+        post = self.create_post('first.gif')
+        response = serve_media(
+            RequestFactory().get('/media/'), post.image.name,
+            document_root=TEMP_MEDIA_ROOT,
+        )
+        self.assertEqual(response['Cache-Control'], IMMUTABLE_CACHE_CONTROL)
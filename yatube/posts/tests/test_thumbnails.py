@@ -0,0 +1,119 @@
+import shutil
+import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+from PIL import Image
+from sorl.thumbnail.base import ThumbnailBackend
+
+from .. import thumbnails
+from ..models import Post
+from ..templatetags.post_cards import post_cards
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+SMALL_GIF = (
+    b'\x47\x49\x46\x38\x39\x61\x02\x00'
+    b'\x01\x00\x80\x00\x00\x00\x00\x00'
+    b'\xFF\xFF\xFF\x21\xF9\x04\x00\x00'
+    b'\x00\x00\x00\x2C\x00\x00\x00\x00'
+    b'\x02\x00\x01\x00\x00\x02\x02\x0C'
+    b'\x0A\x00\x3B'
+)
+
+
+def make_image(name='small.gif', color=None):
+    """Маленький GIF; картинки разных цветов — разные файлы."""
+    content = SMALL_GIF
+    if color is not None:
+        output = BytesIO()
+        Image.new('RGB', (2, 1), color).save(output, 'GIF')
+        content = output.getvalue()
+    return SimpleUploadedFile(
+        name=name, content=content, content_type='image/gif'
+    )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT, POSTS_THUMBNAIL_WORKERS=0)
+class ThumbnailsTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestUsername')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.post = Post.objects.create(
+            text='Текст', author=ThumbnailsTests.user, image=make_image()
+        )
+
+    def test_feed_finds_pregenerated_thumbnails(self):
+        """После pregenerate отрисовка карточки не создаёт миниатюр."""
+        thumbnails.pregenerate(self.post.image.name)
+        with mock.patch.object(
+            ThumbnailBackend, '_create_thumbnail'
+        ) as create:
+            post_cards([self.post])
+        create.assert_not_called()
+
+    def test_upload_schedules_thumbnails(self):
+        """Загрузка картинки через форму ставит миниатюры в очередь."""
+        client = Client()
+        client.force_login(ThumbnailsTests.user)
+        with mock.patch(
+            'django.db.transaction.on_commit', side_effect=lambda f: f()
+        ), mock.patch.object(thumbnails, 'schedule') as schedule:
+            client.post(
+                reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+                data={'text': 'Текст', 'image': make_image('other.gif')},
+            )
+            client.post(
+                reverse('posts:post_edit', kwargs={'post_id': self.post.pk}),
+                data={'text': 'Без новой картинки'},
+            )
+        self.post.refresh_from_db()
+        schedule.assert_called_once_with(self.post.image.name)
+
+    def test_backfill_command(self):
+        """Команда создаёт миниатюры уже загруженных картинок."""
+        out = StringIO()
+        call_command('pregenerate_thumbnails', '--workers', '0', stdout=out)
+        self.assertIn('Обработано картинок: 1, с ошибками: 0', out.getvalue())
+
+    def test_page_thumbnails_are_resolved_in_one_query(self):
+        """Миниатюры страницы ищутся одним запросом и запоминаются."""
+        posts = [self.post] + [
+            Post.objects.create(
+                text='Текст', author=ThumbnailsTests.user,
+                image=make_image(f'small{number}.gif', (number, 0, 0)),
+            )
+            for number in range(3)
+        ]
+        names = [post.image.name for post in posts]
+        for name in names:
+            thumbnails.pregenerate(name)
+        thumbnails._memo.clear()
+        cache.clear()
+        with self.assertNumQueries(1):
+            found = thumbnails.resolve(names)
+        with self.assertNumQueries(0):
+            self.assertEqual(thumbnails.resolve(names), found)
+        self.post.image = make_image('new.gif', 'blue')
+        self.post.save()
+        self.assertNotIn(
+            names[0], [name for name, _ in thumbnails._memo]
+        )
@@ -0,0 +1,162 @@
+from datetime import timedelta
+from unittest import mock, skipUnless
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .. import queries, timeline
+from ..models import Follow, Post, TimelineEntry
+from ..utils import encode_cursor
+
+User = get_user_model()
+
+
+class TimelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='TestReader')
+        cls.author = User.objects.create_user(username='TestAuthor')
+
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
+    def test_post_is_fanned_out_to_followers(self):
+        """Новый пост попадает в ленту подписчика."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+        self.assertIn(post, timeline.follow_feed(self.user))
+
+    def test_follow_and_unfollow_update_timeline(self):
+        """Подписка добавляет старые посты автора, отписка убирает их."""
+        post = Post.objects.create(text='Текст', author=self.author)
+        follow = Follow.objects.create(user=self.user, author=self.author)
+        self.assertIn(post, timeline.follow_feed(self.user))
+        follow.delete()
+        self.assertNotIn(post, timeline.follow_feed(self.user))
+
+    @override_settings(POSTS_FANOUT_MAX_FOLLOWERS=0)
+    def test_celebrity_posts_are_pulled_on_read(self):
+        """Посты знаменитостей не раскладываются, но видны в ленте."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertIn(post, timeline.follow_feed(self.user))
+
+    def test_rebuild_command(self):
+        """Команда rebuild_timeline восстанавливает ленту."""
+        Follow.objects.create(user=self.user, author=self.author)
+        post = Post.objects.create(text='Текст', author=self.author)
+        TimelineEntry.objects.all().delete()
+        call_command('rebuild_timeline', self.user.username, stdout=None)
+        self.assertTrue(
+            TimelineEntry.objects.filter(user=self.user, post=post).exists()
+        )
+
+    @override_settings(POSTS_FANOUT_MAX_FOLLOWERS=1)
+    def test_posts_stay_when_author_is_no_longer_celebrity(self):
+        """Посты, опубликованные знаменитостью, остаются в лентах, когда
+        подписчиков становится не больше порога."""
+        other = User.objects.create_user(username='TestOther')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=other, author=self.author)
+        posts = [
+            Post.objects.create(text='Текст', author=self.author)
+            for _ in range(3)
+        ]
+        post = posts[-1]
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        with mock.patch('django.db.transaction.on_commit') as on_commit:
+            Follow.objects.get(user=other).delete()
+        # В транзакции отписки ленты не пишутся.
+        self.assertFalse(TimelineEntry.objects.filter(post=post).exists())
+        self.assertIn(post, timeline.follow_feed(self.user))
+        with mock.patch.object(timeline, 'BATCH_SIZE', 2):
+            on_commit.call_args[0][0]()
+        self.assertEqual(
+            set(TimelineEntry.objects.filter(user=self.user).values_list(
+                'post', flat=True
+            )),
+            {post.pk for post in posts},
+        )
+        self.assertEqual(timeline.celebrity_ids(), set())
+        self.assertIn(post, timeline.follow_feed(self.user))
+
+    @override_settings(POSTS_FANOUT_MAX_FOLLOWERS=1)
+    def test_pages_merge_celebrity_posts(self):
+        """Страницы ленты идут по дате вперемешку с постами знаменитостей
+        и без повторов."""
+        other = User.objects.create_user(username='TestOther')
+        celebrity = User.objects.create_user(username='TestCelebrity')
+        Follow.objects.create(user=self.user, author=self.author)
+        Follow.objects.create(user=self.user, author=celebrity)
+        now = timezone.now()
+        # Разложен по ленте до того, как автор стал знаменитостью.
+        posts = [Post.objects.create(text='Текст', author=celebrity)]
+        Follow.objects.create(user=other, author=celebrity)
+        for number in range(6):
+            posts.append(Post.objects.create(
+                text='Текст',
+                author=celebrity if number % 2 else self.author,
+            ))
+        for number, post in enumerate(posts):
+            Post.objects.filter(pk=post.pk).update(
+                pub_date=now - timedelta(minutes=number % 3)
+            )
+            TimelineEntry.objects.filter(post=post).update(
+                pub_date=now - timedelta(minutes=number % 3)
+            )
+        expected = list(
+            Post.objects.filter(pk__in=[post.pk for post in posts]).order_by(
+                '-pub_date', '-id'
+            )
+        )
+        feed = timeline.follow_feed(self.user)
+        pages, cursor = [], None
+        while True:
+            paginator = timeline.FollowFeedPaginator(
+                feed, 3, cursor, user=self.user
+            )
+            pages.extend(paginator.page())
+            cursor = paginator.next_cursor
+            if cursor is None:
+                break
+        self.assertEqual(pages, expected)
+        paginator = timeline.FollowFeedPaginator(
+            feed, 3, encode_cursor(expected[3], backwards=True),
+            user=self.user,
+        )
+        self.assertEqual(list(paginator.page()), expected[:3])
+
+    @skipUnless(connection.vendor == 'sqlite', 'план запроса SQLite')
+    def test_pages_read_timeline_index(self):
+        """Ключи страницы читаются из индекса ленты с позиции, без
+        сортировки и без JOIN постов."""
+        Follow.objects.create(user=self.user, author=self.author)
+        for _ in range(3):
+            Post.objects.create(text='Текст', author=self.author)
+        feed = queries.follow_feed(self.user)
+        first = timeline.FollowFeedPaginator(feed, 2, user=self.user)
+        first.page()
+        for cursor in (None, first.next_cursor):
+            with self.subTest(cursor=cursor):
+                with CaptureQueriesContext(connection) as context:
+                    timeline.FollowFeedPaginator(
+                        feed, 2, cursor, user=self.user
+                    ).page()
+                sql = context[0]['sql']
+                self.assertNotIn('JOIN', sql)
+                with connection.cursor() as db:
+                    db.execute('EXPLAIN QUERY PLAN ' + sql)
+                    plan = ' '.join(row[3] for row in db.fetchall())
+                self.assertIn('INDEX timeline_user_date_post_idx', plan)
+                self.assertNotIn('TEMP B-TREE', plan)
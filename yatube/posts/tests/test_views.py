@@ -1,15 +1,26 @@
+import json
 import shutil
 import tempfile
+import zipfile
+from io import BytesIO
+from unittest import mock, skipUnless
 
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.core.cache import cache
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
 from django.test import Client, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
 
-from ..models import Comment, Follow, Group, Post
+from core.decorators import QueryBudgetExceeded, query_budget
+
+from .. import queries
+from ..cache import INDEX, get_generations, group_scope, profile_scope
+from ..models import Comment, Counter, Follow, Group, Post
+from ..utils import CursorPaginator, encode_cursor
 
 User = get_user_model()
 
@@ -213,6 +224,30 @@ class PostPagesTests(TestCase):
         self.assertIn('is_edit', response.context)
         self.assertEqual(response.context['is_edit'], True)
 
+    def test_export_data(self):
+        """Выгрузка — ZIP с постами, комментариями, подписками и картинкой."""
+        author = User.objects.create_user(username='TestAuthor')
+        Follow.objects.create(user=PostPagesTests.user, author=author)
+        with mock.patch('posts.export.CHUNK_SIZE', 16):
+            response = self.authorized_client.get(reverse('posts:export'))
+            parts = list(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertGreater(len(parts), 5)
+        archive = zipfile.ZipFile(BytesIO(b''.join(parts)))
+        self.assertIsNone(archive.testzip())
+        post = json.loads(archive.read('posts.jsonl'))
+        self.assertEqual(post['text'], PostPagesTests.post.text)
+        self.assertEqual(post['group'], PostPagesTests.group.slug)
+        comment = json.loads(archive.read('comments.jsonl'))
+        self.assertEqual(comment['post'], PostPagesTests.post.pk)
+        follow = json.loads(archive.read('follows.jsonl'))
+        self.assertEqual(follow['author'], author.username)
+        with PostPagesTests.post.image.open() as image:
+            self.assertEqual(
+                archive.read(f'media/{PostPagesTests.post.image.name}'),
+                image.read(),
+            )
+
 
 class PaginatorViewsTest(TestCase):
     @classmethod
@@ -233,6 +268,10 @@ class PaginatorViewsTest(TestCase):
         ]
         cls.post = Post.objects.bulk_create(post_list)
 
+    def tearDown(self):
+        super().tearDown()
+        cache.clear()
+
     def setUp(self):
         self.authorized_client = Client()
         self.authorized_client.force_login(PaginatorViewsTest.user)
@@ -247,6 +286,75 @@ class PaginatorViewsTest(TestCase):
         )
         self.assertEqual(len(response.context['page_obj']), 3)
 
+    def test_cursor_pages(self):
+        """Курсор ведёт на следующую страницу и обратно."""
+        response = self.authorized_client.get(reverse('posts:index'))
+        first_page = list(response.context['page_obj'])
+        next_cursor = response.context['page_obj'].paginator.next_cursor
+        self.assertIsNotNone(next_cursor)
+        response = self.authorized_client.get(
+            reverse('posts:index') + f'?cursor={next_cursor}'
+        )
+        page_obj = response.context['page_obj']
+        self.assertEqual(len(page_obj), 3)
+        self.assertIsNone(page_obj.paginator.next_cursor)
+        response = self.authorized_client.get(
+            reverse('posts:index')
+            + f'?cursor={page_obj.paginator.previous_cursor}'
+        )
+        self.assertEqual(list(response.context['page_obj']), first_page)
+
+    def test_cursor_page_is_stable(self):
+        """Новый пост не сдвигает страницу, открытую по курсору."""
+        url = reverse(
+            'posts:group_list', kwargs={'slug': PaginatorViewsTest.group.slug}
+        )
+        response = self.authorized_client.get(url)
+        url += f'?cursor={response.context["page_obj"].paginator.next_cursor}'
+        before = list(self.authorized_client.get(url).context['page_obj'])
+        Post.objects.create(
+            text='Новый текст',
+            author=PaginatorViewsTest.user,
+            group=PaginatorViewsTest.group
+        )
+        after = list(self.authorized_client.get(url).context['page_obj'])
+        self.assertEqual(before, after)
+
+    @skipUnless(connection.vendor == 'sqlite', 'план запроса SQLite')
+    def test_cursor_pages_read_feed_indexes(self):
+        """Страницы лент читаются по индексу с позиции, без сортировки."""
+        group, user = PaginatorViewsTest.group, PaginatorViewsTest.user
+        feeds = {
+            'post_date_idx': queries.index_feed(),
+            'post_group_date_idx': queries.group_feed(group),
+            'post_author_date_idx': queries.profile_feed(user),
+        }
+        for index, posts in feeds.items():
+            first = CursorPaginator(posts, 10)
+            first.page()
+            cursors = [
+                None,
+                first.next_cursor,
+                encode_cursor(Post.objects.first(), backwards=True),
+            ]
+            for cursor in cursors:
+                with self.subTest(index=index, cursor=cursor):
+                    with CaptureQueriesContext(connection) as context:
+                        CursorPaginator(posts, 10, cursor).page()
+                    with connection.cursor() as db:
+                        db.execute(
+                            'EXPLAIN QUERY PLAN ' + context[0]['sql']
+                        )
+                        plan = ' '.join(row[3] for row in db.fetchall())
+                    self.assertIn(f'INDEX {index}', plan)
+                    self.assertNotIn('TEMP B-TREE', plan)
+
+    def test_broken_cursor_shows_first_page(self):
+        response = self.authorized_client.get(
+            reverse('posts:index') + '?cursor=broken'
+        )
+        self.assertEqual(len(response.context['page_obj']), 10)
+
 
 class FollowViewsTest(TestCase):
     @classmethod
@@ -288,6 +396,22 @@ class FollowViewsTest(TestCase):
             response_2.context['page_obj']
         )
 
+    def test_feed_page_is_read_once(self):
+        """ETag и страница ленты подписок не читают её дважды."""
+        Follow.objects.create(user=self.user, author=self.author)
+        with CaptureQueriesContext(connection) as context:
+            response = self.authorized_client.get(
+                reverse('posts:follow_index')
+            )
+        self.assertIn(self.post, response.context['page_obj'])
+        self.assertEqual(
+            sum(
+                'FROM "posts_timelineentry"' in query['sql']
+                for query in context
+            ),
+            1,
+        )
+
     def test_user_unfollowing_list(self):
         Follow.objects.create(
             user=self.user,
@@ -315,3 +439,247 @@ class FollowViewsTest(TestCase):
             new_post,
             response_2.context['page_obj']
         )
+
+
+class FeedQueriesTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for i in range(10):
+            author = User.objects.create_user(username=f'TestAuthor{i}')
+            group = Group.objects.create(
+                title=f'Тестовая группа {i}',
+                slug=f'test-slug-{i}',
+                description='Тестовое описание',
+            )
+            post = Post.objects.create(
+                text='Текст', author=author, group=group
+            )
+            for number in range(i % 4):
+                Comment.objects.create(
+                    post=post, author=author, text=f'Комментарий {number}'
+                )
+        cls.post = post
+
+    def setUp(self):
+        cache.clear()
+
+    def test_index_queries_do_not_depend_on_page_size(self):
+        """Авторы, группы и комментарии карточек не догружаются отдельными
+        запросами."""
+        # Первое чтение создаёт недостающие счётчики комментариев.
+        Client().get(reverse('posts:index'))
+        cache.clear()
+        with self.assertNumQueries(3):
+            response = Client().get(reverse('posts:index'))
+        self.assertEqual(len(response.context['page_obj']), 10)
+
+    def test_new_comment_updates_cached_feeds(self):
+        """Новый комментарий сразу виден в закэшированных лентах."""
+        post = FeedQueriesTest.post
+        urls = [
+            reverse('posts:index'),
+            reverse('posts:group_list', args=(post.group.slug,)),
+            reverse('posts:profile', args=(post.author.username,)),
+        ]
+        client = Client()
+        etags = [client.get(url)['ETag'] for url in urls]
+        Comment.objects.create(
+            post=post, author=post.author, text='Свежий комментарий'
+        )
+        for url, etag in zip(urls, etags):
+            with self.subTest(url=url):
+                response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                self.assertContains(response, 'Свежий комментарий')
+                self.assertContains(response, 'Комментариев: 2')
+
+    @override_settings(MAX_NUMBER_OF_POSTS=3)
+    def test_comment_deep_in_feed_keeps_index_cache(self):
+        """Комментарий к посту не с первой страницы ленты не сбрасывает
+        её кэш, а ленты, где пост на первой странице, сбрасывает."""
+        post = Post.objects.order_by('pub_date', 'id').first()
+        scopes = [
+            INDEX,
+            group_scope(post.group.slug),
+            profile_scope(post.author.username),
+        ]
+        before = get_generations(scopes)
+        Comment.objects.create(post=post, author=post.author, text='Ещё')
+        after = get_generations(scopes)
+        self.assertEqual(before[0], after[0])
+        self.assertNotEqual(before[1], after[1])
+        self.assertNotEqual(before[2], after[2])
+
+    def test_cards_show_latest_comments(self):
+        """Карточка показывает число и последние комментарии поста."""
+        response = Client().get(reverse('posts:index'))
+        card = str(response.context['cards'][0])
+        self.assertEqual(response.context['page_obj'][0], FeedQueriesTest.post)
+        self.assertIn('Комментариев: 1', card)
+        self.assertIn('Комментарий 0', card)
+        card = str(response.context['cards'][2])
+        self.assertIn('Комментариев: 3', card)
+        self.assertNotIn('Комментарий 0', card)
+        self.assertLess(
+            card.index('Комментарий 1'), card.index('Комментарий 2')
+        )
+
+    @override_settings(ENFORCE_QUERY_BUDGETS=True)
+    def test_profile_fits_budget_with_missing_counters(self):
+        """Профиль укладывается в бюджет, даже когда счётчики автора и
+        карточек считаются впервые."""
+        post = FeedQueriesTest.post
+        Counter.objects.all().delete()
+        client = Client()
+        client.force_login(User.objects.exclude(pk=post.author_id)[0])
+        response = client.get(
+            reverse('posts:profile', args=(post.author.username,))
+        )
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(ENFORCE_QUERY_BUDGETS=True)
+    def test_query_budget_exceeded(self):
+        """Превышение бюджета запросов приводит к ошибке."""
+        @query_budget(1)
+        def view(request):
+            return list(Post.objects.all()) + list(Group.objects.all())
+
+        with self.assertRaises(QueryBudgetExceeded):
+            view(None)
+
+
+@override_settings(POSTS_COMMENTS_PER_PAGE=2)
+class CommentThreadTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='TestAuthor')
+        cls.post = Post.objects.create(text='Текст', author=author)
+        for i in range(5):
+            commenter = User.objects.create_user(username=f'TestReader{i}')
+            Comment.objects.create(
+                post=cls.post, author=commenter, text=f'Комментарий {i}'
+            )
+
+    def setUp(self):
+        cache.clear()
+
+    texts = [f'Комментарий {i}' for i in range(5)]
+
+    def read_thread(self, client):
+        """Тексты комментариев всех страниц по ссылкам «Показать ещё»."""
+        response = client.get(
+            reverse('posts:post_detail', args=(CommentThreadTest.post.pk,))
+        )
+        html = response.content.decode()
+        pages = [html]
+        while 'data-comments-url="' in html:
+            url = html.split('data-comments-url="', 1)[1].split('"', 1)[0]
+            html = client.get(url.replace('&amp;', '&')).content.decode()
+            pages.append(html)
+        return [
+            [text for text in self.texts if text in page]
+            for page in pages
+        ]
+
+    def test_comments_are_paginated(self):
+        """Комментарии идут страницами от старых к новым."""
+        self.assertEqual(self.read_thread(Client()), [
+            ['Комментарий 0', 'Комментарий 1'],
+            ['Комментарий 2', 'Комментарий 3'],
+            ['Комментарий 4'],
+        ])
+
+    def test_new_csrf_token_changes_etag(self):
+        """Страница поста с формой комментария после смены CSRF-токена
+        (например, после нового входа) отдаётся заново, а не 304."""
+        client = Client()
+        client.force_login(CommentThreadTest.post.author)
+        url = reverse('posts:post_detail', args=(CommentThreadTest.post.pk,))
+        client.cookies['csrftoken'] = 'a' * 64
+        etag = client.get(url)['ETag']
+        self.assertEqual(
+            client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304
+        )
+        client.cookies['csrftoken'] = 'b' * 64
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    def test_comment_pages_are_cached(self):
+        """Комментарии страницы читаются одним запросом, повторно — из кэша."""
+        url = reverse('posts:post_comments', args=(CommentThreadTest.post.pk,))
+        with self.assertNumQueries(3):
+            Client().get(url)
+        # Остаются проверка ETag и поиск поста.
+        with self.assertNumQueries(2):
+            Client().get(url)
+        Comment.objects.create(
+            post=CommentThreadTest.post,
+            author=CommentThreadTest.post.author,
+            text='Новый комментарий',
+        )
+        self.assertEqual(len(self.read_thread(Client())), 3)
+        self.assertEqual(Client().get(
+            reverse('posts:post_comments', args=(0,))
+        ).status_code, 404)
+
+
+class PostAdminTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.admin = User.objects.create_superuser(
+            'TestAdmin', 'admin@example.com', 'password'
+        )
+        cls.add_posts(10)
+
+    @classmethod
+    def add_posts(cls, amount):
+        for i in range(amount):
+            number = Post.objects.count()
+            author = User.objects.create_user(username=f'TestAuthor{number}')
+            group = Group.objects.create(
+                title=f'Тестовая группа {number}',
+                slug=f'test-slug-{number}',
+                description='Тестовое описание',
+            )
+            Post.objects.create(text='Текст', author=author, group=group)
+
+    def setUp(self):
+        self.client = Client()
+        self.client.force_login(PostAdminTest.admin)
+
+    def changelist_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('admin:posts_post_changelist'))
+        self.assertEqual(response.status_code, 200)
+        return queries
+
+    def test_changelist_queries_do_not_depend_on_rows(self):
+        """Авторы, группы и варианты групп не читаются построчно."""
+        before = len(self.changelist_queries())
+        PostAdminTest.add_posts(10)
+        self.assertEqual(len(self.changelist_queries()), before)
+
+    @override_settings(POSTS_ADMIN_ESTIMATE_COUNT_FROM=5)
+    def test_large_table_count_is_estimated(self):
+        """Большая таблица не считается через COUNT(*)."""
+        queries = self.changelist_queries()
+        self.assertFalse(
+            any('COUNT(' in query['sql'] for query in queries)
+        )
+        response = self.client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'Текст'}
+        )
+        self.assertEqual(response.context['cl'].result_count, 10)
+
+    def test_change_form_does_not_list_users(self):
+        """Форма поста не выгружает всех пользователей и группы."""
+        post, other = Post.objects.first(), Post.objects.last()
+        response = self.client.get(
+            reverse('admin:posts_post_change', args=(post.pk,))
+        )
+        self.assertContains(response, f'>{post.author.username}<')
+        self.assertNotContains(response, f'>{other.author.username}<')
+        self.assertNotContains(response, f'>{other.group.title}<')
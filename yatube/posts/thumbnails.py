@@ -0,0 +1,232 @@
+"""Миниатюры картинок постов.
+
+sorl создаёт миниатюру лениво, при первой отрисовке поста, и этот
+запрос платит за декодирование, масштабирование и сжатие картинки.
+Поэтому после загрузки картинки все её миниатюры ставятся в очередь
+ограниченного пула процессов, и лента находит их уже готовыми.
+
+Тег {% thumbnail %} ищет каждую миниатюру отдельным запросом к
+хранилищу ключей sorl. Карточки ленты вместо этого получают миниатюры
+всей страницы через resolve: одним запросом к кэшу, и только для
+недостающих — одним запросом к БД. Найденное запоминается в процессе.
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from django.conf import settings
+from django.db import connection
+from sorl.thumbnail import default, get_thumbnail
+from sorl.thumbnail.conf import defaults as thumbnail_defaults
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores.cached_db_kvstore import KVStore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+logger = logging.getLogger(__name__)
+
+# Миниатюры, которые выводят шаблоны: геометрия и параметры тега
+# {% thumbnail %}.
+CARD_GEOMETRY = ('960x339', {'crop': 'center', 'upscale': True})
+GEOMETRIES = (CARD_GEOMETRY,)
+
+# Сколько миниатюр помнить в процессе.
+MEMO_SIZE = 4096
+
+_executor = None
+_slots = None
+_lock = threading.Lock()
+_memo = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def pregenerate(name):
+    """Создаёт все миниатюры картинки, которых ещё нет."""
+    for geometry, options in GEOMETRIES:
+        get_thumbnail(name, geometry, **options)
+
+
+def _setup_worker():
+    # Процессы пула запускаются через spawn и не наследуют соединений
+    # родителя с БД и кэшем: Django в них настраивается заново.
+    import django
+    django.setup()
+
+
+def make_executor(workers):
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_setup_worker,
+    )
+
+
+def _get_executor():
+    global _executor, _slots
+    with _lock:
+        if _executor is None:
+            _executor = make_executor(settings.POSTS_THUMBNAIL_WORKERS)
+            _slots = threading.BoundedSemaphore(
+                settings.POSTS_THUMBNAIL_QUEUE
+            )
+        return _executor, _slots
+
+
+def _log_failure(name, future):
+    if future.exception() is not None:
+        logger.warning(
+            'Не удалось создать миниатюры %s', name,
+            exc_info=future.exception(),
+        )
+
+
+def schedule(name):
+    """Ставит создание миниатюр картинки в очередь пула.
+
+    Возвращает False, если очередь заполнена: тогда миниатюры, как и
+    раньше, создаст первая отрисовка поста.
+    """
+    if not name:
+        return False
+    if not settings.POSTS_THUMBNAIL_WORKERS:
+        pregenerate(name)
+        return True
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        # Процессы пула не видят базу в памяти (как в тестах).
+        return False
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        return False
+    future = executor.submit(pregenerate, name)
+    future.add_done_callback(lambda future: slots.release())
+    future.add_done_callback(lambda future: _log_failure(name, future))
+    return True
+
+
+def backfill(names, workers=None):
+    """Создаёт миниатюры для картинок names, не больше 2 * workers
+    задач в очереди одновременно. Возвращает (готово, ошибок).
+
+    При workers=0 миниатюры создаются в текущем процессе.
+    """
+    if workers is None:
+        workers = os.cpu_count()
+    done = failed = 0
+    if not workers:
+        for name in names:
+            try:
+                pregenerate(name)
+            except Exception:
+                logger.warning(
+                    'Не удалось создать миниатюры %s', name, exc_info=True
+                )
+                failed += 1
+            done += 1
+        return done - failed, failed
+    with make_executor(workers) as executor:
+        pending = set()
+        for name in names:
+            if len(pending) >= workers * 2:
+                finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                failed += sum(1 for f in finished if f.exception())
+                done += len(finished)
+            future = executor.submit(pregenerate, name)
+            future.add_done_callback(
+                lambda future, name=name: _log_failure(name, future)
+            )
+            pending.add(future)
+        finished, _ = wait(pending)
+        failed += sum(1 for future in finished if future.exception())
+        done += len(finished)
+    return done - failed, failed
+
+
+def _thumbnail_file(name, geometry, options):
+    """Файл миниатюры, который создал бы get_thumbnail, без обращения
+    к хранилищу ключей."""
+    backend = default.backend
+    source = ImageFile(name)
+    options = dict(options)
+    if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+        options.setdefault('format', backend._get_format(source))
+    for key, value in backend.default_options.items():
+        options.setdefault(key, value)
+    for key, attr in backend.extra_options:
+        value = getattr(thumbnail_settings, attr)
+        if value != getattr(thumbnail_defaults, attr):
+            options.setdefault(key, value)
+    return ImageFile(
+        backend._get_thumbnail_filename(source, geometry, options),
+        default.storage,
+    )
+
+
+def _lookup(files):
+    """Ищет миниатюры в хранилище ключей sorl пачкой."""
+    raw_keys = {add_prefix(file.key): file.name for file in files}
+    kvstore = default.kvstore
+    if not isinstance(kvstore, KVStore):
+        found = {file.name: kvstore.get(file) for file in files}
+        return {name: file for name, file in found.items() if file}
+    values = {
+        key: value
+        for key, value in kvstore.cache.get_many(list(raw_keys)).items()
+        if isinstance(value, str)
+    }
+    missing = [key for key in raw_keys if key not in values]
+    if missing:
+        stored = dict(KVStoreModel.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        if stored:
+            kvstore.cache.set_many(
+                stored, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+            )
+        values.update(stored)
+    return {
+        raw_keys[key]: deserialize_image_file(value)
+        for key, value in values.items()
+    }
+
+
+def resolve(names, geometry=CARD_GEOMETRY):
+    """Возвращает {имя картинки: миниатюра} для картинок names.
+
+    Ещё не созданные миниатюры создаются сразу.
+    """
+    size, options = geometry
+    memo_key = (size, tuple(sorted(options.items())))
+    result = {}
+    with _memo_lock:
+        for name in names:
+            thumbnail = _memo.get((name, memo_key))
+            if thumbnail is not None:
+                _memo.move_to_end((name, memo_key))
+                result[name] = thumbnail
+    files = {
+        name: _thumbnail_file(name, size, options)
+        for name in names if name not in result
+    }
+    found = _lookup(files.values()) if files else {}
+    for name, file in files.items():
+        thumbnail = found.get(file.name)
+        if thumbnail is None:
+            thumbnail = get_thumbnail(name, size, **options)
+        result[name] = thumbnail
+    with _memo_lock:
+        for name in files:
+            _memo[name, memo_key] = result[name]
+        while len(_memo) > MEMO_SIZE:
+            _memo.popitem(last=False)
+    return result
+
+
+def forget(name):
+    """Забывает миниатюры картинки, например после её замены."""
+    with _memo_lock:
+        for key in [key for key in _memo if key[0] == name]:
+            del _memo[key]
@@ -0,0 +1,239 @@
+"""Материализованная лента подписок (fan-out on write).
+
+Новый пост сразу раскладывается по лентам подписчиков автора, и
+страница ленты — чтение индекса (user, pub_date, post) своих записей.
+Посты авторов с огромным числом подписчиков не раскладываются: лента
+подмешивает их при чтении. Когда у такого автора подписчиков снова
+становится меньше порога, его посты после коммита отписки
+раскладываются по лентам всех подписчиков (backfill_author), иначе они
+пропали бы из лент. После изменения POSTS_FANOUT_MAX_FOLLOWERS ленты
+пересобирает команда rebuild_timeline.
+"""
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Q
+
+from . import counters, high_water
+from .models import Counter, Follow, Post, TimelineEntry
+from .utils import CursorPaginator, seek
+
+CELEBRITIES_CACHE_KEY = 'timeline:celebrities'
+CELEBRITIES_CACHE_TIMEOUT = 300
+BATCH_SIZE = 1000
+
+
+def celebrity_ids():
+    """Авторы, чьи посты не раскладываются по лентам подписчиков."""
+    ids = cache.get(CELEBRITIES_CACHE_KEY)
+    if ids is None:
+        ids = set(
+            Counter.objects.filter(
+                kind=Counter.USER_FOLLOWERS,
+                value__gt=settings.POSTS_FANOUT_MAX_FOLLOWERS,
+            ).values_list('object_id', flat=True)
+        )
+        cache.set(CELEBRITIES_CACHE_KEY, ids, CELEBRITIES_CACHE_TIMEOUT)
+    return ids
+
+
+def fan_out(post):
+    """Добавляет новый пост в ленты подписчиков автора."""
+    limit = settings.POSTS_FANOUT_MAX_FOLLOWERS
+    follower_ids = list(
+        Follow.objects.filter(author_id=post.author_id).values_list(
+            'user_id', flat=True
+        )[:limit + 1]
+    )
+    if len(follower_ids) > limit:
+        if post.author_id not in celebrity_ids():
+            cache.delete(CELEBRITIES_CACHE_KEY)
+        return
+    TimelineEntry.objects.bulk_create(
+        [
+            TimelineEntry(user_id=user_id, post=post, pub_date=post.pub_date)
+            for user_id in follower_ids
+        ],
+        batch_size=BATCH_SIZE,
+        ignore_conflicts=True,
+    )
+    high_water.forget(
+        [high_water.follow(user_id) for user_id in follower_ids]
+    )
+
+
+def add_author(user_id, author_id):
+    """Заполняет ленту пользователя постами нового автора подписки."""
+    if author_id in celebrity_ids():
+        return
+    posts = Post.objects.filter(author_id=author_id).values_list(
+        'id', 'pub_date'
+    ).order_by()
+    batch = []
+    for post_id, pub_date in posts.iterator(chunk_size=BATCH_SIZE):
+        batch.append(
+            TimelineEntry(user_id=user_id, post_id=post_id, pub_date=pub_date)
+        )
+        if len(batch) >= BATCH_SIZE:
+            TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    TimelineEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def remove_author(user_id, author_id):
+    """Убирает из ленты пользователя посты автора, от которого он отписался."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def rebuild(user_id):
+    """Пересобирает ленту пользователя по его текущим подпискам."""
+    TimelineEntry.objects.filter(user_id=user_id).delete()
+    author_ids = Follow.objects.filter(user_id=user_id).values_list(
+        'author_id', flat=True
+    )
+    for author_id in author_ids:
+        add_author(user_id, author_id)
+
+
+def followed_celebrities(user):
+    """Знаменитости, на которых подписан пользователь."""
+    celebrities = celebrity_ids()
+    if not celebrities:
+        return []
+    return list(
+        Follow.objects.filter(
+            user=user, author_id__in=celebrities
+        ).values_list('author_id', flat=True)
+    )
+
+
+def follow_high_water(user):
+    """Ленты high_water, по которым видно новое в ленте подписок."""
+    return [high_water.follow(user.pk)] + [
+        high_water.author(author_id)
+        for author_id in followed_celebrities(user)
+    ]
+
+
+def follow_feed(user):
+    """Посты ленты подписок: свои записи ленты плюс посты знаменитостей."""
+    followed = followed_celebrities(user)
+    if not followed:
+        return Post.objects.filter(timeline_entries__user=user)
+    return Post.objects.filter(
+        Q(id__in=TimelineEntry.objects.filter(user=user).values('post_id'))
+        | Q(author_id__in=followed)
+    )
+
+
+class FollowFeedPaginator(CursorPaginator):
+    """Лента подписок по курсору.
+
+    Ключи (pub_date, id) страницы читаются из индекса записей ленты
+    пользователя и, если он подписан на знаменитостей, из индекса их
+    постов; сами посты страницы — одним запросом по id из object_list.
+    """
+
+    def __init__(self, object_list, per_page, cursor=None, *, user):
+        super().__init__(object_list, per_page, cursor)
+        self.user = user
+        self.celebrities = None
+
+    def _fetch(self, position, newer, limit):
+        keys = list(
+            seek(
+                TimelineEntry.objects.filter(user=self.user),
+                position, newer, key=('pub_date', 'post_id'),
+            ).values_list('pub_date', 'post_id')[:limit]
+        )
+        if self.celebrities is None:
+            self.celebrities = followed_celebrities(self.user)
+        if self.celebrities:
+            # Пост, разложенный до того, как автор стал знаменитостью,
+            # найдётся в обоих источниках.
+            keys = sorted(
+                {*keys, *seek(
+                    Post.objects.filter(author_id__in=self.celebrities),
+                    position, newer,
+                ).values_list('pub_date', 'id')[:limit]},
+                reverse=not newer,
+            )[:limit]
+        ids = [pk for _, pk in keys]
+        posts = {
+            item['id'] if isinstance(item, dict) else item.pk: item
+            for item in self.object_list.filter(id__in=ids)
+        }
+        return [posts[pk] for pk in ids if pk in posts]
+
+
+def backfill_author(author_id):
+    """Раскладывает все посты автора по лентам всех его подписчиков.
+
+    Посты идут пачками по BATCH_SIZE в порядке id, и каждая пачка — свой
+    короткий INSERT ... SELECT: запись в ленты не держит одну долгую
+    транзакцию на всё число постов автора.
+    """
+    quote = connection.ops.quote_name
+    entry = TimelineEntry._meta
+    sql = (
+        '{insert} {table} ({user}, {post}, {date}) '
+        'SELECT f.{follow_user}, p.{id}, p.{date} '
+        'FROM {follows} f INNER JOIN {posts} p '
+        'ON p.{author} = f.{follow_author} '
+        'WHERE f.{follow_author} = %s AND p.{id} > %s{until} {suffix}'
+    )
+    names = dict(
+        insert=connection.ops.insert_statement(ignore_conflicts=True),
+        table=quote(entry.db_table),
+        user=quote(entry.get_field('user').column),
+        post=quote(entry.get_field('post').column),
+        date=quote('pub_date'),
+        follow_user=quote(Follow._meta.get_field('user').column),
+        follow_author=quote(Follow._meta.get_field('author').column),
+        id=quote('id'),
+        follows=quote(Follow._meta.db_table),
+        posts=quote(Post._meta.db_table),
+        author=quote(Post._meta.get_field('author').column),
+        suffix=connection.ops.ignore_conflicts_suffix_sql(
+            ignore_conflicts=True
+        ),
+    )
+    post_ids = Post.objects.filter(author_id=author_id).order_by(
+        'id'
+    ).values_list('id', flat=True)
+    after = 0
+    while after is not None:
+        bound = list(post_ids.filter(id__gt=after)[
+            BATCH_SIZE - 1:BATCH_SIZE
+        ])
+        params = [author_id, after]
+        until = ''
+        if bound:
+            until = ' AND p.{} <= %s'.format(quote('id'))
+            params.append(bound[0])
+        with connection.cursor() as cursor:
+            cursor.execute(sql.format(until=until, **names), params)
+        after = bound[0] if bound else None
+
+
+def follower_removed(author_id):
+    """После отписки: автор, переставший быть знаменитостью, получает
+    в ленты подписчиков посты, которые при публикации не разложились.
+
+    Раскладка идёт после коммита отписки, а не в её транзакции. Пока
+    она не закончена, список знаменитостей в кэше ещё содержит автора,
+    и ленты подмешивают его посты при чтении.
+    """
+    followers = counters.get(Counter.USER_FOLLOWERS, author_id)
+    if followers == settings.POSTS_FANOUT_MAX_FOLLOWERS:
+        transaction.on_commit(lambda: _left_celebrities(author_id))
+
+
+def _left_celebrities(author_id):
+    backfill_author(author_id)
+    cache.delete(CELEBRITIES_CACHE_KEY)
+    high_water.forget(users=Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True))
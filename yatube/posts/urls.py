@@ -1,19 +1,74 @@
 from django.urls import path
 
-from . import views
+from . import api, events, feeds, views
 
 app_name = 'posts'
 
 urlpatterns = [
     path('', views.index, name='index'),
+    path('rss/', feeds.index_rss, name='index_rss'),
+    path('atom/', feeds.index_atom, name='index_atom'),
     path('group/<slug:slug>/', views.group_posts, name='group_list'),
+    path('group/<slug:slug>/rss/', feeds.group_rss, name='group_rss'),
+    path('group/<slug:slug>/atom/', feeds.group_atom, name='group_atom'),
     path('profile/<str:username>/', views.profile, name='profile'),
+    path(
+        'profile/<str:username>/rss/', feeds.profile_rss, name='profile_rss'
+    ),
+    path(
+        'profile/<str:username>/atom/',
+        feeds.profile_atom,
+        name='profile_atom'
+    ),
     path('posts/<int:post_id>/', views.post_detail, name='post_detail'),
+    path(
+        'posts/<int:post_id>/comments/',
+        views.post_comments,
+        name='post_comments'
+    ),
     path('create/', views.post_create, name='post_create'),
     path('posts/<int:post_id>/edit/', views.post_edit, name='post_edit'),
     path(
         'posts/<int:post_id>/comment/', views.add_comment, name='add_comment'),
     path('follow/', views.follow_index, name='follow_index'),
+    path('search/', views.search_posts, name='search'),
+    path('groups/choices/', views.group_choices, name='group_choices'),
+    path('export/', views.export_data, name='export'),
+    path('api/posts/', api.api_index, name='api_index'),
+    path(
+        'api/posts/since/', api.api_index_since, name='api_index_since'
+    ),
+    path('api/follow/posts/', api.api_follow, name='api_follow'),
+    path(
+        'api/follow/posts/since/',
+        api.api_follow_since,
+        name='api_follow_since'
+    ),
+    path('api/groups/<slug:slug>/posts/', api.api_group, name='api_group'),
+    path(
+        'api/groups/<slug:slug>/posts/since/',
+        api.api_group_since,
+        name='api_group_since'
+    ),
+    path(
+        'api/profiles/<str:username>/posts/',
+        api.api_profile,
+        name='api_profile'
+    ),
+    path(
+        'events/posts/<int:post_id>/',
+        events.post_events,
+        name='post_events'
+    ),
+    path('events/follow/', events.follow_events, name='follow_events'),
+    path(
+        'events/group/<slug:slug>/', events.group_events, name='group_events'
+    ),
+    path(
+        'events/profile/<str:username>/',
+        events.profile_events,
+        name='profile_events'
+    ),
     path(
         'profile/<str:username>/follow/',
         views.profile_follow,
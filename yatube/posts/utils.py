@@ -1,7 +1,178 @@
-from django.core.paginator import Paginator
+import base64
+import binascii
+import json
 
+from django.conf import settings
+from django.core.paginator import Page, Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import cached_property
 
-def paginator(request, posts, amount_of_page):
+
+def encode_cursor(post, backwards=False):
+    """Кодирует позицию поста в ленте в непрозрачный токен.
+
+    post — пост или строка values() с ключами pub_date и id.
+    """
+    if isinstance(post, dict):
+        pub_date, pk = post['pub_date'], post['id']
+    else:
+        pub_date, pk = post.pub_date, post.pk
+    payload = json.dumps([pub_date.isoformat(), pk, int(backwards)])
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Возвращает (pub_date, id, backwards) или None для битого токена."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        pub_date, pk, backwards = json.loads(base64.urlsafe_b64decode(padded))
+        pub_date = parse_datetime(pub_date)
+    except (ValueError, TypeError, binascii.Error):
+        return None
+    if pub_date is None or not isinstance(pk, int):
+        return None
+    return pub_date, pk, bool(backwards)
+
+
+def seek(queryset, position, newer, key=('pub_date', 'id')):
+    """queryset, упорядоченный по key от позиции (pub_date, id) или от
+    начала: по возрастанию (newer) или по убыванию."""
+    date_field, id_field = key
+    if newer:
+        ordered = queryset.order_by(date_field, id_field)
+    else:
+        ordered = queryset.order_by(f'-{date_field}', f'-{id_field}')
+    if position is None:
+        return ordered
+    pub_date, pk = position
+    after = 'gt' if newer else 'lt'
+    # Условие на одну дату даёт индексу (дата, id) начать чтение сразу с
+    # позиции, а не фильтровать всё до неё.
+    return ordered.filter(
+        Q(**{f'{date_field}__{after}': pub_date})
+        | Q(**{date_field: pub_date, f'{id_field}__{after}': pk}),
+        **{f'{date_field}__{after}e': pub_date},
+    )
+
+
+class CursorPaginator(Paginator):
+    """Постраничный вывод по ключу (pub_date, id) без COUNT и OFFSET.
+
+    Каждая страница выбирается одним запросом с условием по ключу
+    последнего показанного поста, поэтому глубина прокрутки не влияет
+    на стоимость запроса, а новые посты не сдвигают уже открытые страницы.
+    С oldest_first страницы идут от старых записей к новым.
+    """
+    cursor_mode = True
+
+    def __init__(self, object_list, per_page, cursor=None,
+                 oldest_first=False):
+        super().__init__(object_list, per_page)
+        self.cursor = cursor
+        self.oldest_first = oldest_first
+        self.next_cursor = None
+        self.previous_cursor = None
+
+    @property
+    def num_pages(self):
+        # Общее число страниц неизвестно без COUNT: страница всегда
+        # первая, а следующая есть, если есть курсор вперёд.
+        return 2 if self.next_cursor else 1
+
+    def page(self, number=1):
+        position = decode_cursor(self.cursor) if self.cursor else None
+        if position is None:
+            return self._first_page()
+        pub_date, pk, backwards = position
+        if backwards:
+            return self._page_before(pub_date, pk)
+        return self._page_after(pub_date, pk)
+
+    def _first_page(self):
+        items, has_next = self._slice(None, newer=self.oldest_first)
+        return self._build_page(items, has_previous=False, has_next=has_next)
+
+    def _page_after(self, pub_date, pk):
+        items, has_next = self._slice(
+            (pub_date, pk), newer=self.oldest_first
+        )
+        return self._build_page(items, has_previous=True, has_next=has_next)
+
+    def _page_before(self, pub_date, pk):
+        items, has_previous = self._slice(
+            (pub_date, pk), newer=not self.oldest_first
+        )
+        if not has_previous:
+            # Дошли до начала ленты: отдаём полную первую страницу.
+            return self._first_page()
+        items.reverse()
+        return self._build_page(items, has_previous=True, has_next=True)
+
+    def _fetch(self, position, newer, limit):
+        """Первые limit записей за позицией (или от начала, если её нет)
+        в порядке чтения: от старых к новым (newer) или наоборот."""
+        return list(seek(self.object_list, position, newer)[:limit])
+
+    def _slice(self, position, newer):
+        items = self._fetch(position, newer, self.per_page + 1)
+        return items[:self.per_page], len(items) > self.per_page
+
+    def _build_page(self, items, has_previous, has_next):
+        if items and has_next:
+            self.next_cursor = encode_cursor(items[-1])
+        if items and has_previous:
+            self.previous_cursor = encode_cursor(items[0], backwards=True)
+        return Page(items, 1, self)
+
+
+def estimate_count(model, using='default'):
+    """Примерное число строк таблицы без COUNT(*) или None.
+
+    PostgreSQL хранит оценку в статистике таблицы, в SQLite верхняя
+    граница — наибольший rowid, который читается из индекса.
+    """
+    connection = connections[using]
+    table = connection.ops.quote_name(model._meta.db_table)
+    if connection.vendor == 'postgresql':
+        sql = 'SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass'
+        params = [table]
+    elif connection.vendor == 'sqlite':
+        sql, params = f'SELECT MAX(rowid) FROM {table}', []
+    else:
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return max(row[0] or 0, 0) if row else None
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator, который не считает строки большой таблицы целиком.
+
+    Для queryset без условий берётся оценка из estimate_count, если она
+    больше POSTS_ADMIN_ESTIMATE_COUNT_FROM. Отфильтрованные списки и
+    небольшие таблицы считаются точно.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if not queryset.query.where:
+            estimate = estimate_count(queryset.model, queryset.db)
+            if (estimate is not None
+                    and estimate > settings.POSTS_ADMIN_ESTIMATE_COUNT_FROM):
+                return estimate
+        return queryset.count()
+
+
+def paginator(request, posts, amount_of_page, cursor=False,
+              cursor_class=CursorPaginator):
+    if cursor and 'page' not in request.GET:
+        return cursor_class(
+            posts, amount_of_page, request.GET.get('cursor')
+        ).page()
     paginator = Paginator(posts, amount_of_page)
     page_number = request.GET.get('page')
     return (paginator.get_page(page_number))
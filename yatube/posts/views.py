@@ -1,31 +1,49 @@
+from functools import partial
+from urllib.parse import urlencode
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
-from django.views.decorators.cache import cache_page
+from django.views.decorators.http import condition, require_GET
+
+from core.decorators import query_budget
 
+from . import (choices, comments, counters, export, queries, search,
+               thumbnails, timeline)
+from .cache import (AUTHORS, GROUPS, INDEX, cache_page_by_generation,
+                    card_keys, etag_by_generation, group_scope, page_etag,
+                    post_scope, profile_scope)
 from .forms import CommentForm, PostForm
-from .models import Comment, Follow, Group, Post
+from .models import Counter, Follow, Group, Post
 from .utils import paginator
 
 User = get_user_model()
 
-AMOUNT_OF_PAGE = 10
+AMOUNT_OF_PAGE = settings.MAX_NUMBER_OF_POSTS
 
 
-@cache_page(20, key_prefix='index_page')
+@etag_by_generation(lambda: [INDEX])
+@cache_page_by_generation(lambda: [INDEX])
+@query_budget(queries.INDEX_BUDGET, queries.BUDGET_IGNORED_TABLES)
 def index(request):
-    posts = Post.objects.all()
-    page_obj = paginator(request, posts, AMOUNT_OF_PAGE)
+    posts = queries.index_feed()
+    page_obj = paginator(request, posts, AMOUNT_OF_PAGE, cursor=True)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/index.html', context)
 
 
+@etag_by_generation(lambda slug: [group_scope(slug), AUTHORS])
+@cache_page_by_generation(lambda slug: [group_scope(slug), AUTHORS])
+@query_budget(queries.GROUP_BUDGET, queries.BUDGET_IGNORED_TABLES)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
-    page_obj = paginator(request, posts, AMOUNT_OF_PAGE)
+    posts = queries.group_feed(group)
+    page_obj = paginator(request, posts, AMOUNT_OF_PAGE, cursor=True)
     context = {
         'group': group,
         'page_obj': page_obj,
@@ -33,11 +51,20 @@ def group_posts(request, slug):
     return render(request, 'posts/group_list.html', context)
 
 
+@etag_by_generation(lambda username: [profile_scope(username), GROUPS])
+@cache_page_by_generation(
+    lambda username: [profile_scope(username), GROUPS]
+)
+@query_budget(queries.PROFILE_BUDGET, queries.BUDGET_IGNORED_TABLES)
 def profile(request, username):
     author = get_object_or_404(User, username=username)
-    author_posts = author.posts.all()
-    count_posts = author_posts.count()
-    page_obj = paginator(request, author_posts, AMOUNT_OF_PAGE)
+    author_posts = queries.profile_feed(author)
+    counts = counters.get_many([
+        (Counter.AUTHOR_POSTS, author.pk),
+        (Counter.USER_FOLLOWERS, author.pk),
+        (Counter.USER_FOLLOWING, author.pk),
+    ])
+    page_obj = paginator(request, author_posts, AMOUNT_OF_PAGE, cursor=True)
     following = request.user.is_authenticated and Follow.objects.filter(
         user=request.user,
         author=author
@@ -45,33 +72,103 @@ def profile(request, username):
     context = {
         'author': author,
         'page_obj': page_obj,
-        'count_posts': count_posts,
+        'count_posts': counts[Counter.AUTHOR_POSTS, author.pk],
+        'count_followers': counts[Counter.USER_FOLLOWERS, author.pk],
+        'count_following': counts[Counter.USER_FOLLOWING, author.pk],
         'following': following,
     }
     return render(request, 'posts/profile.html', context)
 
 
+def schedule_thumbnails(form):
+    """Заранее создаёт миниатюры загруженной картинки после коммита."""
+    if 'image' in form.changed_data and form.instance.image:
+        name = form.instance.image.name
+        transaction.on_commit(lambda: thumbnails.schedule(name))
+
+
+def post_scopes(post_id):
+    """Области страницы поста: пост, профиль автора, авторы комментариев
+    и группа."""
+    post = Post.objects.filter(pk=post_id).values(
+        'author__username', 'group__slug'
+    ).first()
+    if post is None:
+        return None
+    scopes = [
+        post_scope(post_id), profile_scope(post['author__username']), AUTHORS
+    ]
+    if post['group__slug']:
+        scopes.append(group_scope(post['group__slug']))
+    return scopes
+
+
+def follow_page(request):
+    """Страница ленты подписок; ETag и представление читают её из БД
+    один раз за запрос."""
+    if not hasattr(request, '_follow_page'):
+        request._follow_page = paginator(
+            request, queries.follow_feed(request.user), AMOUNT_OF_PAGE,
+            cursor=True,
+            cursor_class=partial(
+                timeline.FollowFeedPaginator, user=request.user
+            ),
+        )
+    return request._follow_page
+
+
+def follow_etag(request):
+    # Лента подписок своя у каждого: ETag строится по ключам карточек
+    # постов текущей страницы и по её ссылкам на соседние страницы.
+    page_obj = follow_page(request)
+    pages = page_obj.paginator
+    return page_etag(
+        request,
+        [],
+        *card_keys(page_obj),
+        str(pages.num_pages),
+        getattr(pages, 'next_cursor', None) or '',
+        getattr(pages, 'previous_cursor', None) or '',
+    )
+
+
+@etag_by_generation(post_scopes, csrf=True)
 def post_detail(request, post_id):
     post = get_object_or_404(Post, id=post_id)
-    count_posts = post.author.posts.count()
+    counts = counters.get_many([
+        (Counter.AUTHOR_POSTS, post.author_id),
+        (Counter.POST_COMMENTS, post.pk),
+    ])
     form = CommentForm(request.POST or None)
-    comments = Comment.objects.filter(post=post)
     context = {
         'post': post,
-        'count_posts': count_posts,
+        'count_posts': counts[Counter.AUTHOR_POSTS, post.author_id],
+        'count_comments': counts[Counter.POST_COMMENTS, post.pk],
         'form': form,
-        'comments': comments,
+        'comments': comments.render_page(post.pk),
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+@require_GET
+@etag_by_generation(post_scopes)
+def post_comments(request, post_id):
+    """Следующая страница комментариев поста фрагментом HTML."""
+    get_object_or_404(Post, id=post_id)
+    return HttpResponse(
+        comments.render_page(post_id, request.GET.get('cursor'))
+    )
+
+
 @login_required
+@transaction.atomic
 def post_create(request):
-    form = PostForm(request.POST or None)
+    form = PostForm(request.POST or None, files=request.FILES or None)
     if form.is_valid():
         new_post = form.save(commit=False)
         new_post.author = request.user
         new_post.save()
+        schedule_thumbnails(form)
         return redirect('posts:profile', request.user)
     context = {
         'form': form,
@@ -80,6 +177,7 @@ def post_create(request):
 
 
 @login_required
+@transaction.atomic
 def post_edit(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = PostForm(
@@ -91,6 +189,7 @@ def post_edit(request, post_id):
         return redirect('posts:post_detail', post_id)
     if form.is_valid():
         post.save()
+        schedule_thumbnails(form)
         return redirect('posts:post_detail', post_id)
     context = {
         'form': form,
@@ -100,6 +199,7 @@ def post_edit(request, post_id):
 
 
 @login_required
+@transaction.atomic
 def add_comment(request, post_id):
     post = get_object_or_404(Post, id=post_id)
     form = CommentForm(request.POST or None)
@@ -112,18 +212,57 @@ def add_comment(request, post_id):
 
 
 @login_required
+@condition(etag_func=follow_etag)
+@query_budget(queries.FOLLOW_BUDGET, queries.BUDGET_IGNORED_TABLES)
 def follow_index(request):
-    post_list = Post.objects.select_related('author', 'group',).filter(
-        author__following__user=request.user
-    )
-    page_obj = paginator(request, post_list, AMOUNT_OF_PAGE)
+    page_obj = follow_page(request)
     context = {
         'page_obj': page_obj,
     }
     return render(request, 'posts/follow.html', context)
 
 
+@query_budget(queries.SEARCH_BUDGET, queries.BUDGET_IGNORED_TABLES)
+def search_posts(request):
+    query = request.GET.get('q', '').strip()
+    page_obj = search.SearchPaginator(
+        query, AMOUNT_OF_PAGE, request.GET.get('cursor')
+    ).page()
+    context = {
+        'query': query,
+        'page_obj': page_obj,
+        'cursor_query': urlencode({'q': query}) + '&',
+    }
+    return render(request, 'posts/search.html', context)
+
+
+@etag_by_generation(lambda: [GROUPS])
+def group_choices(request):
+    """Группы для выбора в форме поста по мере ввода названия."""
+    page = request.GET.get('page', '')
+    found, more = choices.find(
+        request.GET.get('q', ''), int(page) if page.isdigit() else 1
+    )
+    return JsonResponse({
+        'results': [{'id': pk, 'text': title} for pk, title in found],
+        'more': more,
+    })
+
+
+@login_required
+def export_data(request):
+    """ZIP-архив с постами, комментариями, подписками и картинками."""
+    response = StreamingHttpResponse(
+        export.stream_archive(request.user), content_type='application/zip'
+    )
+    response['Content-Disposition'] = (
+        f'attachment; filename="yatube-{request.user.username}.zip"'
+    )
+    return response
+
+
 @login_required
+@transaction.atomic
 def profile_follow(request, username):
     author = get_object_or_404(User, username=username)
     if request.user != author and not Follow.objects.filter(
@@ -135,6 +274,7 @@ def profile_follow(request, username):
 
 
 @login_required
+@transaction.atomic
 def profile_unfollow(request, username):
     author = get_object_or_404(User, username=username)
     Follow.objects.filter(user=request.user, author=author).delete()
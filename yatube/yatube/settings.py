@@ -10,7 +10,11 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/2.2/ref/settings/
 """
 
+import atexit
 import os
+import shutil
+import sys
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -131,8 +135,54 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 STATIC_URL = '/static/'
 
+# Постов на странице ленты.
 MAX_NUMBER_OF_POSTS: int = 10
 
+# Авторы с большим числом подписчиков не раскладывают посты по лентам,
+# их посты подмешиваются в ленту подписок при чтении.
+POSTS_FANOUT_MAX_FOLLOWERS: int = 10000
+
+# Превышение бюджета запросов в представлениях лент — ошибка (в DEBUG и
+# тестах, где Django сбрасывает DEBUG, но эта настройка остаётся).
+ENFORCE_QUERY_BUDGETS: bool = DEBUG
+
+# Страницы лент сбрасываются сигналами записей, поэтому живут долго.
+POSTS_PAGE_CACHE_TIMEOUT: int = 60 * 60 * 4
+# Сколько ещё отдавать истёкшую страницу, пока её пересчитывает один воркер.
+POSTS_PAGE_CACHE_STALE_TIMEOUT: int = 60 * 10
+# Карточки постов сбрасываются сменой ключа, а не по времени.
+POSTS_CARD_CACHE_TIMEOUT: int = 60 * 60 * 24
+
+# Комментариев на странице поста и в каждой подгружаемой странице.
+POSTS_COMMENTS_PER_PAGE: int = 50
+# Сколько последних комментариев показывать в карточке поста ленты.
+POSTS_CARD_COMMENTS: int = 2
+
+# Пул процессов, заранее создающий миниатюры загруженных картинок
+# (0 — создавать в процессе запроса), и предел задач в его очереди.
+POSTS_THUMBNAIL_WORKERS: int = 2
+POSTS_THUMBNAIL_QUEUE: int = 100
+
+# С какого примерного числа строк список в админке не считает их точно.
+POSTS_ADMIN_ESTIMATE_COUNT_FROM: int = 100_000
+
+# Файлы кэша и журнала событий. Тесты (manage.py test и pytest) пишут
+# и очищают их, поэтому получают свой временный каталог.
+TESTING: bool = sys.argv[1:2] == ['test'] or 'pytest' in sys.modules
+if TESTING:
+    RUNTIME_DIR = tempfile.mkdtemp(prefix='yatube-test-')
+    atexit.register(shutil.rmtree, RUNTIME_DIR, ignore_errors=True)
+else:
+    RUNTIME_DIR = BASE_DIR
+
+# События SSE: журнал, через который их получают все воркеры (None —
+# только внутри процесса), предел соединений на процесс, очередь
+# событий соединения и интервал пустых сообщений в секундах.
+EVENTS_LOG_PATH = os.path.join(RUNTIME_DIR, 'events.sqlite3')
+EVENTS_MAX_CONNECTIONS: int = 100
+EVENTS_QUEUE_SIZE: int = 50
+EVENTS_HEARTBEAT: int = 15
+
 LOGIN_URL = 'users:login'
 
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -148,8 +198,34 @@ CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Загруженные файлы называются хэшем содержимого: одинаковые картинки
+# хранятся один раз, а их адреса не меняются. Миниатюры sorl сами
+# выбирают имена и хранятся как обычно.
+DEFAULT_FILE_STORAGE = 'core.storage.ContentAddressedStorage'
+THUMBNAIL_STORAGE = 'django.core.files.storage.FileSystemStorage'
+
+# Загружаемые файлы пишутся сразу во временный файл на диске.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+# Картинки постов: предел размера загрузки и разрешения до
+# декодирования, предел стороны и размера сохранённого файла.
+POSTS_IMAGE_MAX_UPLOAD_SIZE: int = 20 * 1024 * 1024
+POSTS_IMAGE_MAX_PIXELS: int = 50_000_000
+POSTS_IMAGE_MAX_SIDE: int = 1920
+POSTS_IMAGE_MAX_BYTES: int = 1024 * 1024
+
+# Общий для всех воркеров кэш — файл SQLite в режиме WAL, перед ним
+# LRU в памяти каждого процесса для крупных значений.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.caches.tiered.TieredCache',
+        'LOCATION': 'default',
+        'OPTIONS': {'L2': 'shared', 'MAX_BYTES': 32 * 1024 * 1024},
+    },
+    'shared': {
+        'BACKEND': 'core.caches.sqlite.SQLiteCache',
+        'LOCATION': os.path.join(RUNTIME_DIR, 'cache.sqlite3'),
+        'OPTIONS': {'MAX_BYTES': 256 * 1024 * 1024},
     }
 }
@@ -3,6 +3,8 @@ from django.conf.urls.static import static
 from django.contrib import admin
 from django.urls import include, path
 
+from core.views import serve_media
+
 urlpatterns = [
     path('', include('posts.urls', namespace='posts')),
     path('group/<slug:slug>/', include('posts.urls')),
@@ -11,6 +13,7 @@ urlpatterns = [
     path('auth/', include('django.contrib.auth.urls')),
     path('about/', include('about.urls', namespace='about')),
     path('users/', include('users.urls', namespace='users')),
+    path('core/', include('core.urls', namespace='core')),
 ]
 
 handler404 = 'core.views.page_not_found'
@@ -19,5 +22,6 @@ handler500 = 'core.views.internal_server_error'
 
 if settings.DEBUG:
     urlpatterns += static(
-        settings.MEDIA_URL, document_root=settings.MEDIA_ROOT
+        settings.MEDIA_URL, view=serve_media,
+        document_root=settings.MEDIA_ROOT,
     )